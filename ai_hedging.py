@@ -0,0 +1,192 @@
+"""
+Módulo de Requisições Paralelas com Hedging
+Dispara o modelo mais rápido e, se ele demorar além do p95 observado,
+dispara o próximo em paralelo; vence a primeira resposta válida
+"""
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from config import Config
+from circuit_breaker import CircuitoAberto
+from cancelamento import GeracaoCancelada, TokenCancelamento
+
+logger = logging.getLogger(__name__)
+
+
+class LatenciaModelo:
+    """Latência recente de um modelo (EWMA + janela para o p95)"""
+
+    def __init__(self):
+        self.ewma: Optional[float] = None
+        self.amostras = deque(maxlen=Config.IA_HEDGE_JANELA)
+        self.sucessos = 0
+        self.falhas = 0
+        self.vitorias = 0
+
+    def registrar(self, segundos: float) -> None:
+        alfa = Config.IA_EWMA_ALPHA
+        self.ewma = segundos if self.ewma is None else alfa * segundos + (1 - alfa) * self.ewma
+        self.amostras.append(segundos)
+
+    def p95(self) -> Optional[float]:
+        if not self.amostras:
+            return None
+        ordenadas = sorted(self.amostras)
+        return ordenadas[min(len(ordenadas) - 1, int(len(ordenadas) * 0.95))]
+
+
+class ExecutorHedging:
+    """Executa a mesma chamada em vários modelos com disparos escalonados"""
+
+    def __init__(self, max_workers: int = Config.IA_HEDGE_WORKERS):
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="bopm-hedge")
+        self._lock = threading.RLock()
+        self._modelos: Dict[str, LatenciaModelo] = {}
+        self.hedges_disparados = 0
+
+    def _latencia(self, modelo: str) -> LatenciaModelo:
+        with self._lock:
+            return self._modelos.setdefault(modelo, LatenciaModelo())
+
+    def ordenar(self, modelos: Sequence[str]) -> List[str]:
+        """
+        Ordena os modelos pela latência média; modelos ainda sem medição
+        contam com o atraso padrão e mantêm a ordem da configuração
+        """
+        def chave(modelo: str) -> float:
+            ewma = self._latencia(modelo).ewma
+            return ewma if ewma is not None else Config.IA_HEDGE_DELAY_S
+        return sorted(modelos, key=chave)
+
+    def atraso_hedge(self, modelo: str) -> float:
+        """Tempo de espera pelo modelo antes de disparar o próximo (p95 limitado)"""
+        p95 = self._latencia(modelo).p95()
+        if p95 is None:
+            return Config.IA_HEDGE_DELAY_S
+        return min(max(p95, Config.IA_HEDGE_MIN_DELAY_S), Config.IA_HEDGE_MAX_DELAY_S)
+
+    def registrar_chamada(self, modelo: str, segundos: float, sucesso: bool, erro: bool = False) -> None:
+        """
+        Registra a duração de uma chamada feita fora do executor (ex.: streaming)
+
+        Args:
+            modelo: Modelo chamado
+            segundos: Duração total da chamada
+            sucesso: Se a chamada produziu texto
+            erro: Se a chamada terminou em exceção
+        """
+        latencia = self._latencia(modelo)
+        if erro:
+            # Falhas pesam como resposta lenta para empurrar o modelo para o fim da fila
+            segundos = max(segundos, Config.IA_HEDGE_MAX_DELAY_S)
+        with self._lock:
+            latencia.registrar(segundos)
+            if sucesso:
+                latencia.sucessos += 1
+            else:
+                latencia.falhas += 1
+
+    def _executar_medindo(self, funcao: Callable[[str], Optional[str]], modelo: str) -> Optional[str]:
+        inicio = time.perf_counter()
+        try:
+            resultado = funcao(modelo)
+        except (CircuitoAberto, GeracaoCancelada):
+            # Recusa local, sem chamada à API: não entra na medição de latência
+            return None
+        except Exception as e:
+            self.registrar_chamada(modelo, time.perf_counter() - inicio, False, erro=True)
+            logger.warning(f"Falha com modelo {modelo}: {str(e)}")
+            return None
+        self.registrar_chamada(modelo, time.perf_counter() - inicio, bool(resultado))
+        return resultado
+
+    def executar(self, funcao: Callable[[str], Optional[str]],
+                 modelos: Sequence[str],
+                 cancelamento: Optional[TokenCancelamento] = None) -> Tuple[Optional[str], Optional[str]]:
+        """
+        Executa funcao(modelo) com hedging entre os modelos
+
+        Args:
+            funcao: Chamada ao modelo; retorna o texto ou levanta exceção
+            modelos: Modelos candidatos
+            cancelamento: Token verificado enquanto aguarda; ao cancelar, a
+                espera termina na hora e as chamadas em voo são abandonadas
+                (terminam pelo timeout da própria tentativa)
+
+        Returns:
+            Tupla (texto, modelo vencedor) ou (None, None) se todos falharem
+
+        Raises:
+            GeracaoCancelada: Se o token for cancelado ou o prazo expirar
+        """
+        fila = self.ordenar(modelos)
+        em_voo: Dict[Future, str] = {}
+        ultimo = None
+        proximo_hedge: Optional[float] = None
+
+        def disparar() -> None:
+            nonlocal ultimo, proximo_hedge
+            ultimo = fila.pop(0)
+            logger.info(f"Tentando modelo: {ultimo}")
+            em_voo[self._pool.submit(self._executar_medindo, funcao, ultimo)] = ultimo
+            proximo_hedge = time.monotonic() + self.atraso_hedge(ultimo) if fila else None
+
+        disparar()
+        while em_voo:
+            if cancelamento is not None and cancelamento.cancelado:
+                for pendente in em_voo:
+                    pendente.cancel()
+                cancelamento.verificar()
+
+            espera = None if proximo_hedge is None else max(0.0, proximo_hedge - time.monotonic())
+            if cancelamento is not None:
+                espera = Config.IA_CANCELAMENTO_POLL_S if espera is None else min(espera, Config.IA_CANCELAMENTO_POLL_S)
+            concluidos, _ = wait(list(em_voo), timeout=espera, return_when=FIRST_COMPLETED)
+
+            if not concluidos:
+                if proximo_hedge is not None and time.monotonic() >= proximo_hedge:
+                    # Modelo atual passou do p95: dispara o próximo em paralelo
+                    with self._lock:
+                        self.hedges_disparados += 1
+                    logger.info(f"{ultimo} acima de {self.atraso_hedge(ultimo):.1f}s: disparando hedge")
+                    disparar()
+                continue
+
+            for futuro in concluidos:
+                modelo = em_voo.pop(futuro)
+                texto = futuro.result()
+                if texto:
+                    # Descarta as demais: as que ainda não começaram são canceladas
+                    for pendente in em_voo:
+                        pendente.cancel()
+                    with self._lock:
+                        self._latencia(modelo).vitorias += 1
+                    return texto, modelo
+
+            # Falha: tenta o próximo sem esperar o atraso
+            if fila:
+                disparar()
+
+        return None, None
+
+    def estatisticas(self) -> Dict:
+        """Latência e resultados por modelo"""
+        with self._lock:
+            modelos = {
+                modelo: {
+                    "ewma_ms": round(latencia.ewma * 1000) if latencia.ewma is not None else None,
+                    "p95_ms": round(latencia.p95() * 1000) if latencia.amostras else None,
+                    "sucessos": latencia.sucessos,
+                    "falhas": latencia.falhas,
+                    "vitorias": latencia.vitorias,
+                }
+                for modelo, latencia in self._modelos.items()
+            }
+            return {"hedges_disparados": self.hedges_disparados, "modelos": modelos}
+
+    def encerrar(self) -> None:
+        self._pool.shutdown(wait=False, cancel_futures=True)
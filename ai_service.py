@@ -2,14 +2,26 @@
 Módulo de Serviço de IA (Google Gemini)
 Gerencia processamento de texto com sistema de cache
 """
+import asyncio
 import hashlib
+import json
 import logging
-from typing import Optional, Dict
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
+from typing import Callable, Iterable, List, Optional, Dict, Tuple
 from collections import OrderedDict
 from google import genai
 from google.genai import types
 
 from config import Config
+from cache_persistente import CachePersistente
+from cache_compartilhado import CacheCompartilhado, extrair_relato
+from ai_hedging import ExecutorHedging
+from circuit_breaker import CircuitoAberto, GerenciadorDisjuntores
+from limitador_taxa import LimitadorTaxa, estimar_tokens
+from cancelamento import GeracaoCancelada, TokenCancelamento
+from segmentacao import dividir_em_segmentos, juntar_segmentos
 
 logger = logging.getLogger(__name__)
 
@@ -19,14 +31,75 @@ class AIServiceError(Exception):
     pass
 
 
+class FrequenciaTinyLFU:
+    """
+    Estimador de frequência aproximada (Count-Min Sketch com contadores de 4 bits)
+    usado como filtro de admissão. Os contadores são reduzidos à metade
+    periodicamente, para que a popularidade antiga envelheça.
+    """
+    
+    PROFUNDIDADE = 4
+    MAX_CONTADOR = 15
+    
+    def __init__(self, largura: int = Config.CACHE_SKETCH_WIDTH):
+        # Largura potência de 2 para usar máscara em vez de módulo
+        self.largura = 1 << max(4, (largura - 1).bit_length())
+        self.mascara = self.largura - 1
+        self.linhas = [bytearray(self.largura) for _ in range(self.PROFUNDIDADE)]
+        self.amostras = 0
+        self.limite_amostras = self.largura * 10
+    
+    def _indices(self, key: str):
+        h = hash(key) & 0xFFFFFFFFFFFFFFFF
+        for i in range(self.PROFUNDIDADE):
+            h = (h * 0x9E3779B97F4A7C15 + i) & 0xFFFFFFFFFFFFFFFF
+            yield i, (h >> 17) & self.mascara
+    
+    def registrar(self, key: str) -> None:
+        """Conta um acesso à chave"""
+        for linha, indice in self._indices(key):
+            if self.linhas[linha][indice] < self.MAX_CONTADOR:
+                self.linhas[linha][indice] += 1
+        self.amostras += 1
+        if self.amostras >= self.limite_amostras:
+            self._envelhecer()
+    
+    def frequencia(self, key: str) -> int:
+        """Estimativa (por cima) do número de acessos recentes"""
+        return min(self.linhas[linha][indice] for linha, indice in self._indices(key))
+    
+    def _envelhecer(self) -> None:
+        for linha in self.linhas:
+            for i in range(self.largura):
+                linha[i] >>= 1
+        self.amostras //= 2
+
+
 class LRUCache:
-    """Cache LRU (Least Recently Used) simples para resultados da IA"""
+    """
+    Cache LRU limitado por bytes para resultados da IA, com filtro de
+    admissão TinyLFU: um item novo só desaloja itens que foram acessados
+    com menos frequência que ele, evitando que rajadas de rascunhos
+    únicos expulsem os textos mais usados. Seguro para uso entre threads.
+    """
     
-    def __init__(self, max_size: int = Config.CACHE_MAX_SIZE):
+    # Custo fixo aproximado por entrada (chave, nó do OrderedDict, objeto str)
+    OVERHEAD_ENTRADA = 120
+    
+    def __init__(self, max_bytes: int = Config.CACHE_MAX_BYTES):
         self.cache: OrderedDict = OrderedDict()
-        self.max_size = max_size
+        self.tamanhos: Dict[str, int] = {}
+        self.max_bytes = max_bytes
+        self.bytes_usados = 0
+        self.frequencias = FrequenciaTinyLFU()
         self.hits = 0
         self.misses = 0
+        self.evictions: Dict[str, int] = {"capacidade": 0, "limpeza": 0}
+        self.rejeitados = 0
+        self._lock = threading.RLock()
+    
+    def _custo(self, key: str, value: str) -> int:
+        return len(value.encode('utf-8')) + len(key) + self.OVERHEAD_ENTRADA
     
     def get(self, key: str) -> Optional[str]:
         """
@@ -38,41 +111,93 @@ class LRUCache:
         Returns:
             Valor ou None se não encontrado
         """
-        if key in self.cache:
-            self.hits += 1
-            # Move para o final (mais recente)
-            self.cache.move_to_end(key)
-            logger.debug(f"Cache HIT (taxa: {self.taxa_acerto():.1f}%)")
-            return self.cache[key]
-        
-        self.misses += 1
-        logger.debug(f"Cache MISS (taxa: {self.taxa_acerto():.1f}%)")
-        return None
+        with self._lock:
+            self.frequencias.registrar(key)
+            if key in self.cache:
+                self.hits += 1
+                # Move para o final (mais recente)
+                self.cache.move_to_end(key)
+                logger.debug(f"Cache HIT (taxa: {self.taxa_acerto():.1f}%)")
+                return self.cache[key]
+            
+            self.misses += 1
+            logger.debug(f"Cache MISS (taxa: {self.taxa_acerto():.1f}%)")
+            return None
     
-    def put(self, key: str, value: str) -> None:
+    def peek(self, key: str) -> Optional[str]:
+        """Consulta sem afetar recência, frequência ou estatísticas"""
+        with self._lock:
+            return self.cache.get(key)
+    
+    def put(self, key: str, value: str) -> bool:
         """
-        Armazena valor no cache
+        Armazena valor no cache, sujeito ao orçamento de bytes e ao filtro de admissão
         
         Args:
             key: Chave
             value: Valor a armazenar
+            
+        Returns:
+            True se o valor foi admitido
         """
-        if key in self.cache:
-            self.cache.move_to_end(key)
-        else:
-            self.cache[key] = value
+        with self._lock:
+            custo = self._custo(key, value)
+            if custo > self.max_bytes:
+                self.rejeitados += 1
+                return False
+            
+            if key in self.cache:
+                self.bytes_usados += custo - self.tamanhos[key]
+                self.cache[key] = value
+                self.tamanhos[key] = custo
+                self.cache.move_to_end(key)
+                self._remover_excedente()
+                return True
+            
+            # Seleciona as vítimas (menos recentes) necessárias para abrir espaço
+            vitimas = []
+            liberados = 0
+            for antiga in self.cache:
+                if self.bytes_usados - liberados + custo <= self.max_bytes:
+                    break
+                vitimas.append(antiga)
+                liberados += self.tamanhos[antiga]
+            
+            # TinyLFU: só admite se for mais popular que todas as vítimas
+            if vitimas:
+                frequencia = self.frequencias.frequencia(key)
+                if any(self.frequencias.frequencia(v) >= frequencia for v in vitimas):
+                    self.rejeitados += 1
+                    logger.debug("Cache ADMISSÃO rejeitada: vítimas mais frequentes")
+                    return False
+                for vitima in vitimas:
+                    self._remover(vitima)
+                    self.evictions["capacidade"] += 1
+                logger.debug(f"Cache EVICTION: {len(vitimas)} itens removidos por capacidade")
             
-            # Remove o item mais antigo se exceder tamanho máximo
-            if len(self.cache) > self.max_size:
-                oldest_key = next(iter(self.cache))
-                removed = self.cache.pop(oldest_key)
-                logger.debug(f"Cache EVICTION: removido item mais antigo")
+            self.cache[key] = value
+            self.tamanhos[key] = custo
+            self.bytes_usados += custo
+            return True
+    
+    def _remover(self, key: str) -> None:
+        self.cache.pop(key)
+        self.bytes_usados -= self.tamanhos.pop(key)
+    
+    def _remover_excedente(self) -> None:
+        while self.bytes_usados > self.max_bytes and self.cache:
+            self._remover(next(iter(self.cache)))
+            self.evictions["capacidade"] += 1
     
     def clear(self) -> None:
         """Limpa o cache"""
-        self.cache.clear()
-        self.hits = 0
-        self.misses = 0
+        with self._lock:
+            self.evictions["limpeza"] += len(self.cache)
+            self.cache.clear()
+            self.tamanhos.clear()
+            self.bytes_usados = 0
+            self.hits = 0
+            self.misses = 0
         logger.info("Cache limpo")
     
     def taxa_acerto(self) -> float:
@@ -83,26 +208,59 @@ class LRUCache:
         return (self.hits / total) * 100
     
     def tamanho(self) -> int:
-        """Retorna tamanho atual do cache"""
+        """Retorna número de entradas no cache"""
         return len(self.cache)
     
     def estatisticas(self) -> Dict:
         """Retorna estatísticas do cache"""
+        with self._lock:
+            return self._estatisticas()
+    
+    def _estatisticas(self) -> Dict:
+        maiores = sorted(self.tamanhos.items(), key=lambda item: item[1], reverse=True)
         return {
             "tamanho": self.tamanho(),
-            "max_size": self.max_size,
+            "bytes": self.bytes_usados,
+            "max_bytes": self.max_bytes,
+            "uso_memoria": (self.bytes_usados / self.max_bytes) * 100 if self.max_bytes else 0.0,
             "hits": self.hits,
             "misses": self.misses,
-            "taxa_acerto": self.taxa_acerto()
+            "taxa_acerto": self.taxa_acerto(),
+            "evictions": dict(self.evictions),
+            "admissoes_rejeitadas": self.rejeitados,
+            "maiores_entradas": [
+                {"chave": chave[:12], "bytes": custo} for chave, custo in maiores[:Config.CACHE_STATS_TOP]
+            ],
         }
 
 
 class GeminiAIService:
     """Serviço de processamento de texto via Google Gemini com cache"""
     
-    def __init__(self):
+    def __init__(self, cache_compartilhado: Optional[CacheCompartilhado] = None):
+        """
+        Args:
+            cache_compartilhado: Camada de cache no MongoDB, comum às estações (opcional)
+        """
         self.client: Optional[genai.Client] = None
         self.cache = LRUCache()
+        self.cache_compartilhado = cache_compartilhado
+        self.cache_disco: Optional[CachePersistente] = None
+        try:
+            self.cache_disco = CachePersistente()
+        except Exception as e:
+            logger.error(f"Cache persistente indisponível: {str(e)}")
+        # Single-flight: chamadas concorrentes com a mesma chave compartilham o resultado
+        self._em_andamento: Dict[str, Future] = {}
+        self._lock_voo = threading.Lock()
+        self.requisicoes_agrupadas = 0
+        self.hedging = ExecutorHedging()
+        self.disjuntores = GerenciadorDisjuntores()
+        self._pool_segmentos = ThreadPoolExecutor(
+            max_workers=Config.IA_SEGMENTOS_PARALELOS, thread_name_prefix="bopm-ia-segmento"
+        )
+        self.segmentos_gerados = 0
+        self.segmentos_do_cache = 0
         self._inicializar_cliente()
     
     def _inicializar_cliente(self) -> None:
@@ -118,22 +276,92 @@ class GeminiAIService:
             logger.error(f"✗ Erro ao inicializar Gemini: {str(e)}")
             self.client = None
     
-    def _gerar_cache_key(self, relato_bruto: str, natureza: str) -> str:
+    @staticmethod
+    def _impressao_geracao() -> str:
+        """Impressão curta da configuração de geração (modelos, prompt e parâmetros)"""
+        conteudo = json.dumps([
+            Config.MODELOS_GEMINI,
+            Config.PROMPT_TEMPLATE,
+            Config.IA_TEMPERATURE,
+            Config.IA_CANDIDATE_COUNT,
+        ], ensure_ascii=False)
+        return hashlib.sha256(conteudo.encode('utf-8')).hexdigest()[:16]
+    
+    def _gerar_cache_key(self, relato_bruto: str, natureza: str,
+                         template: Optional[str] = None) -> str:
         """
-        Gera chave única para cache baseada no conteúdo
+        Gera chave única para cache baseada no conteúdo e nos parâmetros
+        da geração (modelos, template do prompt e temperatura), para que
+        mudanças de configuração não reaproveitem textos antigos
         
         Args:
             relato_bruto: Texto do rascunho
             natureza: Natureza dos fatos
+            template: Template do prompt (padrão: Config.PROMPT_TEMPLATE)
             
         Returns:
-            Hash MD5 como chave
+            Hash SHA-256 como chave
+        """
+        conteudo = json.dumps([
+            Config.MODELOS_GEMINI,
+            template or Config.PROMPT_TEMPLATE,
+            Config.IA_TEMPERATURE,
+            Config.IA_CANDIDATE_COUNT,
+            relato_bruto.strip(),
+            natureza.strip(),
+        ], ensure_ascii=False)
+        return hashlib.sha256(conteudo.encode('utf-8')).hexdigest()
+    
+    def _buscar_cache(self, cache_key: str) -> Optional[str]:
         """
-        conteudo = f"{relato_bruto.strip()}|{natureza.strip()}"
-        return hashlib.md5(conteudo.encode('utf-8')).hexdigest()
+        Consulta memória, disco local e cache compartilhado, nessa ordem,
+        promovendo o acerto para as camadas mais rápidas
+        """
+        resultado = self.cache.get(cache_key)
+        if resultado:
+            return resultado
+        
+        if self.cache_disco is not None:
+            try:
+                resultado = self.cache_disco.get(cache_key)
+            except Exception as e:
+                logger.warning(f"Falha ao ler cache persistente: {str(e)}")
+            if resultado:
+                self.cache.put(cache_key, resultado)
+                logger.info("Texto recuperado do cache persistente")
+                return resultado
+        
+        if self.cache_compartilhado is None:
+            return None
+        encontrado = self.cache_compartilhado.get(cache_key, self._impressao_geracao())
+        if encontrado is None:
+            return None
+        resultado, modelo = encontrado
+        self._armazenar_local(cache_key, resultado, modelo)
+        logger.info("Texto recuperado do cache compartilhado")
+        return resultado
+    
+    def _armazenar_local(self, cache_key: str, texto: str, modelo: str) -> None:
+        """Grava o texto na memória e no disco desta estação"""
+        self.cache.put(cache_key, texto)
+        if self.cache_disco is None:
+            return
+        try:
+            self.cache_disco.put(cache_key, texto, modelo)
+        except Exception as e:
+            logger.warning(f"Falha ao gravar cache persistente: {str(e)}")
+    
+    def _armazenar_cache(self, cache_key: str, texto: str, modelo: str) -> None:
+        """Grava o texto em todas as camadas de cache"""
+        self._armazenar_local(cache_key, texto, modelo)
+        if self.cache_compartilhado is not None:
+            self.cache_compartilhado.put(cache_key, self._impressao_geracao(), texto, modelo)
     
     def gerar_texto_formal(self, relato_bruto: str, natureza: str, 
-                          usar_cache: bool = True) -> str:
+                          usar_cache: bool = True,
+                          ao_receber: Optional[Callable[[str], None]] = None,
+                          ao_reiniciar: Optional[Callable[[], None]] = None,
+                          cancelamento: Optional[TokenCancelamento] = None) -> str:
         """
         Transforma rascunho em texto formal via IA
         
@@ -141,71 +369,464 @@ class GeminiAIService:
             relato_bruto: Rascunho original
             natureza: Natureza dos fatos
             usar_cache: Se deve usar cache
+            ao_receber: Se informado, usa a API de streaming e recebe cada
+                trecho do texto assim que chega (na thread do worker)
+            ao_reiniciar: Chamado quando um modelo falha no meio do streaming
+                e os trechos já entregues devem ser descartados
+            cancelamento: Token para cancelar a geração; sem ele, aplica-se
+                o prazo total Config.IA_PRAZO_TOTAL_S
             
         Returns:
-            Texto formalizado
+            Texto formalizado completo
+            
+        Raises:
+            GeracaoCancelada: Cancelada pelo usuário (PrazoExcedido se o prazo expirou)
         """
         if not self.client:
             logger.warning("Cliente Gemini indisponível")
             return f"[ERRO] IA não configurada.\nTexto Original:\n{relato_bruto}"
         
+        if cancelamento is None:
+            cancelamento = TokenCancelamento(Config.IA_PRAZO_TOTAL_S)
+        
+        if Config.IA_SEGMENTAR and len(relato_bruto) >= Config.IA_SEGMENTACAO_MIN_CHARS:
+            segmentos = dividir_em_segmentos(relato_bruto)
+            if len(segmentos) > 1:
+                # Rascunho inteiro já formalizado (ex.: cache compartilhado semeado com BOPMs salvos)
+                inteiro = self._buscar_cache(self._gerar_cache_key(relato_bruto, natureza)) if usar_cache else None
+                if inteiro:
+                    logger.info("Texto recuperado do cache (rascunho inteiro)")
+                    if ao_receber:
+                        ao_receber(inteiro)
+                    return inteiro
+                return self._gerar_segmentado(relato_bruto, segmentos, natureza, usar_cache,
+                                              ao_receber, cancelamento)
+        
+        texto, _ = self._gerar_com_cache(relato_bruto, natureza, usar_cache, ao_receber,
+                                         ao_reiniciar, cancelamento)
+        return texto if texto is not None else self._texto_falha(relato_bruto)
+    
+    def _gerar_com_cache(self, relato_bruto: str, natureza: str, usar_cache: bool,
+                         ao_receber: Optional[Callable[[str], None]],
+                         ao_reiniciar: Optional[Callable[[], None]],
+                         cancelamento: TokenCancelamento,
+                         template: Optional[str] = None) -> Tuple[Optional[str], bool]:
+        """
+        Gera um texto consultando o cache e agrupando chamadas idênticas (single-flight)
+        
+        Returns:
+            Tupla (texto gerado ou None se todos os modelos falharem,
+            se o texto veio do cache ou de uma geração idêntica em andamento)
+        """
+        if ao_receber is None:
+            gerar = lambda: self._gerar_via_modelos(relato_bruto, natureza, cancelamento, template)
+        else:
+            gerar = lambda: self._gerar_em_streaming(relato_bruto, natureza, ao_receber,
+                                                     ao_reiniciar, cancelamento)
+        
+        if not usar_cache:
+            texto_gerado, _ = gerar()
+            return texto_gerado, False
+        
         # 1. Verifica cache
-        if usar_cache:
-            cache_key = self._gerar_cache_key(relato_bruto, natureza)
-            resultado_cache = self.cache.get(cache_key)
-            
-            if resultado_cache:
-                logger.info("Texto recuperado do cache")
-                return resultado_cache
+        cache_key = self._gerar_cache_key(relato_bruto, natureza, template)
+        resultado_cache = self._buscar_cache(cache_key)
+        if resultado_cache:
+            logger.info("Texto recuperado do cache")
+            if ao_receber:
+                ao_receber(resultado_cache)
+            return resultado_cache, True
+        
+        # 2. Single-flight: se a mesma chave já está sendo gerada, aguarda aquela chamada
+        with self._lock_voo:
+            voo = self._em_andamento.get(cache_key)
+            lider = voo is None
+            if lider:
+                voo = Future()
+                self._em_andamento[cache_key] = voo
+            else:
+                self.requisicoes_agrupadas += 1
+        
+        if not lider:
+            logger.info("Geração idêntica em andamento: aguardando o resultado")
+            while True:
+                try:
+                    resultado = voo.result(timeout=cancelamento.limitar(Config.IA_CANCELAMENTO_POLL_S))
+                    break
+                except FuturesTimeoutError:
+                    cancelamento.verificar()
+            if ao_receber and resultado is not None:
+                ao_receber(resultado)
+            return resultado, True
         
-        # 2. Gera prompt
-        prompt = Config.PROMPT_TEMPLATE.format(
+        try:
+            # Outra chamada pode ter concluído entre a consulta ao cache e o registro do voo
+            texto_gerado = self.cache.peek(cache_key)
+            do_cache = texto_gerado is not None
+            if not do_cache:
+                texto_gerado, modelo = gerar()
+                if texto_gerado is not None:
+                    self._armazenar_cache(cache_key, texto_gerado, modelo)
+                    logger.info(f"Texto armazenado em cache (tamanho: {self.cache.tamanho()})")
+            voo.set_result(texto_gerado)
+            return texto_gerado, do_cache
+        except BaseException as e:
+            voo.set_exception(e)
+            raise
+        finally:
+            with self._lock_voo:
+                self._em_andamento.pop(cache_key, None)
+    
+    def _gerar_segmentado(self, relato_bruto: str, segmentos: List[str], natureza: str,
+                          usar_cache: bool, ao_receber: Optional[Callable[[str], None]],
+                          cancelamento: TokenCancelamento) -> str:
+        """
+        Formaliza os trechos em paralelo, cada um com sua própria entrada de
+        cache: ao regenerar, só os trechos alterados vão para a API. Com
+        ao_receber, os trechos são entregues em ordem assim que ficam prontos.
+        """
+        logger.info(f"Rascunho longo: gerando {len(segmentos)} trechos em paralelo")
+        futuros = [
+            self._pool_segmentos.submit(self._gerar_segmento, segmento, natureza, usar_cache, cancelamento)
+            for segmento in segmentos
+        ]
+        
+        textos: List[str] = []
+        em_cache = 0
+        try:
+            for futuro in futuros:
+                while True:
+                    try:
+                        texto, do_cache = futuro.result(
+                            timeout=cancelamento.limitar(Config.IA_CANCELAMENTO_POLL_S)
+                        )
+                        break
+                    except FuturesTimeoutError:
+                        cancelamento.verificar()
+                if texto is None:
+                    # Os trechos já gerados ficam no cache para a próxima tentativa
+                    return self._texto_falha(relato_bruto)
+                em_cache += do_cache
+                if ao_receber:
+                    ao_receber(("\n\n" if textos else "") + texto.strip())
+                textos.append(texto)
+        finally:
+            for futuro in futuros:
+                futuro.cancel()
+        
+        with self._lock_voo:
+            self.segmentos_gerados += len(segmentos) - em_cache
+            self.segmentos_do_cache += em_cache
+        logger.info(f"✓ {len(segmentos)} trechos formalizados ({em_cache} já estavam em cache)")
+        return juntar_segmentos(textos)
+    
+    def _gerar_segmento(self, segmento: str, natureza: str, usar_cache: bool,
+                        cancelamento: TokenCancelamento) -> Tuple[Optional[str], bool]:
+        """Gera um trecho; retorna (texto ou None, se veio do cache)"""
+        return self._gerar_com_cache(segmento, natureza, usar_cache, None, None,
+                                     cancelamento, Config.PROMPT_TEMPLATE_SEGMENTO)
+    
+    def _montar_requisicao(self, relato_bruto: str, natureza: str,
+                           timeout_s: Optional[float] = None,
+                           template: Optional[str] = None) -> Tuple[str, types.GenerateContentConfig]:
+        """Monta o prompt e a configuração da geração (com timeout HTTP da tentativa)"""
+        prompt = (template or Config.PROMPT_TEMPLATE).format(
             natureza=natureza,
             rascunho=relato_bruto
         )
-        
-        # 3. Configuração da geração
         config = types.GenerateContentConfig(
             temperature=Config.IA_TEMPERATURE,
-            candidate_count=Config.IA_CANDIDATE_COUNT
+            candidate_count=Config.IA_CANDIDATE_COUNT,
+            http_options=types.HttpOptions(timeout=max(1, int(timeout_s * 1000))) if timeout_s else None
         )
+        return prompt, config
+    
+    @staticmethod
+    def _timeout_tentativa(cancelamento: TokenCancelamento) -> float:
+        """Prazo de uma tentativa, limitado ao que resta do prazo total"""
+        cancelamento.verificar()
+        return cancelamento.limitar(Config.IA_TIMEOUT_TENTATIVA_S)
+    
+    def _gerar_em_streaming(self, relato_bruto: str, natureza: str,
+                            ao_receber: Callable[[str], None],
+                            ao_reiniciar: Optional[Callable[[], None]],
+                            cancelamento: TokenCancelamento) -> Tuple[Optional[str], Optional[str]]:
+        """
+        Gera via API de streaming, tentando os modelos em ordem de latência.
+        Não há hedging: trechos já exibidos não podem vir de dois modelos.
+        O cancelamento fecha o stream no próximo trecho recebido.
         
-        # 4. Tenta cada modelo disponível
-        for modelo in Config.MODELOS_GEMINI:
+        Returns:
+            Tupla (texto completo, modelo usado) ou (None, None) se todos falharem
+        """
+        modelos = [m for m in self.hedging.ordenar(Config.MODELOS_GEMINI) if self.disjuntores.disponivel(m)]
+        for modelo in modelos:
+            timeout_s = self._timeout_tentativa(cancelamento)
+            if not self.disjuntores.permitir(modelo):
+                continue
+            logger.info(f"Tentando modelo (streaming): {modelo}")
+            prompt, config = self._montar_requisicao(relato_bruto, natureza, timeout_s)
+            trechos = []
+            stream = None
+            inicio = time.perf_counter()
             try:
-                logger.info(f"Tentando modelo: {modelo}")
-                
-                response = self.client.models.generate_content(
+                stream = self.client.models.generate_content_stream(
                     model=modelo,
                     contents=prompt,
                     config=config
                 )
-                
-                texto_gerado = response.text
-                
-                # Salva no cache
-                if usar_cache:
-                    self.cache.put(cache_key, texto_gerado)
-                    logger.info(f"Texto armazenado em cache (tamanho: {self.cache.tamanho()})")
-                
-                logger.info(f"✓ Texto gerado com sucesso usando {modelo}")
-                return texto_gerado
-                
+                for chunk in stream:
+                    if cancelamento.cancelado:
+                        cancelamento.verificar()
+                    if chunk.text:
+                        trechos.append(chunk.text)
+                        ao_receber(chunk.text)
+            except GeracaoCancelada:
+                # Fecha a resposta HTTP em andamento
+                fechar = getattr(stream, "close", None)
+                if fechar:
+                    fechar()
+                self.disjuntores.liberar(modelo)
+                raise
             except Exception as e:
-                logger.warning(f"Falha com modelo {modelo}: {str(e)}")
+                classe = self.disjuntores.registrar_falha(modelo, e)
+                self.hedging.registrar_chamada(modelo, time.perf_counter() - inicio, False, erro=True)
+                logger.warning(f"Falha ({classe}) no streaming com modelo {modelo}: {str(e)}")
+                if trechos and ao_reiniciar:
+                    ao_reiniciar()
                 continue
+            
+            # Duração total, comparável às chamadas sem streaming (ordem e atraso do hedging)
+            self.hedging.registrar_chamada(modelo, time.perf_counter() - inicio, bool(trechos))
+            self.disjuntores.registrar_sucesso(modelo)
+            if trechos:
+                logger.info(f"✓ Texto gerado com sucesso usando {modelo} (streaming)")
+                return "".join(trechos), modelo
         
-        # 5. Fallback se todos modelos falharem
         logger.error("Todos os modelos falharam")
+        return None, None
+    
+    @staticmethod
+    def _texto_falha(relato_bruto: str) -> str:
         return f"[FALHA] IA indisponível.\nTexto Original:\n{relato_bruto}"
     
+    def _gerar_via_modelos(self, relato_bruto: str, natureza: str,
+                           cancelamento: TokenCancelamento,
+                           template: Optional[str] = None) -> Tuple[Optional[str], Optional[str]]:
+        """
+        Chama a API com hedging entre os modelos configurados, do mais
+        rápido (latência observada) ao mais lento
+        
+        Returns:
+            Tupla (texto gerado, modelo usado) ou (None, None) se todos falharem
+        """
+        # 1. Descarta na hora os modelos com circuito aberto
+        modelos = [m for m in Config.MODELOS_GEMINI if self.disjuntores.disponivel(m)]
+        if not modelos:
+            logger.error("Todos os modelos estão com o circuito aberto")
+            return None, None
+        
+        # 2. Dispara os modelos com hedging (cada tentativa com seu timeout HTTP)
+        def chamar(modelo: str) -> Optional[str]:
+            timeout_s = self._timeout_tentativa(cancelamento)
+            if not self.disjuntores.permitir(modelo):
+                raise CircuitoAberto(modelo)
+            prompt, config = self._montar_requisicao(relato_bruto, natureza, timeout_s, template)
+            try:
+                response = self.client.models.generate_content(
+                    model=modelo,
+                    contents=prompt,
+                    config=config
+                )
+            except Exception as e:
+                classe = self.disjuntores.registrar_falha(modelo, e)
+                logger.warning(f"Falha ({classe}) com modelo {modelo}")
+                raise
+            self.disjuntores.registrar_sucesso(modelo)
+            return response.text
+        
+        texto, modelo = self.hedging.executar(chamar, modelos, cancelamento)
+        if texto is None:
+            logger.error("Todos os modelos falharam")
+            return None, None
+        
+        logger.info(f"✓ Texto gerado com sucesso usando {modelo}")
+        return texto, modelo
+    
+    # === GERAÇÃO EM LOTE ===
+    def gerar_lote(self, itens: Iterable[Dict],
+                   concorrencia: int = Config.IA_LOTE_CONCORRENCIA,
+                   usar_cache: bool = True) -> Dict:
+        """
+        Formaliza vários rascunhos com o cliente assíncrono do SDK, limitando
+        a concorrência e respeitando a cota (requisições e tokens por minuto)
+        
+        Args:
+            itens: Dicionários com "id", "rascunho" e "natureza"
+            concorrencia: Máximo de chamadas simultâneas à API
+            usar_cache: Se deve consultar/gravar o cache
+            
+        Returns:
+            {"resultados": [...], "resumo": {...}}; cada resultado traz id,
+            texto, modelo, origem ("cache"/"api"), segundos e erro
+        """
+        itens = list(itens)
+        if not self.client:
+            erro = "IA não configurada"
+            return {
+                "resultados": [{"id": item.get("id"), "texto": None, "modelo": None,
+                                "origem": None, "segundos": 0.0, "erro": erro} for item in itens],
+                "resumo": {"total": len(itens), "sucessos": 0, "do_cache": 0, "falhas": len(itens)},
+            }
+        return asyncio.run(self._gerar_lote_async(itens, concorrencia, usar_cache))
+    
+    async def _gerar_lote_async(self, itens: List[Dict], concorrencia: int, usar_cache: bool) -> Dict:
+        semaforo = asyncio.Semaphore(concorrencia)
+        limitador = LimitadorTaxa()
+        # Rascunhos idênticos no mesmo lote compartilham uma única chamada
+        em_andamento: Dict[str, asyncio.Task] = {}
+        inicio = time.perf_counter()
+        
+        async def chamar_api(relato: str, natureza: str) -> Tuple[str, str]:
+            prompt, config = self._montar_requisicao(relato, natureza, Config.IA_TIMEOUT_TENTATIVA_S)
+            estimados = estimar_tokens(prompt)
+            ultimo_erro: Optional[Exception] = None
+            for modelo in self.hedging.ordenar(Config.MODELOS_GEMINI):
+                if not self.disjuntores.permitir(modelo):
+                    continue
+                async with semaforo:
+                    await limitador.adquirir(estimados)
+                    try:
+                        response = await self.client.aio.models.generate_content(
+                            model=modelo, contents=prompt, config=config
+                        )
+                    except Exception as e:
+                        classe = self.disjuntores.registrar_falha(modelo, e)
+                        logger.warning(f"Lote: falha ({classe}) com modelo {modelo}: {str(e)}")
+                        ultimo_erro = e
+                        continue
+                self.disjuntores.registrar_sucesso(modelo)
+                uso = getattr(response, "usage_metadata", None)
+                if uso is not None and getattr(uso, "total_token_count", None):
+                    limitador.ajustar(estimados, uso.total_token_count)
+                if response.text:
+                    return response.text, modelo
+            raise AIServiceError(f"Todos os modelos falharam: {ultimo_erro}" if ultimo_erro
+                                 else "Todos os modelos estão com o circuito aberto")
+        
+        async def processar(item: Dict) -> Dict:
+            relato, natureza = item.get("rascunho", ""), item.get("natureza", "")
+            resultado = {"id": item.get("id"), "texto": None, "modelo": None,
+                         "origem": "api", "segundos": 0.0, "erro": None}
+            inicio_item = time.perf_counter()
+            try:
+                cache_key = self._gerar_cache_key(relato, natureza)
+                # Disco (SQLite) e cache compartilhado (MongoDB) são bloqueantes: fora do event loop
+                texto = await asyncio.to_thread(self._buscar_cache, cache_key) if usar_cache else None
+                if texto:
+                    resultado.update(texto=texto, origem="cache")
+                else:
+                    tarefa = em_andamento.get(cache_key)
+                    lider = tarefa is None
+                    if lider:
+                        tarefa = asyncio.ensure_future(chamar_api(relato, natureza))
+                        em_andamento[cache_key] = tarefa
+                    texto, modelo = await tarefa
+                    if usar_cache and lider:
+                        await asyncio.to_thread(self._armazenar_cache, cache_key, texto, modelo)
+                    resultado.update(texto=texto, modelo=modelo)
+            except Exception as e:
+                resultado["erro"] = str(e)
+            resultado["segundos"] = round(time.perf_counter() - inicio_item, 3)
+            return resultado
+        
+        resultados = await asyncio.gather(*(processar(item) for item in itens))
+        duracao = time.perf_counter() - inicio
+        
+        latencias = sorted(r["segundos"] for r in resultados if r["origem"] == "api" and not r["erro"])
+        def percentil(p: float) -> Optional[float]:
+            if not latencias:
+                return None
+            return latencias[min(len(latencias) - 1, int(len(latencias) * p))]
+        
+        sucessos = sum(1 for r in resultados if not r["erro"])
+        resumo = {
+            "total": len(resultados),
+            "sucessos": sucessos,
+            "do_cache": sum(1 for r in resultados if r["origem"] == "cache"),
+            "falhas": len(resultados) - sucessos,
+            "segundos": round(duracao, 1),
+            "itens_por_min": round(len(resultados) / duracao * 60, 1) if duracao > 0 else 0.0,
+            "latencia_p50_s": percentil(0.5),
+            "latencia_p95_s": percentil(0.95),
+            "limitador": limitador.estatisticas(),
+        }
+        logger.info(
+            f"✓ Lote: {resumo['sucessos']}/{resumo['total']} gerados "
+            f"({resumo['do_cache']} do cache) em {resumo['segundos']}s"
+        )
+        return {"resultados": list(resultados), "resumo": resumo}
+    
+    def semear_cache_compartilhado(self, registros: Iterable[Tuple[str, str, str]]) -> Dict:
+        """
+        Semeia o cache compartilhado com BOPMs já formalizados
+        
+        Args:
+            registros: Tuplas (rascunho, natureza, texto_final)
+            
+        Returns:
+            Dicionário com lidos, inseridos, existentes e ignorados (sem relato reconhecível)
+        """
+        if self.cache_compartilhado is None:
+            raise AIServiceError("Cache compartilhado não configurado")
+        
+        ignorados = 0
+        
+        def entradas():
+            nonlocal ignorados
+            for rascunho, natureza, texto_final in registros:
+                relato = extrair_relato(texto_final or "")
+                if not rascunho or relato is None:
+                    ignorados += 1
+                    continue
+                yield self._gerar_cache_key(rascunho, natureza or ""), relato
+        
+        estatisticas = self.cache_compartilhado.semear(entradas(), self._impressao_geracao())
+        estatisticas["ignorados"] = ignorados
+        logger.info(
+            f"✓ Cache compartilhado semeado: {estatisticas['inseridos']} novos, "
+            f"{estatisticas['existentes']} já existentes, {ignorados} ignorados"
+        )
+        return estatisticas
+    
     def limpar_cache(self) -> None:
-        """Limpa o cache de resultados"""
+        """Limpa o cache de resultados desta estação (memória e disco; o compartilhado expira por TTL)"""
         self.cache.clear()
+        if self.cache_disco is not None:
+            self.cache_disco.clear()
     
     def obter_estatisticas_cache(self) -> Dict:
         """Obtém estatísticas do cache"""
-        return self.cache.estatisticas()
+        estatisticas = self.cache.estatisticas()
+        estatisticas["requisicoes_agrupadas"] = self.requisicoes_agrupadas
+        estatisticas["segmentos"] = {
+            "gerados": self.segmentos_gerados,
+            "do_cache": self.segmentos_do_cache,
+        }
+        estatisticas["latencia"] = self.hedging.estatisticas()
+        estatisticas["disjuntores"] = self.disjuntores.estatisticas()
+        if self.cache_disco is not None:
+            estatisticas["disco"] = self.cache_disco.estatisticas()
+        if self.cache_compartilhado is not None:
+            estatisticas["compartilhado"] = self.cache_compartilhado.estatisticas()
+        return estatisticas
+    
+    def encerrar(self) -> None:
+        """Libera os pools de hedging e de trechos e o arquivo do cache persistente"""
+        self.hedging.encerrar()
+        self._pool_segmentos.shutdown(wait=False, cancel_futures=True)
+        if self.cache_disco is not None:
+            self.cache_disco.fechar()
     
     def testar_conexao(self) -> tuple[bool, str]:
         """
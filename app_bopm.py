@@ -1,15 +1,19 @@
 import logging
-import threading
+from collections import deque
+from concurrent.futures import Future
 from datetime import datetime
 from tkinter import messagebox
 import customtkinter as ctk
 from config import Config
-from database import BOPMDatabase
+from database import BOPMDatabase, SALVO_CRIADO, SALVO_ATUALIZADO, SALVO_OFFLINE, SALVO_CONFLITO
 from ai_service import GeminiAIService
+from cache_compartilhado import CacheCompartilhado
+from cancelamento import GeracaoCancelada, PrazoExcedido, TokenCancelamento
 from validators import BOPMValidator
 from user_settings import settings
 from security import security
-from ui_components import InputFrame, OutputFrame, SearchFrame, SettingsDialog
+from executor_backend import ExecutorBackend
+from ui_components import Coluna, InputFrame, OutputFrame, SearchFrame, SettingsDialog, TabelaVirtual
 
 # --- CONFIGURAÇÃO DE LOGGING ---
 logging.basicConfig(
@@ -38,7 +42,10 @@ class BOPMBackend:
         
         # Inicializar serviços
         self.db = BOPMDatabase()
-        self.ai_service = GeminiAIService()
+        self.ai_service = GeminiAIService(
+            cache_compartilhado=CacheCompartilhado(self.db.colecao_cache_ia)
+        )
+        self.executor = ExecutorBackend()
         
         logger.info(f"Banco: {'✓ Conectado' if self.db.conectado else '✗ Desconectado'}")
         logger.info("=== Backend inicializado ===")
@@ -56,56 +63,114 @@ class BOPMBackend:
         """
         return self.db.salvar_bopm(dados_inputs, texto_final)
     
+    def salvar_bopm_versionado_db(self, dados_inputs: dict, texto_final: str,
+                                  versao_esperada: int | None = None,
+                                  forcar: bool = False) -> tuple[str, str, int | None]:
+        """Salva BOPM com controle de versão (retorna status, mensagem e versão)"""
+        return self.db.salvar_bopm_versionado(dados_inputs, texto_final, versao_esperada, forcar)
+    
     def buscar_bopm_db(self, numero_bopm: str) -> tuple[dict | None, str]:
         """Busca BOPM por número"""
         return self.db.buscar_bopm(numero_bopm)
     
     def listar_bopms_db(self, limite: int = 50) -> tuple[list | None, str]:
-        """Lista BOPMs recentes"""
+        """Lista BOPMs recentes (RegistroBOPM: só as colunas da listagem)"""
         return self.db.listar_bopms(limite)
     
-    def buscar_avancada(self, filtros: dict, limite: int = 50) -> tuple[list | None, str]:
-        """Busca avançada com filtros"""
-        try:
-            query = {}
-            if filtros.get('numero'):
-                query['numero_bopm'] = {'$regex': filtros['numero'], '$options': 'i'}
-            if filtros.get('infrator'):
-                query['infrator'] = {'$regex': filtros['infrator'], '$options': 'i'}
-            if filtros.get('natureza'):
-                query['natureza'] = {'$regex': filtros['natureza'], '$options': 'i'}
-            if filtros.get('motorista'):
-                query['equipe.motorista'] = {'$regex': filtros['motorista'], '$options': 'i'}
-            
-            cursor = self.db.collection.find(query).sort('data_atualizacao', -1).limit(limite)
-            resultados = list(cursor)
-            return resultados, f"{len(resultados)} resultados"
-        except Exception as e:
-            return None, f"Erro na busca: {str(e)}"
+    def listar_pagina_db(self, limite: int = 50, token: str | None = None) -> tuple[list | None, str | None, str]:
+        """Lista BOPMs paginados (retorna token da próxima página)"""
+        return self.db.listar_pagina(limite, token)
     
-    def gerar_texto_ia(self, relato_bruto: str, natureza: str) -> str:
+    def buscar_avancada(self, filtros: dict, limite: int = 50,
+                        token: str | None = None) -> tuple[list | None, str | None, str]:
+        """Busca avançada com filtros, paginada (RegistroBOPM; o documento completo vem de buscar_bopm_db)"""
+        return self.db.buscar_avancada(filtros, limite, token)
+    
+    def gerar_texto_ia(self, relato_bruto: str, natureza: str, cancelamento=None) -> str:
         """Gera texto formal via IA (com cache)"""
-        return self.ai_service.gerar_texto_formal(relato_bruto, natureza)
+        return self.ai_service.gerar_texto_formal(relato_bruto, natureza, cancelamento=cancelamento)
+    
+    def gerar_texto_ia_stream(self, relato_bruto: str, natureza: str,
+                              ao_receber, ao_reiniciar=None, cancelamento=None) -> str:
+        """Gera texto formal via IA em streaming (com cache); retorna o texto completo"""
+        return self.ai_service.gerar_texto_formal(relato_bruto, natureza,
+                                                  ao_receber=ao_receber, ao_reiniciar=ao_reiniciar,
+                                                  cancelamento=cancelamento)
     
     def obter_estatisticas(self) -> dict:
         """Retorna estatísticas gerais"""
         return {
             "cache": self.ai_service.obter_estatisticas_cache(),
             "total_bopms": self.db.contar_bopms(),
-            "db_conectado": self.db.conectado
+            "contadores": self.db.obter_estatisticas_bopms()[0],
+            "db_conectado": self.db.conectado,
+            "journal": self.db.journal.estatisticas(),
+            "cache_documentos": self.db.cache.estatisticas()
         }
+    
+    # === VARIANTES ASSÍNCRONAS (resultados entregues na thread da UI) ===
+    def salvar_bopm_db_async(self, dados_inputs: dict, texto_final: str,
+                             ao_concluir=None, ao_falhar=None) -> Future:
+        return self.executor.executar(self.salvar_bopm_db, dados_inputs, texto_final,
+                                      ao_concluir=ao_concluir, ao_falhar=ao_falhar)
+    
+    def salvar_bopm_versionado_db_async(self, dados_inputs: dict, texto_final: str,
+                                        versao_esperada: int | None = None, forcar: bool = False,
+                                        ao_concluir=None, ao_falhar=None) -> Future:
+        return self.executor.executar(self.salvar_bopm_versionado_db, dados_inputs, texto_final,
+                                      versao_esperada, forcar,
+                                      ao_concluir=ao_concluir, ao_falhar=ao_falhar)
+    
+    def buscar_bopm_db_async(self, numero_bopm: str, ao_concluir=None, ao_falhar=None) -> Future:
+        return self.executor.executar(self.buscar_bopm_db, numero_bopm,
+                                      ao_concluir=ao_concluir, ao_falhar=ao_falhar)
+    
+    def listar_bopms_db_async(self, limite: int = 50, ao_concluir=None, ao_falhar=None) -> Future:
+        return self.executor.executar(self.listar_bopms_db, limite,
+                                      ao_concluir=ao_concluir, ao_falhar=ao_falhar)
+    
+    def listar_pagina_db_async(self, limite: int = 50, token: str | None = None,
+                               ao_concluir=None, ao_falhar=None) -> Future:
+        return self.executor.executar(self.listar_pagina_db, limite, token,
+                                      ao_concluir=ao_concluir, ao_falhar=ao_falhar)
+    
+    def buscar_avancada_async(self, filtros: dict, limite: int = 50, token: str | None = None,
+                              ao_concluir=None, ao_falhar=None) -> Future:
+        return self.executor.executar(self.buscar_avancada, filtros, limite, token,
+                                      ao_concluir=ao_concluir, ao_falhar=ao_falhar)
+    
+    def gerar_texto_ia_async(self, relato_bruto: str, natureza: str,
+                             ao_concluir=None, ao_falhar=None) -> Future:
+        return self.executor.executar(self.gerar_texto_ia, relato_bruto, natureza,
+                                      ao_concluir=ao_concluir, ao_falhar=ao_falhar, pool="ia")
+    
+    def obter_estatisticas_async(self, ao_concluir=None, ao_falhar=None) -> Future:
+        return self.executor.executar(self.obter_estatisticas,
+                                      ao_concluir=ao_concluir, ao_falhar=ao_falhar)
+    
+    def encerrar(self) -> None:
+        """Libera workers e conexão com o banco"""
+        self.executor.encerrar()
+        self.ai_service.encerrar()
+        if self.db:
+            self.db.fechar_conexao()
 
 
 class App(ctk.CTk):
     def __init__(self):
         super().__init__()
         self.backend = BOPMBackend()
+        self.backend.executor.vincular_ui(self)
         
         self.title("Gerador de BOPM - 3° BPM")
         self.geometry(Config.WINDOW_GEOMETRY)
         
         self.autosave_timer = None
         self.validation_labels = {}
+        self.numero_carregado = None
+        self.versao_carregada = None
+        self._fila_salvamentos = deque()
+        self.cancelamento_ia = None
         
         self.grid_columnconfigure(1, weight=1)
         self.grid_rowconfigure(0, weight=1)
@@ -155,6 +220,9 @@ class App(ctk.CTk):
         self.btn_gerar = ctk.CTkButton(action_frame, text="🤖 Gerar IA (Ctrl+G)", command=self.iniciar_geracao, height=40, fg_color="green")
         self.btn_gerar.pack(fill="x", pady=(0, 5))
         
+        # Exibido apenas durante a geração
+        self.btn_cancelar = ctk.CTkButton(action_frame, text="✖ Cancelar IA", command=self.cancelar_geracao, height=30, fg_color="#C0392B")
+        
         btn_row = ctk.CTkFrame(action_frame, fg_color="transparent")
         btn_row.pack(fill="x", pady=5)
         
@@ -185,6 +253,9 @@ class App(ctk.CTk):
         
         self.configurar_atalhos()
         self.atualizar_status_conexao()
+        self.backend.db.adicionar_observador_conexao(
+            lambda _: self.backend.executor.chamar_na_ui(self.atualizar_status_conexao)
+        )
         self.carregar_ultimos_bopms()
         
         logger.info("Interface inicializada")
@@ -195,15 +266,21 @@ class App(ctk.CTk):
         self.bind("<Control-n>", lambda e: self.limpar_campos())
         self.bind("<Control-f>", lambda e: self.entry_search.focus())
         self.bind("<Control-h>", lambda e: self.abrir_busca_avancada())
-        self.bind("<Escape>", lambda e: self.limpar_campos())
+        self.bind("<Escape>", lambda e: self.cancelar_geracao() if self.cancelamento_ia else self.limpar_campos())
         self.bind("<F1>", lambda e: self.mostrar_atalhos())
         self.entry_search.bind("<Return>", lambda e: self.buscar_no_banco())
 
     def atualizar_status_conexao(self):
         if self.backend.db.conectado:
-            self.lbl_conexao.configure(text="🟢 MongoDB", text_color="green")
+            rtt = self.backend.db.monitor.ultimo_rtt_ms
+            texto = f"🟢 MongoDB ({rtt:.0f}ms)" if rtt is not None else "🟢 MongoDB"
+            self.lbl_conexao.configure(text=texto, text_color="green")
+        elif self.backend.db.monitor.online is None:
+            self.lbl_conexao.configure(text="🟡 Conectando", text_color="orange")
         else:
-            self.lbl_conexao.configure(text="🔴 Offline", text_color="red")
+            pendentes = self.backend.db.journal.profundidade()
+            texto = f"🔴 Offline ({pendentes} pend.)" if pendentes else "🔴 Offline"
+            self.lbl_conexao.configure(text=texto, text_color="red")
     
     def abrir_configuracoes(self):
         SettingsDialog(self, on_save=self.aplicar_configuracoes)
@@ -216,17 +293,21 @@ class App(ctk.CTk):
         self.lbl_status.configure(text="Texto limpo", text_color="gray")
     
     def carregar_ultimos_bopms(self):
-        try:
-            lista, msg = self.backend.listar_bopms_db(5)
-            if lista and len(lista) > 0:
-                texto_info = f"ℹ️ Últimos {len(lista)} BOPMs: "
-                numeros = [doc.get('numero_bopm', 'N/A') for doc in lista[:3]]
-                texto_info += ", ".join(numeros)
-                if len(lista) > 3:
-                    texto_info += "..."
-                self.lbl_status.configure(text=texto_info, text_color="#3498DB")
-        except Exception as e:
-            logger.debug(f"Erro ao carregar últimos BOPMs: {e}")
+        self.backend.listar_bopms_db_async(
+            5,
+            ao_concluir=self._exibir_ultimos_bopms,
+            ao_falhar=lambda e: logger.debug(f"Erro ao carregar últimos BOPMs: {e}")
+        )
+    
+    def _exibir_ultimos_bopms(self, resultado):
+        lista, msg = resultado
+        if lista and len(lista) > 0:
+            texto_info = f"ℹ️ Últimos {len(lista)} BOPMs: "
+            numeros = [registro.numero_bopm for registro in lista[:3]]
+            texto_info += ", ".join(numeros)
+            if len(lista) > 3:
+                texto_info += "..."
+            self.lbl_status.configure(text=texto_info, text_color="#3498DB")
     
     def criar_input(self, texto, nome_var, parent):
         frame = ctk.CTkFrame(parent, fg_color="transparent")
@@ -297,6 +378,17 @@ class App(ctk.CTk):
         Returns:
             String formatada em Markdown
         """
+        cabecalho, rodape = self.partes_template(dados)
+        return f"{cabecalho}{relato_final}{rodape}"
+    
+    def partes_template(self, dados: dict) -> tuple[str, str]:
+        """
+        Divide o template do BOPM em cabeçalho e rodapé ao redor do relato,
+        para exibir o cabeçalho antes de a IA terminar
+        
+        Returns:
+            Tupla (texto antes do relato, texto depois do relato)
+        """
         # Gera o Markdown para exibição
         bloco_equipe = f"**Equipe Policial**\n**Motorista:** {dados['motorista']}\n**Encarregado:** {dados['encarregado']}"
         if dados.get('aux1', '').strip(): 
@@ -304,7 +396,7 @@ class App(ctk.CTk):
         if dados.get('aux2', '').strip(): 
             bloco_equipe += f"\n**2º Auxiliar:** {dados['aux2']}"
 
-        return f"""**Título:**
+        cabecalho = f"""**Título:**
 BOPM #{dados['numero']} ({dados['infrator']})
 
 **Modelo:**
@@ -316,7 +408,8 @@ BOPM #{dados['numero']} ({dados['infrator']})
 {bloco_equipe}
 
 **Relato dos Fatos:**
-{relato_final}
+"""
+        rodape = f"""
 
 **Natureza dos Fatos:** {dados['natureza']}
 
@@ -325,6 +418,7 @@ BOPM #{dados['numero']} ({dados['infrator']})
 **Procedimentos:** {dados.get('procedimentos', 'Nada consta')}
 
 **Assinatura do Responsável:** {dados.get('assinatura', '')}"""
+        return cabecalho, rodape
 
     # --- LÓGICA DE COLETA DE DADOS ---
     def mostrar_atalhos(self):
@@ -348,7 +442,7 @@ BOPM #{dados['numero']} ({dados['infrator']})
             ("Ctrl+N", "Limpar todos os campos"),
             ("Ctrl+F", "Focar no campo de busca"),
             ("Ctrl+H", "Abrir busca avançada"),
-            ("Esc", "Limpar campos"),
+            ("Esc", "Cancelar geração da IA / Limpar campos"),
             ("Enter", "Buscar (quando no campo de busca)"),
             ("F1", "Mostrar esta ajuda")
         ]
@@ -415,6 +509,7 @@ BOPM #{dados['numero']} ({dados['infrator']})
             self.txt_relato.delete("1.0", "end")
             self.txt_output.delete("1.0", "end")
             self.entry_search.delete(0, "end")
+            self.registrar_versao(None, None)
             for label in self.validation_labels.values():
                 label.configure(text="")
             self.lbl_contador.configure(text="0 caracteres", text_color="gray")
@@ -464,6 +559,8 @@ BOPM #{dados['numero']} ({dados['infrator']})
         self.txt_output.delete("1.0", "end")
         self.txt_output.insert("1.0", texto_salvo)
         
+        self.registrar_versao(doc.get('numero_bopm'), doc.get('_version', 0))
+        
         self.lbl_status.configure(
             text=f"✓ BOPM #{doc.get('numero_bopm')} carregado do banco", 
             text_color="#58D68D"
@@ -494,15 +591,32 @@ BOPM #{dados['numero']} ({dados['infrator']})
             logger.debug(f"Auto-save ignorado: {msg}")
             return
         
-        # Tenta salvar
+        if self._fila_salvamentos:
+            # Salvamento em andamento: tenta de novo no próximo ciclo
+            self.iniciar_autosave_timer()
+            return
+        
+        # Tenta salvar (fora da thread da UI)
         texto_atual = self.txt_output.get("1.0", "end-1c")
-        sucesso, msg = self.backend.salvar_bopm_db(dados, texto_atual)
         
-        if sucesso:
-            self.lbl_status.configure(text="💾 Auto-save realizado", text_color="gray")
-            logger.info(f"Auto-save: BOPM #{dados['numero']}")
-        else:
-            logger.debug(f"Auto-save falhou: {msg}")
+        def ao_concluir(resultado):
+            status, msg, versao = resultado
+            if status in (SALVO_CRIADO, SALVO_ATUALIZADO, SALVO_OFFLINE):
+                self.registrar_versao(dados['numero'], versao)
+                self.lbl_status.configure(text="💾 Auto-save realizado", text_color="gray")
+                self.atualizar_status_conexao()
+                logger.info(f"Auto-save: BOPM #{dados['numero']}")
+            elif status == SALVO_CONFLITO:
+                # Nunca sobrescreve em silêncio: o usuário decide ao salvar manualmente
+                self.lbl_status.configure(text=f"⚠️ Auto-save suspenso: {msg}", text_color="orange")
+            else:
+                logger.debug(f"Auto-save falhou: {msg}")
+        
+        self._salvar_em_serie(
+            dados, texto_atual, False,
+            ao_concluir=ao_concluir,
+            ao_falhar=lambda e: logger.debug(f"Auto-save falhou: {e}")
+        )
 
     # --- ACTIONS ---
     def buscar_no_banco(self):
@@ -511,24 +625,28 @@ BOPM #{dados['numero']} ({dados['infrator']})
             self.lbl_status.configure(text="Digite um número para buscar", text_color="yellow")
             return
         
-        try:
-            logger.info(f"Buscando BOPM #{numero}")
-            doc, msg = self.backend.buscar_bopm_db(numero)
-            
+        logger.info(f"Buscando BOPM #{numero}")
+        self.lbl_status.configure(text=f"🔍 Buscando BOPM #{numero}...", text_color="gray")
+        
+        def ao_concluir(resultado):
+            doc, msg = resultado
             if doc:
                 self.popular_inputs(doc)
             else:
                 self.lbl_status.configure(text=msg, text_color="red")
                 logger.warning(msg)
-        except Exception as e:
+        
+        def ao_falhar(e):
             logger.error(f"Erro ao buscar: {str(e)}")
             messagebox.showerror("Erro", f"Erro ao buscar BOPM:\n{str(e)}", parent=self)
             self.lbl_status.configure(text="Erro na busca", text_color="red")
+        
+        self.backend.buscar_bopm_db_async(numero, ao_concluir=ao_concluir, ao_falhar=ao_falhar)
     
     def abrir_busca_avancada(self):
         janela = ctk.CTkToplevel(self)
         janela.title("Busca Avançada")
-        janela.geometry("600x400")
+        janela.geometry("600x480")
         janela.transient(self)
         janela.grab_set()
         
@@ -540,7 +658,8 @@ BOPM #{dados['numero']} ({dados['infrator']})
         filtros = {}
         
         for campo, label in [("numero", "Número BOPM"), ("infrator", "Infrator"), 
-                             ("natureza", "Natureza"), ("motorista", "Motorista")]:
+                             ("natureza", "Natureza"), ("motorista", "Motorista"),
+                             ("texto", "Texto do Relato")]:
             ctk.CTkLabel(frame, text=label, anchor="w").pack(fill="x", pady=(10, 0))
             entry = ctk.CTkEntry(frame)
             entry.pack(fill="x")
@@ -552,53 +671,100 @@ BOPM #{dados['numero']} ({dados['infrator']})
                 messagebox.showwarning("Aviso", "Preencha ao menos um filtro", parent=janela)
                 return
             
-            resultados, msg = self.backend.buscar_avancada(filtros_valores, 50)
-            if resultados:
-                janela.destroy()
-                self.exibir_resultados_busca(resultados)
-            else:
-                messagebox.showerror("Erro", msg, parent=janela)
+            def ao_concluir(resultado):
+                resultados, proximo_token, msg = resultado
+                if not janela.winfo_exists():
+                    return
+                btn_buscar.configure(state="normal", text="Buscar")
+                if resultados:
+                    janela.destroy()
+                    self.exibir_resultados_busca(resultados, filtros_valores, proximo_token)
+                elif resultados is None:
+                    messagebox.showerror("Erro", msg, parent=janela)
+                else:
+                    messagebox.showinfo("Busca Avançada", msg, parent=janela)
+            
+            def ao_falhar(e):
+                logger.error(f"Erro na busca avançada: {str(e)}")
+                if not janela.winfo_exists():
+                    return
+                btn_buscar.configure(state="normal", text="Buscar")
+                messagebox.showerror("Erro", f"Erro na busca:\n{str(e)}", parent=janela)
+            
+            btn_buscar.configure(state="disabled", text="⏳ Buscando...")
+            self.backend.buscar_avancada_async(filtros_valores, 50,
+                                               ao_concluir=ao_concluir, ao_falhar=ao_falhar)
         
-        ctk.CTkButton(frame, text="Buscar", command=executar_busca).pack(pady=20)
+        btn_buscar = ctk.CTkButton(frame, text="Buscar", command=executar_busca)
+        btn_buscar.pack(pady=20)
         ctk.CTkButton(frame, text="Cancelar", command=janela.destroy, fg_color="gray").pack()
     
-    def exibir_resultados_busca(self, resultados):
+    @staticmethod
+    def _paginar(consultar):
+        """
+        Adapta uma consulta paginada assíncrona para a TabelaVirtual
+        
+        Args:
+            consultar: Função (token, ao_concluir, ao_falhar) que agenda a
+                consulta; ao_concluir recebe (registros, proximo_token, msg)
+        """
+        def carregar_pagina(token, ao_receber, ao_falhar):
+            def ao_concluir(resultado):
+                registros, proximo_token, msg = resultado
+                if registros is None:
+                    ao_falhar(msg)
+                else:
+                    ao_receber(registros, proximo_token)
+            
+            consultar(token, ao_concluir, lambda e: ao_falhar(str(e)))
+        return carregar_pagina
+    
+    @staticmethod
+    def _formatar_data(data) -> str:
+        if isinstance(data, datetime):
+            return data.strftime("%d/%m/%Y %H:%M")
+        return str(data)[:16] if data else "N/A"
+    
+    def exibir_resultados_busca(self, resultados, filtros: dict, proximo_token: str | None = None):
         janela = ctk.CTkToplevel(self)
-        janela.title(f"Resultados ({len(resultados)})")
+        janela.title("Resultados da Busca")
         janela.geometry("800x600")
         janela.transient(self)
         
         frame = ctk.CTkFrame(janela)
         frame.pack(fill="both", expand=True, padx=10, pady=10)
         
-        ctk.CTkLabel(frame, text=f"📋 {len(resultados)} resultados encontrados", 
-                    font=("Arial", 16, "bold")).pack(pady=10)
+        lbl_titulo = ctk.CTkLabel(frame, text="", font=("Arial", 16, "bold"))
+        lbl_titulo.pack(pady=10)
         
-        scroll_frame = ctk.CTkScrollableFrame(frame)
-        scroll_frame.pack(fill="both", expand=True, pady=10)
-        
-        for doc in resultados:
-            item_frame = ctk.CTkFrame(scroll_frame, fg_color="#34495E")
-            item_frame.pack(fill="x", pady=2)
-            
-            numero = doc.get('numero_bopm', 'N/A')
-            infrator = doc.get('infrator', 'N/A')
-            natureza = doc.get('natureza', 'N/A')
-            
-            ctk.CTkLabel(item_frame, text=numero, width=100).pack(side="left", padx=5)
-            ctk.CTkLabel(item_frame, text=infrator[:30], width=200, anchor="w").pack(side="left", padx=5)
-            ctk.CTkLabel(item_frame, text=natureza[:30], width=300, anchor="w").pack(side="left", padx=5)
-            
-            ctk.CTkButton(item_frame, text="Carregar", width=80,
-                         command=lambda n=numero: self.carregar_da_lista(n, janela)).pack(side="right", padx=5)
+        def ao_atualizar(total, ha_mais):
+            sufixo = "+" if ha_mais else ""
+            lbl_titulo.configure(text=f"📋 {total}{sufixo} resultados encontrados")
         
+        tabela = TabelaVirtual(
+            frame,
+            colunas=[Coluna("numero_bopm", "Número", 100),
+                     Coluna("infrator", "Infrator", 200),
+                     Coluna("natureza", "Natureza", 300)],
+            carregar_pagina=self._paginar(
+                lambda token, ao_concluir, ao_falhar: self.backend.buscar_avancada_async(
+                    filtros, 50, token, ao_concluir=ao_concluir, ao_falhar=ao_falhar)
+            ),
+            acao=("Carregar", lambda registro: self.carregar_da_lista(registro.numero_bopm, janela)),
+            ao_atualizar=ao_atualizar
+        )
+        tabela.pack(fill="both", expand=True, pady=10)
         ctk.CTkButton(frame, text="Fechar", command=janela.destroy, fg_color="gray").pack(pady=10)
+        
+        tabela.definir_registros(resultados, proximo_token)
     
     def abrir_historico(self):
         logger.info("Abrindo histórico")
-        
-        # Busca lista de BOPMs
-        lista, msg = self.backend.listar_bopms_db(50)
+        self.lbl_status.configure(text="⏳ Carregando histórico...", text_color="gray")
+        self.backend.listar_pagina_db_async(50, ao_concluir=self._exibir_historico)
+    
+    def _exibir_historico(self, resultado):
+        lista, proximo_token, msg = resultado
         
         if not lista:
             self.lbl_status.configure(text=msg, text_color="red")
@@ -616,58 +782,28 @@ BOPM #{dados['numero']} ({dados['infrator']})
         frame.pack(fill="both", expand=True, padx=10, pady=10)
         
         # Label titulo
-        ctk.CTkLabel(
-            frame, 
-            text=f"📋 Últimos {len(lista)} BOPMs", 
-            font=("Arial", 16, "bold")
-        ).pack(pady=10)
-        
-        # Scrollable frame com lista
-        scroll_frame = ctk.CTkScrollableFrame(frame)
-        scroll_frame.pack(fill="both", expand=True, pady=10)
+        lbl_titulo = ctk.CTkLabel(frame, text="", font=("Arial", 16, "bold"))
+        lbl_titulo.pack(pady=10)
         
-        # Cabeçalho
-        header = ctk.CTkFrame(scroll_frame, fg_color="#2C3E50")
-        header.pack(fill="x", pady=(0, 5))
+        def ao_atualizar(total, ha_mais):
+            sufixo = "" if ha_mais else " (fim do arquivo)"
+            lbl_titulo.configure(text=f"📋 {total} BOPMs mais recentes{sufixo}")
         
-        ctk.CTkLabel(header, text="Número", width=100, font=("Arial", 12, "bold")).pack(side="left", padx=5)
-        ctk.CTkLabel(header, text="Infrator", width=200, font=("Arial", 12, "bold")).pack(side="left", padx=5)
-        ctk.CTkLabel(header, text="Natureza", width=200, font=("Arial", 12, "bold")).pack(side="left", padx=5)
-        ctk.CTkLabel(header, text="Data", width=150, font=("Arial", 12, "bold")).pack(side="left", padx=5)
-        
-        # Lista de BOPMs
-        for doc in lista:
-            item_frame = ctk.CTkFrame(scroll_frame, fg_color="#34495E")
-            item_frame.pack(fill="x", pady=2, padx=5)
-            
-            numero = doc.get('numero_bopm', 'N/A')
-            infrator = doc.get('infrator', 'N/A')
-            natureza = doc.get('natureza', 'N/A')
-            data = doc.get('data_atualizacao', datetime.now())
-            
-            if isinstance(data, datetime):
-                data_str = data.strftime("%d/%m/%Y %H:%M")
-            else:
-                data_str = str(data)[:16] if data else "N/A"
-            
-            if infrator and len(infrator) > 25:
-                infrator = infrator[:25] + "..."
-            if natureza and len(natureza) > 25:
-                natureza = natureza[:25] + "..."
-            
-            ctk.CTkLabel(item_frame, text=numero, width=100, anchor="w").pack(side="left", padx=5, pady=8)
-            ctk.CTkLabel(item_frame, text=infrator, width=200, anchor="w").pack(side="left", padx=5, pady=8)
-            ctk.CTkLabel(item_frame, text=natureza, width=200, anchor="w").pack(side="left", padx=5, pady=8)
-            ctk.CTkLabel(item_frame, text=data_str, width=120, anchor="w").pack(side="left", padx=5, pady=8)
-            
-            # Botão carregar
-            btn_carregar = ctk.CTkButton(
-                item_frame,
-                text="Carregar",
-                width=80,
-                command=lambda n=numero: self.carregar_da_lista(n, janela_historico)
-            )
-            btn_carregar.pack(side="right", padx=5)
+        # Lista de BOPMs: só as linhas visíveis têm widgets; as páginas chegam ao rolar
+        tabela = TabelaVirtual(
+            frame,
+            colunas=[Coluna("numero_bopm", "Número", 100),
+                     Coluna("infrator", "Infrator", 200),
+                     Coluna("natureza", "Natureza", 200),
+                     Coluna("data_atualizacao", "Data", 120, self._formatar_data)],
+            carregar_pagina=self._paginar(
+                lambda token, ao_concluir, ao_falhar: self.backend.listar_pagina_db_async(
+                    50, token, ao_concluir=ao_concluir, ao_falhar=ao_falhar)
+            ),
+            acao=("Carregar", lambda registro: self.carregar_da_lista(registro.numero_bopm, janela_historico)),
+            ao_atualizar=ao_atualizar
+        )
+        tabela.pack(fill="both", expand=True, pady=10)
         
         # Botão fechar
         ctk.CTkButton(
@@ -676,57 +812,121 @@ BOPM #{dados['numero']} ({dados['infrator']})
             command=janela_historico.destroy,
             fg_color="gray"
         ).pack(pady=10)
+        
+        tabela.definir_registros(lista, proximo_token)
+        self.lbl_status.configure(text="", text_color="gray")
     
     def carregar_da_lista(self, numero: str, janela_historico):
         """Carrega BOPM selecionado do histórico"""
         logger.info(f"Carregando BOPM #{numero} do histórico")
         
-        doc, msg = self.backend.buscar_bopm_db(numero)
-        if doc:
-            self.popular_inputs(doc)
-            janela_historico.destroy()
-        else:
-            self.lbl_status.configure(text=msg, text_color="red")
+        def ao_concluir(resultado):
+            doc, msg = resultado
+            if doc:
+                self.popular_inputs(doc)
+                if janela_historico.winfo_exists():
+                    janela_historico.destroy()
+            else:
+                self.lbl_status.configure(text=msg, text_color="red")
+        
+        self.backend.buscar_bopm_db_async(numero, ao_concluir=ao_concluir)
 
-    def salvar_tudo(self):
-        try:
-            dados = self.coletar_inputs()
-            texto_final_atual = self.txt_output.get("1.0", "end-1c")
+    def versao_para_salvar(self, numero: str) -> int | None:
+        """Versão carregada na tela para o número informado (None = BOPM novo)"""
+        return self.versao_carregada if numero == self.numero_carregado else None
+    
+    def registrar_versao(self, numero: str, versao: int | None):
+        self.numero_carregado = numero
+        self.versao_carregada = versao
+    
+    def _salvar_em_serie(self, dados: dict, texto_final: str, forcar: bool, ao_concluir, ao_falhar):
+        """
+        Enfileira um salvamento: auto-save e salvamento manual rodam um de cada
+        vez, e cada um usa a versão registrada pelo anterior (sem falso conflito)
+        """
+        def iniciar():
+            def concluir(resultado):
+                try:
+                    ao_concluir(resultado)
+                finally:
+                    self._proximo_salvamento()
             
-            if not dados['numero']:
-                messagebox.showwarning("Aviso", "Número do BOPM é obrigatório", parent=self)
-                return
+            def falhar(e):
+                try:
+                    ao_falhar(e)
+                finally:
+                    self._proximo_salvamento()
+            
+            # A versão é lida só agora, depois que o salvamento anterior a registrou
+            self.backend.salvar_bopm_versionado_db_async(
+                dados, texto_final, self.versao_para_salvar(dados['numero']), forcar,
+                ao_concluir=concluir, ao_falhar=falhar
+            )
+        
+        self._fila_salvamentos.append(iniciar)
+        if len(self._fila_salvamentos) == 1:
+            iniciar()
+    
+    def _proximo_salvamento(self):
+        self._fila_salvamentos.popleft()
+        if self._fila_salvamentos:
+            self._fila_salvamentos[0]()
+    
+    def salvar_tudo(self, forcar: bool = False):
+        dados = self.coletar_inputs()
+        texto_final_atual = self.txt_output.get("1.0", "end-1c")
+        
+        if not dados['numero']:
+            messagebox.showwarning("Aviso", "Número do BOPM é obrigatório", parent=self)
+            return
+        
+        self.lbl_status.configure(text="⏳ Salvando...", text_color="gray")
+        logger.info(f"Tentando salvar BOPM #{dados.get('numero', 'N/A')}")
+        
+        def ao_salvar(resultado):
+            status, msg, versao = resultado
+            self.atualizar_status_conexao()
             
-            doc_existente, _ = self.backend.buscar_bopm_db(dados['numero'])
-            if doc_existente:
+            if status == SALVO_CONFLITO:
                 resposta = messagebox.askyesnocancel(
                     "BOPM Existente",
-                    f"BOPM #{dados['numero']} já existe.\n\nDeseja sobrescrever?",
+                    f"{msg}.\n\nDeseja sobrescrever?",
                     parent=self
                 )
-                if resposta is None or resposta is False:
+                if resposta:
+                    self.salvar_tudo(forcar=True)
+                else:
                     self.lbl_status.configure(text="Salvamento cancelado", text_color="gray")
-                    return
-            
-            logger.info(f"Tentando salvar BOPM #{dados.get('numero', 'N/A')}")
+                return
             
-            sucesso, msg = self.backend.salvar_bopm_db(dados, texto_final_atual)
+            sucesso = status in (SALVO_CRIADO, SALVO_ATUALIZADO, SALVO_OFFLINE)
             cor = "#58D68D" if sucesso else "red"
             self.lbl_status.configure(text=msg, text_color=cor)
             
             if sucesso:
+                self.registrar_versao(dados['numero'], versao)
                 logger.info(f"✓ BOPM #{dados['numero']} salvo")
                 messagebox.showinfo("Sucesso", "BOPM salvo com sucesso!", parent=self)
                 self.carregar_ultimos_bopms()
             else:
                 logger.warning(f"✗ Falha ao salvar: {msg}")
                 messagebox.showerror("Erro", f"Falha ao salvar:\n{msg}", parent=self)
-        except Exception as e:
+        
+        def ao_falhar(e):
             logger.error(f"Exceção ao salvar: {str(e)}")
             messagebox.showerror("Erro Crítico", f"Erro inesperado:\n{str(e)}", parent=self)
             self.lbl_status.configure(text="Erro ao salvar", text_color="red")
+        
+        self._salvar_em_serie(
+            dados, texto_final_atual, forcar,
+            ao_concluir=ao_salvar,
+            ao_falhar=ao_falhar
+        )
 
     def iniciar_geracao(self):
+        if self.cancelamento_ia is not None:
+            # Já há uma geração em andamento (ex.: Ctrl+G repetido)
+            return
         try:
             dados = self.coletar_inputs()
             
@@ -739,29 +939,113 @@ BOPM #{dados['numero']} ({dados['infrator']})
 
             logger.info("Iniciando geração de texto pela IA")
             self.btn_gerar.configure(state="disabled", text="⏳ Processando IA...")
-            threading.Thread(target=self.executar_backend, args=(dados,), daemon=True).start()
+            token = TokenCancelamento(Config.IA_PRAZO_TOTAL_S)
+            self.cancelamento_ia = token
+            self.btn_cancelar.pack(fill="x", pady=(0, 5), after=self.btn_gerar)
+            if Config.IA_STREAMING:
+                self._iniciar_streaming(dados, token)
+                return
+            self.backend.executor.executar(
+                self.executar_backend, dados, token,
+                ao_concluir=lambda texto: self._se_geracao_atual(token, self.atualizar_ui_pos_processamento, texto),
+                ao_falhar=lambda e: self._se_geracao_atual(token, self._falha_geracao, e),
+                pool="ia"
+            )
         except Exception as e:
             logger.error(f"Erro ao iniciar geração: {str(e)}")
             messagebox.showerror("Erro", f"Erro ao iniciar geração:\n{str(e)}", parent=self)
             self.lbl_status.configure(text="Erro", text_color="red")
 
-    def executar_backend(self, dados):
-        try:
-            relato_formal = self.backend.gerar_texto_ia(dados['rascunho'], dados['natureza'])
-            texto_completo = self.formatar_bopm_template(dados, relato_formal)
-            self.after(0, lambda: self.atualizar_ui_pos_processamento(texto_completo))
-        except Exception as e:
-            logger.error(f"Erro no processamento: {str(e)}", exc_info=True)
-            erro_msg = f"Erro ao gerar texto:\n{str(e)}"
-            self.after(0, lambda: messagebox.showerror("Erro de Processamento", erro_msg, parent=self))
-            self.after(0, lambda: self.lbl_status.configure(text="Erro na IA", text_color="red"))
-            self.after(0, lambda: self.btn_gerar.configure(state="normal", text="GERAR / ATUALIZAR TEMPLATE"))
+    def executar_backend(self, dados, cancelamento=None) -> str:
+        """Executa no worker de IA; o resultado é entregue na thread da UI"""
+        relato_formal = self.backend.gerar_texto_ia(dados['rascunho'], dados['natureza'], cancelamento)
+        return self.formatar_bopm_template(dados, relato_formal)
+
+    def _se_geracao_atual(self, token, callback, *args):
+        """Só repassa resultados da geração corrente (as canceladas são ignoradas)"""
+        if token is self.cancelamento_ia:
+            callback(*args)
+
+    def _encerrar_geracao(self):
+        self.cancelamento_ia = None
+        self.btn_cancelar.pack_forget()
+        self.btn_gerar.configure(state="normal", text="GERAR / ATUALIZAR TEMPLATE")
+
+    def cancelar_geracao(self):
+        """Cancela a geração em andamento e libera a interface imediatamente"""
+        if self.cancelamento_ia is None:
+            return
+        self.cancelamento_ia.cancelar()
+        self._encerrar_geracao()
+        self.lbl_status.configure(text="✖ Geração cancelada", text_color="orange")
+        logger.info("Geração de texto cancelada pelo usuário")
+
+    def _iniciar_streaming(self, dados, token):
+        """Exibe o cabeçalho do template já e preenche o relato conforme a IA responde"""
+        cabecalho, rodape = self.partes_template(dados)
+        self.txt_output.delete("1.0", "end")
+        self.txt_output.insert("1.0", cabecalho + rodape)
+        # Marcas delimitando o relato: o início fica parado, o fim avança com o texto
+        posicao = f"1.0 + {len(cabecalho)} chars"
+        self.txt_output.mark_set("relato_inicio", posicao)
+        self.txt_output.mark_gravity("relato_inicio", "left")
+        self.txt_output.mark_set("relato_fim", posicao)
+        self.txt_output.mark_gravity("relato_fim", "right")
+        self.lbl_status.configure(text="⏳ Recebendo texto da IA...", text_color="#3498DB")
+        
+        acumulador = self.backend.executor.criar_acumulador(
+            lambda trecho: self._se_geracao_atual(token, self._anexar_relato, trecho)
+        )
+        
+        def reiniciar():
+            acumulador.descartar()
+            self.backend.executor.chamar_na_ui(self._se_geracao_atual, token, self._substituir_relato, "")
+        
+        self.backend.executor.executar(
+            self.backend.gerar_texto_ia_stream, dados['rascunho'], dados['natureza'],
+            acumulador.adicionar, reiniciar, token,
+            ao_concluir=lambda relato: self._se_geracao_atual(token, self._concluir_streaming, relato),
+            ao_falhar=lambda e: self._se_geracao_atual(token, self._falha_geracao, e),
+            pool="ia"
+        )
+    
+    def _anexar_relato(self, trecho):
+        self.txt_output.insert("relato_fim", trecho)
+        self.txt_output.see("relato_fim")
+    
+    def _substituir_relato(self, texto):
+        self.txt_output.delete("relato_inicio", "relato_fim")
+        self.txt_output.insert("relato_fim", texto)
+    
+    def _concluir_streaming(self, relato_final):
+        """Garante que o relato exibido é exatamente o texto final (também gravado no cache)"""
+        self._substituir_relato(relato_final)
+        self._encerrar_geracao()
+        self.lbl_status.configure(
+            text="✓ Texto gerado pela IA. Revise antes de salvar.", 
+            text_color="#3498DB"
+        )
+        logger.info("Texto gerado (streaming) e exibido na interface")
+    
+    def _falha_geracao(self, e):
+        self._encerrar_geracao()
+        if isinstance(e, PrazoExcedido):
+            logger.warning("Prazo da geração de texto excedido")
+            self.lbl_status.configure(text="⏱ IA não respondeu dentro do prazo", text_color="orange")
+            messagebox.showwarning("IA", f"A IA não respondeu em {Config.IA_PRAZO_TOTAL_S}s. Tente novamente.", parent=self)
+            return
+        if isinstance(e, GeracaoCancelada):
+            self.lbl_status.configure(text="✖ Geração cancelada", text_color="orange")
+            return
+        logger.error(f"Erro no processamento: {str(e)}", exc_info=e)
+        messagebox.showerror("Erro de Processamento", f"Erro ao gerar texto:\n{str(e)}", parent=self)
+        self.lbl_status.configure(text="Erro na IA", text_color="red")
 
     def atualizar_ui_pos_processamento(self, texto):
         """Atualiza UI após processamento"""
         self.txt_output.delete("1.0", "end")
         self.txt_output.insert("1.0", texto)
-        self.btn_gerar.configure(state="normal", text="GERAR / ATUALIZAR TEMPLATE")
+        self._encerrar_geracao()
         self.lbl_status.configure(
             text="✓ Texto gerado pela IA. Revise antes de salvar.", 
             text_color="#3498DB"
@@ -786,8 +1070,7 @@ if __name__ == "__main__":
     # Cleanup ao fechar
     def ao_fechar():
         logger.info("Encerrando aplicação...")
-        if app.backend.db:
-            app.backend.db.fechar_conexao()
+        app.backend.encerrar()
         app.destroy()
     
     app.protocol("WM_DELETE_WINDOW", ao_fechar)
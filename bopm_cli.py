@@ -0,0 +1,271 @@
+"""
+Interface de Linha de Comando do BOPM
+Operações em lote sobre o banco sem abrir a interface gráfica
+
+Exemplos:
+    python bopm_cli.py exportar ocorrencias.jsonl
+    python bopm_cli.py importar ocorrencias.csv --lote 2000
+    python bopm_cli.py estatisticas --reconstruir
+    python bopm_cli.py gerar-lote rascunhos.jsonl formalizados.jsonl --concorrencia 8
+    python bopm_cli.py semear-cache-ia
+    python bopm_cli.py chaves rotacionar
+    python bopm_cli.py chaves recriptografar --pausa 0.2
+"""
+import argparse
+import csv
+import json
+import logging
+import sys
+from pathlib import Path
+
+from config import Config
+
+logger = logging.getLogger("bopm_cli")
+
+
+def _formato(caminho: str, formato: str | None) -> str:
+    if formato:
+        return formato
+    return "csv" if Path(caminho).suffix.lower() == ".csv" else "jsonl"
+
+
+def _abrir_banco():
+    from database import BOPMDatabase
+
+    db = BOPMDatabase()
+    if not db.aguardar_conexao(Config.CLI_CONNECT_TIMEOUT_S):
+        logger.error("✗ Não foi possível conectar ao MongoDB")
+        db.fechar_conexao()
+        sys.exit(1)
+    return db
+
+
+def cmd_exportar(args) -> int:
+    db = _abrir_banco()
+    try:
+        with open(args.arquivo, "w", encoding="utf-8", newline="") as destino:
+            total, msg = db.exportar_stream(destino, _formato(args.arquivo, args.formato), args.lote)
+        print(msg)
+        return 0 if msg.startswith("✓") else 1
+    finally:
+        db.fechar_conexao()
+
+
+def cmd_importar(args) -> int:
+    db = _abrir_banco()
+    try:
+        with open(args.arquivo, "r", encoding="utf-8", newline="") as origem:
+            estatisticas = db.importar_lote(origem, _formato(args.arquivo, args.formato), args.lote)
+        print(estatisticas["mensagem"])
+        return 0 if estatisticas["erros"] == 0 and estatisticas["mensagem"].startswith("✓") else 1
+    finally:
+        db.fechar_conexao()
+
+
+def cmd_estatisticas(args) -> int:
+    db = _abrir_banco()
+    try:
+        if args.reconstruir:
+            sucesso, msg = db.reconstruir_estatisticas()
+            print(msg)
+            if not sucesso:
+                return 1
+        contadores, msg = db.obter_estatisticas_bopms()
+        if contadores is None:
+            print(msg)
+            return 1
+        print(f"Total de BOPMs: {contadores['total']}")
+        for dimensao in ("natureza", "encarregado", "dia"):
+            print(f"\nPor {dimensao}:")
+            ordenados = sorted(contadores[dimensao].items(),
+                               key=lambda item: item[0] if dimensao == "dia" else -item[1])
+            for chave, contagem in ordenados:
+                print(f"  {chave}: {contagem}")
+        return 0
+    finally:
+        db.fechar_conexao()
+
+
+def _ler_rascunhos(arquivo: str, formato: str):
+    """Lê itens do lote; aceita também o formato gerado por 'exportar'"""
+    with open(arquivo, "r", encoding="utf-8", newline="") as origem:
+        if formato == "csv":
+            registros = list(csv.DictReader(origem))
+        else:
+            registros = [json.loads(linha) for linha in origem if linha.strip()]
+    for indice, registro in enumerate(registros, 1):
+        yield {
+            "id": registro.get("id") or registro.get("numero_bopm") or str(indice),
+            "rascunho": registro.get("rascunho") or registro.get("rascunho_original", ""),
+            "natureza": registro.get("natureza", ""),
+        }
+
+
+def cmd_gerar_lote(args) -> int:
+    from ai_service import GeminiAIService
+
+    itens = list(_ler_rascunhos(args.entrada, _formato(args.entrada, args.formato)))
+    servico = GeminiAIService()
+    try:
+        lote = servico.gerar_lote(itens, concorrencia=args.concorrencia, usar_cache=not args.sem_cache)
+    finally:
+        servico.encerrar()
+
+    with open(args.saida, "w", encoding="utf-8") as destino:
+        for resultado in lote["resultados"]:
+            destino.write(json.dumps(resultado, ensure_ascii=False) + "\n")
+
+    resumo = lote["resumo"]
+    print(f"{resumo['sucessos']}/{resumo['total']} gerados, {resumo['do_cache']} do cache, "
+          f"{resumo['falhas']} falhas")
+    if "segundos" in resumo:
+        print(f"{resumo['segundos']}s ({resumo['itens_por_min']} itens/min), "
+              f"p50 {resumo['latencia_p50_s']}s, p95 {resumo['latencia_p95_s']}s, "
+              f"espera por cota {resumo['limitador']['segundos_em_espera']}s")
+    return 0 if resumo["falhas"] == 0 else 1
+
+
+def cmd_semear_cache_ia(args) -> int:
+    from ai_service import GeminiAIService
+    from cache_compartilhado import CacheCompartilhado
+
+    db = _abrir_banco()
+    servico = GeminiAIService(cache_compartilhado=CacheCompartilhado(db.colecao_cache_ia))
+    try:
+        estatisticas = servico.semear_cache_compartilhado(db.iterar_rascunhos_formalizados(args.lote))
+    except Exception as e:
+        print(f"✗ Erro ao semear cache compartilhado: {str(e)}")
+        return 1
+    finally:
+        servico.encerrar()
+        db.fechar_conexao()
+
+    print(f"✓ {estatisticas['inseridos']} textos adicionados ao cache compartilhado "
+          f"({estatisticas['existentes']} já existiam, {estatisticas['ignorados']} ignorados)")
+    return 0
+
+
+def cmd_chaves(args) -> int:
+    from security import security
+    from recriptografia import agendar_recriptografia, ler_checkpoint
+    from user_settings import settings
+
+    if args.acao == "status":
+        for id_chave in security.ids_chaves():
+            marcas = [m for m, i in (("ativa", security.id_chave), ("blind index", security.id_indice)) if i == id_chave]
+            print(f"{id_chave}{'  (' + ', '.join(marcas) + ')' if marcas else ''}")
+        pendente = ler_checkpoint()
+        if pendente:
+            modo = "criptografar" if pendente["criptografar"] else "descriptografar"
+            print(f"\nRecriptografia pendente ({modo}): {pendente['processados']} documentos processados")
+        return 0
+
+    if args.acao == "rotacionar":
+        # A nova chave é publicada no chaveiro compartilhado do banco
+        db = _abrir_banco()
+        try:
+            id_chave = security.rotacionar_chave()
+        except (ValueError, ConnectionError) as e:
+            print(f"✗ {e}")
+            return 1
+        finally:
+            db.fechar_conexao()
+        print(f"✓ Nova chave ativa: {id_chave}")
+        if not settings.get("security", "encrypt_sensitive_data", False):
+            return 0
+        agendar_recriptografia(True)
+        print("Recriptografia agendada: o app a executa em segundo plano ao conectar,"
+              " ou rode 'chaves recriptografar'")
+        return 0
+
+    criptografar = {"criptografar": True, "descriptografar": False}.get(args.modo)
+    db = _abrir_banco()
+    try:
+        concluido, msg = db.recriptografar(criptografar, tamanho_lote=args.lote, pausa_s=args.pausa)
+    except KeyboardInterrupt:
+        concluido, msg = False, "Interrompido (o progresso foi salvo)"
+    finally:
+        db.fechar_conexao()
+    print(msg)
+    return 0 if concluido else 1
+
+
+def cmd_compressao(args) -> int:
+    db = _abrir_banco()
+    try:
+        if args.acao == "treinar":
+            sucesso, msg = db.treinar_dicionario_compressao(args.amostras)
+            print(msg)
+            return 0 if sucesso else 1
+
+        resultados, msg = db.benchmark_compressao(args.amostras)
+    finally:
+        db.fechar_conexao()
+    if resultados is None:
+        print(msg)
+        return 1
+    print(msg)
+    print(f"{'método':<18}{'bytes':>12}{'razão':>8}{'comprimir µs':>15}{'descomprimir µs':>18}")
+    for metodo, r in resultados.items():
+        print(f"{metodo:<18}{r['bytes']:>12}{r['razao']:>8}{r['comprimir_us']:>15}{r['descomprimir_us']:>18}")
+    return 0
+
+
+def criar_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Ferramentas de linha de comando do Gerador de BOPM")
+    sub = parser.add_subparsers(dest="comando", required=True)
+
+    p = sub.add_parser("exportar", help="Exporta a coleção de ocorrências (JSONL/CSV)")
+    p.add_argument("arquivo", help="Arquivo de destino")
+    p.add_argument("--formato", choices=["jsonl", "csv"], help="Padrão: pela extensão")
+    p.add_argument("--lote", type=int, default=Config.EXPORT_BATCH_SIZE, help="batch_size do cursor")
+    p.set_defaults(func=cmd_exportar)
+
+    p = sub.add_parser("importar", help="Importa ocorrências (JSONL/CSV) com validação e upsert")
+    p.add_argument("arquivo", help="Arquivo de origem")
+    p.add_argument("--formato", choices=["jsonl", "csv"], help="Padrão: pela extensão")
+    p.add_argument("--lote", type=int, default=Config.IMPORT_BATCH_SIZE, help="Operações por bulk_write")
+    p.set_defaults(func=cmd_importar)
+
+    p = sub.add_parser("estatisticas", help="Exibe os contadores materializados")
+    p.add_argument("--reconstruir", action="store_true", help="Recalcula por agregação antes de exibir")
+    p.set_defaults(func=cmd_estatisticas)
+
+    p = sub.add_parser("gerar-lote", help="Formaliza vários rascunhos via IA (JSONL/CSV -> JSONL)")
+    p.add_argument("entrada", help="Arquivo com id/numero_bopm, rascunho/rascunho_original e natureza")
+    p.add_argument("saida", help="Arquivo JSONL de resultados")
+    p.add_argument("--formato", choices=["jsonl", "csv"], help="Formato da entrada (padrão: pela extensão)")
+    p.add_argument("--concorrencia", type=int, default=Config.IA_LOTE_CONCORRENCIA,
+                   help="Chamadas simultâneas à API")
+    p.add_argument("--sem-cache", action="store_true", help="Ignora o cache (ex.: após mudar o prompt)")
+    p.set_defaults(func=cmd_gerar_lote)
+
+    p = sub.add_parser("semear-cache-ia", help="Semeia o cache compartilhado da IA com os BOPMs já salvos")
+    p.add_argument("--lote", type=int, default=Config.EXPORT_BATCH_SIZE, help="batch_size do cursor")
+    p.set_defaults(func=cmd_semear_cache_ia)
+
+    p = sub.add_parser("chaves", help="Chaveiro de criptografia e recriptografia da coleção")
+    p.add_argument("acao", choices=["status", "rotacionar", "recriptografar"])
+    p.add_argument("--modo", choices=["criptografar", "descriptografar"],
+                   help="Padrão: retoma o job pendente ou segue a configuração atual")
+    p.add_argument("--lote", type=int, default=Config.REENCRYPT_BATCH_SIZE, help="Documentos por lote")
+    p.add_argument("--pausa", type=float, default=Config.REENCRYPT_PAUSA_S, help="Segundos entre lotes")
+    p.set_defaults(func=cmd_chaves)
+
+    p = sub.add_parser("compressao", help="Treina o dicionário zstd ou mede a compressão no acervo")
+    p.add_argument("acao", choices=["treinar", "benchmark"])
+    p.add_argument("--amostras", type=int, default=Config.COMPRESSION_DICT_SAMPLES,
+                   help="Documentos sorteados da coleção")
+    p.set_defaults(func=cmd_compressao)
+
+    return parser
+
+
+def main(argv=None) -> int:
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    args = criar_parser().parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,174 @@
+"""
+Módulo de Cache Compartilhado da IA (MongoDB)
+Segunda camada do cache de textos gerados, comum a todas as estações:
+um rascunho já formalizado em qualquer máquina não é pago de novo
+"""
+import logging
+from datetime import datetime
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+from pymongo import UpdateOne
+
+from config import Config
+from security import security
+from user_settings import settings
+
+logger = logging.getLogger(__name__)
+
+MARCADOR_RELATO = "**Relato dos Fatos:**\n"
+MARCADOR_NATUREZA = "\n\n**Natureza dos Fatos:**"
+
+
+def extrair_relato(texto_final: str) -> Optional[str]:
+    """Recorta o relato formal de um BOPM montado pelo template (None se não encontrado)"""
+    inicio = texto_final.find(MARCADOR_RELATO)
+    if inicio < 0:
+        return None
+    inicio += len(MARCADOR_RELATO)
+    fim = texto_final.find(MARCADOR_NATUREZA, inicio)
+    relato = texto_final[inicio:fim if fim >= 0 else len(texto_final)].strip()
+    return relato or None
+
+
+class CacheCompartilhado:
+    """
+    Cache de textos gerados em uma coleção MongoDB com índice TTL
+
+    Documentos: {_id: chave, texto, modelo, impressao, origem, criado_em}.
+    A coleção é obtida a cada uso, de modo que, sem conexão, o cache é
+    simplesmente ignorado em vez de bloquear a geração.
+    """
+
+    def __init__(self, obter_colecao: Callable[[], Optional[object]]):
+        """
+        Args:
+            obter_colecao: Retorna a coleção do cache ou None se o banco estiver offline
+        """
+        self._obter_colecao = obter_colecao
+        self.hits = 0
+        self.misses = 0
+        self.erros = 0
+
+    @staticmethod
+    def criar_indices(colecao) -> None:
+        """Índice TTL que descarta entradas antigas (idempotente)"""
+        colecao.create_index("criado_em", expireAfterSeconds=Config.AI_SHARED_CACHE_TTL_S)
+
+    @staticmethod
+    def _cifrar(texto: str) -> str:
+        if settings.get("security", "encrypt_sensitive_data", False):
+            return security.encrypt(texto)
+        return texto
+
+    @staticmethod
+    def _decifrar(texto: str) -> Optional[str]:
+        """Texto puro é devolvido como está; None se o envelope não puder ser aberto"""
+        resultado = security.descriptografar_campo(texto)
+        if security.criptografado(resultado):
+            # Chave ausente nesta estação: nunca entregar ciphertext como texto gerado
+            return None
+        return resultado
+
+    def get(self, chave: str, impressao: str) -> Optional[Tuple[str, str]]:
+        """
+        Busca um texto gerado com a mesma configuração de modelos/prompt
+
+        Returns:
+            Tupla (texto, modelo) ou None
+        """
+        colecao = self._obter_colecao()
+        if colecao is None:
+            return None
+        try:
+            documento = colecao.find_one(
+                {"_id": chave, "impressao": impressao},
+                {"texto": 1, "modelo": 1},
+                max_time_ms=Config.AI_SHARED_CACHE_TIMEOUT_MS
+            )
+        except Exception as e:
+            self.erros += 1
+            logger.warning(f"Falha ao ler cache compartilhado: {str(e)}")
+            return None
+        texto = self._decifrar(documento["texto"]) if documento is not None else None
+        if texto is None:
+            if documento is not None:
+                logger.warning(f"Entrada {chave[:12]} do cache compartilhado ilegível nesta estação")
+            self.misses += 1
+            return None
+        self.hits += 1
+        return texto, documento.get("modelo", "")
+
+    def put(self, chave: str, impressao: str, texto: str, modelo: str) -> None:
+        """Grava (ou renova) um texto gerado pela API"""
+        colecao = self._obter_colecao()
+        if colecao is None:
+            return
+        try:
+            colecao.update_one(
+                {"_id": chave},
+                {"$set": {
+                    "texto": self._cifrar(texto),
+                    "modelo": modelo,
+                    "impressao": impressao,
+                    "origem": "api",
+                    "criado_em": datetime.now(),
+                }},
+                upsert=True
+            )
+        except Exception as e:
+            self.erros += 1
+            logger.warning(f"Falha ao gravar cache compartilhado: {str(e)}")
+
+    def semear(self, entradas: Iterable[Tuple[str, str]], impressao: str,
+               tamanho_lote: int = Config.IMPORT_BATCH_SIZE) -> Dict:
+        """
+        Insere entradas vindas de BOPMs já salvos, sem sobrescrever as existentes
+
+        Args:
+            entradas: Pares (chave, texto)
+            impressao: Impressão da configuração de geração atual
+            tamanho_lote: Operações por bulk_write
+
+        Returns:
+            Dicionário com lidos, inseridos e existentes
+        """
+        colecao = self._obter_colecao()
+        if colecao is None:
+            raise ConnectionError("Banco de dados offline")
+
+        estatisticas = {"lidos": 0, "inseridos": 0, "existentes": 0}
+        operacoes = []
+
+        def enviar():
+            resultado = colecao.bulk_write(operacoes, ordered=False)
+            estatisticas["inseridos"] += resultado.upserted_count
+            estatisticas["existentes"] += len(operacoes) - resultado.upserted_count
+            operacoes.clear()
+
+        for chave, texto in entradas:
+            estatisticas["lidos"] += 1
+            operacoes.append(UpdateOne(
+                {"_id": chave},
+                {"$setOnInsert": {
+                    "texto": self._cifrar(texto),
+                    "modelo": "",
+                    "impressao": impressao,
+                    "origem": "backfill",
+                    "criado_em": datetime.now(),
+                }},
+                upsert=True
+            ))
+            if len(operacoes) >= tamanho_lote:
+                enviar()
+        if operacoes:
+            enviar()
+        return estatisticas
+
+    def estatisticas(self) -> Dict:
+        consultas = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / consultas * 100, 1) if consultas else 0.0,
+            "erros": self.erros,
+        }
@@ -0,0 +1,191 @@
+"""
+Módulo de Cache de Documentos
+Cache read-through, limitado em bytes, dos BOPMs já descriptografados,
+invalidado por escritas locais e pelo change stream do MongoDB
+"""
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, Hashable, List, Optional, Tuple
+
+import bson
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+class CacheDocumentos:
+    """
+    LRU de documentos (guardados como BSON) com índice secundário por _id.
+    Só responde enquanto há um change stream ativo garantindo a invalidação.
+    """
+
+    def __init__(self, max_bytes: int = Config.DOC_CACHE_MAX_BYTES,
+                 max_consultas: int = Config.DOC_CACHE_MAX_CONSULTAS):
+        self.max_bytes = max_bytes
+        self.max_consultas = max_consultas
+        self._lock = threading.Lock()
+        self._documentos: "OrderedDict[str, Tuple[bytes, object]]" = OrderedDict()
+        self._por_id: Dict = {}
+        self._consultas: "OrderedDict[Hashable, Tuple[List[bytes], object]]" = OrderedDict()
+        self._bytes = 0
+        self._geracao = 0
+        self.ativo = False
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidacoes = 0
+
+    # === CONTROLE ===
+    def ativar(self) -> None:
+        """Habilita o cache (chamado quando o change stream começa a ser lido)"""
+        with self._lock:
+            self._limpar()
+            self.ativo = True
+
+    def desativar(self) -> None:
+        """Desabilita e esvazia o cache (invalidação remota deixou de ser garantida)"""
+        with self._lock:
+            self.ativo = False
+            self._limpar()
+
+    def geracao(self) -> int:
+        """Marcador a ser lido antes de consultar o banco (ver inserir)"""
+        with self._lock:
+            return self._geracao
+
+    def _limpar(self) -> None:
+        self._documentos.clear()
+        self._por_id.clear()
+        self._consultas.clear()
+        self._bytes = 0
+        self._geracao += 1
+
+    # === DOCUMENTOS ===
+    def obter(self, numero_bopm: str) -> Optional[Dict]:
+        """Retorna uma cópia do documento em cache (None em miss)"""
+        with self._lock:
+            if not self.ativo:
+                return None
+            entrada = self._documentos.get(numero_bopm)
+            if entrada is None:
+                self.misses += 1
+                return None
+            dados = entrada[0]
+            self._documentos.move_to_end(numero_bopm)
+            self.hits += 1
+        return bson.decode(dados)
+
+    def inserir(self, documento: Dict, geracao: int) -> None:
+        """
+        Guarda um documento lido do banco
+
+        Args:
+            documento: Documento já descriptografado
+            geracao: Valor de geracao() lido antes da consulta; se houve
+                invalidação desde então, o documento pode estar obsoleto e é descartado
+        """
+        dados = bson.encode(documento)
+        if len(dados) > self.max_bytes:
+            return
+        numero = documento["numero_bopm"]
+
+        with self._lock:
+            if not self.ativo or geracao != self._geracao:
+                return
+            self._remover(numero)
+            doc_id = documento.get("_id")
+            self._documentos[numero] = (dados, doc_id)
+            self._bytes += len(dados)
+            if doc_id is not None:
+                self._por_id[doc_id] = numero
+            while self._bytes > self.max_bytes:
+                antigo = next(iter(self._documentos))
+                self._remover(antigo)
+                self.evictions += 1
+
+    def _remover(self, numero_bopm: str) -> bool:
+        entrada = self._documentos.pop(numero_bopm, None)
+        if entrada is None:
+            return False
+        dados, doc_id = entrada
+        self._bytes -= len(dados)
+        self._por_id.pop(doc_id, None)
+        return True
+
+    # === CONSULTAS (listas) ===
+    def obter_consulta(self, chave: Hashable) -> Optional[Tuple[List[Dict], object]]:
+        """Retorna (documentos, extra) de uma listagem em cache"""
+        with self._lock:
+            if not self.ativo:
+                return None
+            entrada = self._consultas.get(chave)
+            if entrada is None:
+                self.misses += 1
+                return None
+            self._consultas.move_to_end(chave)
+            self.hits += 1
+        itens, extra = entrada
+        return [bson.decode(dados) for dados in itens], extra
+
+    def inserir_consulta(self, chave: Hashable, documentos: List[Dict], geracao: int,
+                         extra=None) -> None:
+        """
+        Guarda o resultado de uma listagem (descartado na próxima invalidação)
+
+        Args:
+            chave: Identificação da consulta
+            documentos: Resultado já descriptografado
+            geracao: Valor de geracao() lido antes da consulta
+            extra: Valor adicional devolvido junto (ex.: token da próxima página)
+        """
+        itens = [bson.encode(documento) for documento in documentos]
+        with self._lock:
+            if not self.ativo or geracao != self._geracao:
+                return
+            self._consultas[chave] = (itens, extra)
+            self._consultas.move_to_end(chave)
+            while len(self._consultas) > self.max_consultas:
+                self._consultas.popitem(last=False)
+
+    # === INVALIDAÇÃO ===
+    def invalidar(self, numero_bopm: Optional[str] = None, doc_id=None) -> None:
+        """
+        Remove um documento (por número ou _id) e todas as listagens em cache
+
+        Args:
+            numero_bopm: Número do BOPM alterado
+            doc_id: _id do documento alterado (eventos do change stream)
+        """
+        with self._lock:
+            if numero_bopm is None and doc_id is not None:
+                numero_bopm = self._por_id.get(doc_id)
+            if numero_bopm is not None:
+                self._remover(numero_bopm)
+            self._consultas.clear()
+            self._geracao += 1
+            self.invalidacoes += 1
+
+    def limpar(self) -> None:
+        """Esvazia o cache mantendo o estado ativo"""
+        with self._lock:
+            self._limpar()
+            self.invalidacoes += 1
+
+    def estatisticas(self) -> Dict:
+        """Retorna métricas do cache"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "ativo": self.ativo,
+                "documentos": len(self._documentos),
+                "consultas": len(self._consultas),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": f"{self.hits / total * 100:.1f}%" if total else "0.0%",
+                "evictions": self.evictions,
+                "invalidacoes": self.invalidacoes,
+            }
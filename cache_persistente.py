@@ -0,0 +1,155 @@
+"""
+Módulo de Cache Persistente da IA
+Segunda camada (SQLite em modo WAL) abaixo do LRUCache em memória:
+sobrevive a reinícios, com expiração por TTL e limite de tamanho em bytes
+"""
+import logging
+import sqlite3
+import threading
+import time
+from typing import Dict, Optional
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+class CachePersistente:
+    """Cache chave -> texto em disco, lido sob demanda (nada é carregado na abertura)"""
+
+    def __init__(self, caminho: str = Config.AI_CACHE_PATH,
+                 ttl_s: float = Config.AI_CACHE_TTL_S,
+                 max_bytes: int = Config.AI_CACHE_MAX_BYTES):
+        self.ttl_s = ttl_s
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.expirados = 0
+        self.removidos_tamanho = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(caminho, check_same_thread=False, isolation_level=None)
+        # WAL: escrita atômica e leitores nunca veem um registro pela metade após queda
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS entradas ("
+            " chave TEXT PRIMARY KEY,"
+            " valor TEXT NOT NULL,"
+            " tamanho INTEGER NOT NULL,"
+            " modelo TEXT,"
+            " criado_em REAL NOT NULL,"
+            " acessado_em REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_entradas_acesso ON entradas (acessado_em)")
+        self._bytes = self._conn.execute("SELECT COALESCE(SUM(tamanho), 0) FROM entradas").fetchone()[0]
+        self.purgar_expirados()
+
+    def get(self, chave: str) -> Optional[str]:
+        """Busca um texto; entradas expiradas contam como miss e são removidas"""
+        agora = time.time()
+        with self._lock:
+            linha = self._conn.execute(
+                "SELECT valor, tamanho, criado_em FROM entradas WHERE chave = ?", (chave,)
+            ).fetchone()
+            if linha is None:
+                self.misses += 1
+                return None
+            valor, tamanho, criado_em = linha
+            if agora - criado_em > self.ttl_s:
+                self._conn.execute("DELETE FROM entradas WHERE chave = ?", (chave,))
+                self._bytes -= tamanho
+                self.expirados += 1
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE entradas SET acessado_em = ? WHERE chave = ?", (agora, chave))
+            self.hits += 1
+        return valor
+
+    def put(self, chave: str, valor: str, modelo: Optional[str] = None) -> None:
+        """Grava (ou substitui) um texto e aplica o limite de tamanho"""
+        tamanho = len(valor.encode("utf-8"))
+        if tamanho > self.max_bytes:
+            return
+        agora = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                anterior = self._conn.execute(
+                    "SELECT tamanho FROM entradas WHERE chave = ?", (chave,)
+                ).fetchone()
+                self._conn.execute(
+                    "INSERT INTO entradas (chave, valor, tamanho, modelo, criado_em, acessado_em) "
+                    "VALUES (?, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT(chave) DO UPDATE SET valor = excluded.valor, "
+                    "tamanho = excluded.tamanho, modelo = excluded.modelo, "
+                    "criado_em = excluded.criado_em, acessado_em = excluded.acessado_em",
+                    (chave, valor, tamanho, modelo, agora, agora)
+                )
+                self._bytes += tamanho - (anterior[0] if anterior else 0)
+                self._aplicar_limite()
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                self._bytes = self._conn.execute(
+                    "SELECT COALESCE(SUM(tamanho), 0) FROM entradas"
+                ).fetchone()[0]
+                raise
+
+    def _aplicar_limite(self) -> None:
+        # Remove as entradas menos recentemente acessadas até caber no orçamento
+        while self._bytes > self.max_bytes:
+            linhas = self._conn.execute(
+                "SELECT chave, tamanho FROM entradas ORDER BY acessado_em LIMIT 64"
+            ).fetchall()
+            if not linhas:
+                break
+            for chave, tamanho in linhas:
+                if self._bytes <= self.max_bytes:
+                    break
+                self._conn.execute("DELETE FROM entradas WHERE chave = ?", (chave,))
+                self._bytes -= tamanho
+                self.removidos_tamanho += 1
+
+    def purgar_expirados(self) -> int:
+        """Remove todas as entradas com TTL vencido"""
+        limite = time.time() - self.ttl_s
+        with self._lock:
+            removidos, liberados = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(tamanho), 0) FROM entradas WHERE criado_em < ?", (limite,)
+            ).fetchone()
+            if removidos:
+                self._conn.execute("DELETE FROM entradas WHERE criado_em < ?", (limite,))
+                self._bytes -= liberados
+                self.expirados += removidos
+        return removidos
+
+    def clear(self) -> None:
+        """Remove todas as entradas"""
+        with self._lock:
+            self._conn.execute("DELETE FROM entradas")
+            self._bytes = 0
+            self.hits = 0
+            self.misses = 0
+
+    def tamanho(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM entradas").fetchone()[0]
+
+    def estatisticas(self) -> Dict:
+        """Retorna estatísticas do cache em disco"""
+        total = self.hits + self.misses
+        return {
+            "tamanho": self.tamanho(),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "ttl_s": self.ttl_s,
+            "hits": self.hits,
+            "misses": self.misses,
+            "taxa_acerto": (self.hits / total) * 100 if total else 0.0,
+            "expirados": self.expirados,
+            "removidos_tamanho": self.removidos_tamanho,
+        }
+
+    def fechar(self) -> None:
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,61 @@
+"""
+Módulo de Cancelamento e Prazos
+Token compartilhado entre a interface e os workers de IA para cancelar
+uma geração ou encerrá-la quando o prazo total expira
+"""
+import threading
+import time
+from typing import Optional
+
+
+class GeracaoCancelada(Exception):
+    """A geração foi cancelada pelo usuário"""
+    pass
+
+
+class PrazoExcedido(GeracaoCancelada):
+    """A geração ultrapassou o prazo total"""
+    pass
+
+
+class TokenCancelamento:
+    """Sinal de cancelamento com prazo opcional (thread-safe)"""
+
+    def __init__(self, prazo_s: Optional[float] = None):
+        self._evento = threading.Event()
+        self.limite = time.monotonic() + prazo_s if prazo_s is not None else None
+
+    def cancelar(self) -> None:
+        """Solicita o cancelamento"""
+        self._evento.set()
+
+    @property
+    def cancelado(self) -> bool:
+        return self._evento.is_set() or self.expirado
+
+    @property
+    def expirado(self) -> bool:
+        return self.limite is not None and time.monotonic() >= self.limite
+
+    def restante(self) -> Optional[float]:
+        """Segundos até o prazo (None se não há prazo)"""
+        if self.limite is None:
+            return None
+        return max(0.0, self.limite - time.monotonic())
+
+    def limitar(self, segundos: float) -> float:
+        """Reduz um tempo de espera para não ultrapassar o prazo"""
+        restante = self.restante()
+        return segundos if restante is None else min(segundos, restante)
+
+    def verificar(self) -> None:
+        """Levanta GeracaoCancelada/PrazoExcedido se for o caso"""
+        if self._evento.is_set():
+            raise GeracaoCancelada("Geração cancelada")
+        if self.expirado:
+            raise PrazoExcedido("Prazo da geração excedido")
+
+    def aguardar(self, segundos: float) -> bool:
+        """Espera até o tempo indicado ou o cancelamento; retorna True se cancelado"""
+        self._evento.wait(self.limitar(segundos))
+        return self.cancelado
@@ -0,0 +1,198 @@
+"""
+Módulo de Circuit Breaker por Modelo
+Classifica as falhas da API Gemini e suspende temporariamente os modelos
+que estão sem cota ou instáveis, com backoff exponencial e jitter
+"""
+import logging
+import random
+import re
+import threading
+import time
+from typing import Dict, Optional
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Estados do disjuntor
+FECHADO = "fechado"
+ABERTO = "aberto"
+MEIO_ABERTO = "meio_aberto"
+
+# Classes de erro
+ERRO_QUOTA = "quota"
+ERRO_SERVIDOR = "servidor"
+ERRO_TIMEOUT = "timeout"
+ERRO_INVALIDO = "invalido"
+
+
+class CircuitoAberto(Exception):
+    """Chamada recusada porque o disjuntor do modelo está aberto"""
+    pass
+
+
+def _status_http(erro: Exception) -> Optional[int]:
+    for atributo in ("code", "status_code", "status"):
+        valor = getattr(erro, atributo, None)
+        if isinstance(valor, int):
+            return valor
+    resposta = getattr(erro, "response", None)
+    valor = getattr(resposta, "status_code", None)
+    return valor if isinstance(valor, int) else None
+
+
+def classificar_erro(erro: Exception) -> str:
+    """
+    Classifica uma exceção da chamada ao modelo
+
+    Returns:
+        ERRO_QUOTA, ERRO_SERVIDOR, ERRO_TIMEOUT ou ERRO_INVALIDO
+    """
+    status = _status_http(erro)
+    mensagem = str(erro).upper()
+
+    if isinstance(erro, TimeoutError) or "TIMEOUT" in type(erro).__name__.upper():
+        return ERRO_TIMEOUT
+    if status == 429 or "RESOURCE_EXHAUSTED" in mensagem or "QUOTA" in mensagem:
+        return ERRO_QUOTA
+    if status in (408, 504) or "DEADLINE_EXCEEDED" in mensagem or "TIMED OUT" in mensagem:
+        return ERRO_TIMEOUT
+    if status is not None and 400 <= status < 500:
+        return ERRO_INVALIDO
+    # 5xx, falhas de rede e erros sem status são tratados como instabilidade do servidor
+    return ERRO_SERVIDOR
+
+
+def extrair_retry_after(erro: Exception) -> Optional[float]:
+    """Lê o tempo sugerido pelo servidor (cabeçalho Retry-After ou RetryInfo.retryDelay)"""
+    resposta = getattr(erro, "response", None)
+    cabecalhos = getattr(resposta, "headers", None) or {}
+    try:
+        valor = cabecalhos.get("retry-after") or cabecalhos.get("Retry-After")
+        if valor:
+            return float(valor)
+    except (TypeError, ValueError):
+        pass
+
+    encontrado = re.search(r"retryDelay['\"]?\s*[:=]\s*['\"]?(\d+(?:\.\d+)?)s", str(erro))
+    return float(encontrado.group(1)) if encontrado else None
+
+
+class Disjuntor:
+    """Estado do circuito de um modelo"""
+
+    def __init__(self):
+        self.estado = FECHADO
+        self.falhas_consecutivas = 0
+        self.aberturas = 0
+        self.aberto_ate = 0.0
+        self.sondando = False
+        self.ultima_classe: Optional[str] = None
+        self.falhas_por_classe: Dict[str, int] = {}
+
+
+class GerenciadorDisjuntores:
+    """Disjuntores independentes para cada modelo"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._disjuntores: Dict[str, Disjuntor] = {}
+
+    def _disjuntor(self, modelo: str) -> Disjuntor:
+        return self._disjuntores.setdefault(modelo, Disjuntor())
+
+    def disponivel(self, modelo: str) -> bool:
+        """Consulta (sem reservar a sondagem) se o modelo pode ser tentado agora"""
+        with self._lock:
+            disjuntor = self._disjuntor(modelo)
+            if disjuntor.estado == FECHADO:
+                return True
+            return time.monotonic() >= disjuntor.aberto_ate and not disjuntor.sondando
+
+    def permitir(self, modelo: str) -> bool:
+        """
+        Autoriza uma chamada. Vencido o tempo de abertura, o circuito passa a
+        meio-aberto e só uma chamada de sondagem é liberada.
+        """
+        with self._lock:
+            disjuntor = self._disjuntor(modelo)
+            if disjuntor.estado == FECHADO:
+                return True
+            if time.monotonic() < disjuntor.aberto_ate or disjuntor.sondando:
+                return False
+            disjuntor.estado = MEIO_ABERTO
+            disjuntor.sondando = True
+            return True
+
+    def registrar_sucesso(self, modelo: str) -> None:
+        with self._lock:
+            self._fechar(modelo, self._disjuntor(modelo))
+
+    @staticmethod
+    def _fechar(modelo: str, disjuntor: Disjuntor) -> None:
+        """Único caminho para FECHADO: zera também as contagens de falha"""
+        if disjuntor.estado != FECHADO:
+            logger.info(f"Circuito de {modelo} fechado")
+        disjuntor.estado = FECHADO
+        disjuntor.falhas_consecutivas = 0
+        disjuntor.aberturas = 0
+        disjuntor.sondando = False
+
+    def liberar(self, modelo: str) -> None:
+        """Devolve a vaga de sondagem de uma chamada abandonada sem resultado"""
+        with self._lock:
+            self._disjuntor(modelo).sondando = False
+
+    def registrar_falha(self, modelo: str, erro: Exception) -> str:
+        """
+        Contabiliza uma falha e abre o circuito quando necessário
+
+        Returns:
+            Classe do erro
+        """
+        classe = classificar_erro(erro)
+        with self._lock:
+            disjuntor = self._disjuntor(modelo)
+            disjuntor.ultima_classe = classe
+            disjuntor.falhas_por_classe[classe] = disjuntor.falhas_por_classe.get(classe, 0) + 1
+            sondagem = disjuntor.sondando
+            disjuntor.sondando = False
+
+            if classe == ERRO_INVALIDO:
+                # Erro da requisição, não do modelo: não afeta o circuito,
+                # mas uma sondagem respondida mostra que o modelo voltou
+                if sondagem:
+                    self._fechar(modelo, disjuntor)
+                return classe
+
+            disjuntor.falhas_consecutivas += 1
+            if (classe == ERRO_QUOTA or sondagem
+                    or disjuntor.falhas_consecutivas >= Config.IA_BREAKER_LIMIAR_FALHAS):
+                self._abrir(modelo, disjuntor, extrair_retry_after(erro))
+        return classe
+
+    def _abrir(self, modelo: str, disjuntor: Disjuntor, retry_after: Optional[float]) -> None:
+        backoff = min(Config.IA_BREAKER_BASE_S * (2 ** disjuntor.aberturas), Config.IA_BREAKER_MAX_S)
+        espera = backoff * random.uniform(0.5, 1.0)
+        if retry_after is not None:
+            espera = max(espera, min(retry_after, Config.IA_BREAKER_MAX_S))
+        disjuntor.estado = ABERTO
+        disjuntor.aberturas += 1
+        disjuntor.aberto_ate = time.monotonic() + espera
+        logger.warning(f"Circuito de {modelo} aberto por {espera:.0f}s ({disjuntor.ultima_classe})")
+
+    def estatisticas(self) -> Dict:
+        """Estado de cada disjuntor"""
+        agora = time.monotonic()
+        with self._lock:
+            return {
+                modelo: {
+                    "estado": disjuntor.estado,
+                    "falhas_consecutivas": disjuntor.falhas_consecutivas,
+                    "reabre_em_s": round(max(0.0, disjuntor.aberto_ate - agora), 1)
+                    if disjuntor.estado == ABERTO else 0.0,
+                    "ultima_classe": disjuntor.ultima_classe,
+                    "falhas_por_classe": dict(disjuntor.falhas_por_classe),
+                }
+                for modelo, disjuntor in self._disjuntores.items()
+            }
@@ -0,0 +1,194 @@
+"""
+Módulo de Compressão de Textos Longos
+Comprime rascunho_original e texto_final com zstd e um dicionário treinado
+no próprio acervo de BOPMs, antes da criptografia opcional.
+
+Formato gravado (bytes): b"BZ\\x01" + id do dicionário (4 bytes, 0 = sem
+dicionário) + frame zstd. Textos em str continuam sendo lidos como estão.
+A biblioteca zstandard é opcional: sem ela, os textos são gravados sem compressão.
+"""
+import logging
+import struct
+import threading
+import time
+import zlib
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+from config import Config
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+MAGICO = b"BZ\x01"
+_CABECALHO = struct.Struct(">I")
+CAMPOS_COMPRIMIDOS = ("rascunho_original", "texto_final")
+# Substitui, na leitura, um campo que não pôde ser descomprimido (ex.: dicionário ausente)
+TEXTO_ILEGIVEL = "[texto comprimido ilegível nesta estação]"
+
+
+class ErroCompressao(Exception):
+    """Texto comprimido que não pode ser lido (biblioteca ou dicionário ausente)"""
+    pass
+
+
+class Compressor:
+    """Compressão zstd com dicionários versionados pelo id"""
+
+    def __init__(self, diretorio: str = Config.COMPRESSION_DICT_DIR):
+        self.diretorio = Path(diretorio)
+        self._dicionarios: Dict[int, "zstandard.ZstdCompressionDict"] = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.id_ativo = 0
+        # Busca dicionários desconhecidos em outra fonte (ex.: coleção do MongoDB)
+        self.carregador: Optional[Callable[[int], Optional[bytes]]] = None
+        self._carregar_diretorio()
+
+    @property
+    def disponivel(self) -> bool:
+        return zstandard is not None
+
+    @property
+    def ativo(self) -> bool:
+        return Config.COMPRESSION_ENABLED and self.disponivel
+
+    def ids_dicionarios(self) -> List[int]:
+        return list(self._dicionarios)
+
+    def _carregar_diretorio(self) -> None:
+        if not self.disponivel or not self.diretorio.exists():
+            return
+        for arquivo in sorted(self.diretorio.glob("*.zdict"), key=lambda a: a.stat().st_mtime):
+            try:
+                self.registrar_dicionario(arquivo.read_bytes(), persistir=False)
+            except Exception as e:
+                logger.error(f"✗ Dicionário de compressão inválido {arquivo.name}: {str(e)}")
+
+    @staticmethod
+    def identificar(dados: bytes) -> int:
+        """Id gravado pelo zstd no próprio dicionário"""
+        return zstandard.ZstdCompressionDict(dados).dict_id()
+
+    def registrar_dicionario(self, dados: bytes, ativar: bool = True, persistir: bool = True) -> int:
+        """
+        Torna um dicionário conhecido (e, por padrão, o usado nas novas gravações)
+
+        Returns:
+            Id do dicionário
+        """
+        dicionario = zstandard.ZstdCompressionDict(dados)
+        id_dicionario = dicionario.dict_id()
+        with self._lock:
+            self._dicionarios[id_dicionario] = dicionario
+            if ativar:
+                self.id_ativo = id_dicionario
+        if persistir:
+            # Cópia local: documentos do journal offline continuam legíveis sem o banco
+            self.diretorio.mkdir(exist_ok=True)
+            (self.diretorio / f"{id_dicionario}.zdict").write_bytes(dados)
+        return id_dicionario
+
+    def _dicionario(self, id_dicionario: int):
+        if id_dicionario == 0:
+            return None
+        dicionario = self._dicionarios.get(id_dicionario)
+        if dicionario is None and self.carregador is not None:
+            dados = self.carregador(id_dicionario)
+            if dados:
+                self.registrar_dicionario(dados, ativar=False)
+                dicionario = self._dicionarios.get(id_dicionario)
+        if dicionario is None:
+            raise ErroCompressao(f"Dicionário de compressão {id_dicionario} não encontrado")
+        return dicionario
+
+    def _compressor(self, id_dicionario: int):
+        """ZstdCompressor por thread e dicionário (a instância não é thread-safe)"""
+        cache = getattr(self._local, "compressores", None)
+        if cache is None:
+            cache = self._local.compressores = {}
+        if id_dicionario not in cache:
+            cache[id_dicionario] = zstandard.ZstdCompressor(
+                level=Config.COMPRESSION_LEVEL, dict_data=self._dicionario(id_dicionario)
+            )
+        return cache[id_dicionario]
+
+    def _descompressor(self, id_dicionario: int):
+        cache = getattr(self._local, "descompressores", None)
+        if cache is None:
+            cache = self._local.descompressores = {}
+        if id_dicionario not in cache:
+            cache[id_dicionario] = zstandard.ZstdDecompressor(dict_data=self._dicionario(id_dicionario))
+        return cache[id_dicionario]
+
+    def comprimir(self, texto, id_dicionario: Optional[int] = None):
+        """Comprime um texto; textos curtos (ou sem zstandard) são devolvidos como estão"""
+        if not isinstance(texto, str) or not self.ativo or len(texto) < Config.COMPRESSION_MIN_CHARS:
+            return texto
+        id_dicionario = self.id_ativo if id_dicionario is None else id_dicionario
+        frame = self._compressor(id_dicionario).compress(texto.encode("utf-8"))
+        return MAGICO + _CABECALHO.pack(id_dicionario) + frame
+
+    @staticmethod
+    def comprimido(valor) -> bool:
+        return isinstance(valor, bytes) and valor.startswith(MAGICO)
+
+    def descomprimir(self, valor):
+        """Devolve o texto de um valor comprimido; outros valores são devolvidos como estão"""
+        if not self.comprimido(valor):
+            return valor
+        if not self.disponivel:
+            raise ErroCompressao("Texto comprimido com zstd: instale o pacote zstandard")
+        (id_dicionario,) = _CABECALHO.unpack_from(valor, len(MAGICO))
+        frame = valor[len(MAGICO) + _CABECALHO.size:]
+        return self._descompressor(id_dicionario).decompress(frame).decode("utf-8")
+
+    def treinar(self, amostras: List[str], tamanho: int = Config.COMPRESSION_DICT_SIZE) -> bytes:
+        """Treina um dicionário com textos do acervo"""
+        if not self.disponivel:
+            raise ErroCompressao("Instale o pacote zstandard para treinar dicionários")
+        dicionario = zstandard.train_dictionary(tamanho, [a.encode("utf-8") for a in amostras if a])
+        return dicionario.as_bytes()
+
+
+def medir(textos: List[str], dicionario: Optional[bytes] = None) -> Dict[str, Dict]:
+    """
+    Compara tamanho e custo por documento: zlib, zstd sem e com dicionário
+
+    Returns:
+        {método: {bytes, razao, comprimir_us, descomprimir_us}}
+    """
+    dados = [t.encode("utf-8") for t in textos if t]
+    originais = sum(len(d) for d in dados) or 1
+    metodos = {"zlib": (lambda d: zlib.compress(d, 6), zlib.decompress)}
+    if zstandard is not None:
+        sem = zstandard.ZstdCompressor(level=Config.COMPRESSION_LEVEL)
+        metodos["zstd"] = (sem.compress, zstandard.ZstdDecompressor().decompress)
+        if dicionario:
+            dic = zstandard.ZstdCompressionDict(dicionario)
+            com = zstandard.ZstdCompressor(level=Config.COMPRESSION_LEVEL, dict_data=dic)
+            metodos["zstd+dicionario"] = (com.compress, zstandard.ZstdDecompressor(dict_data=dic).decompress)
+
+    resultado = {"original": {"bytes": originais, "razao": 1.0, "comprimir_us": 0.0, "descomprimir_us": 0.0}}
+    for nome, (comprimir, descomprimir) in metodos.items():
+        inicio = time.perf_counter()
+        comprimidos = [comprimir(d) for d in dados]
+        meio = time.perf_counter()
+        for c in comprimidos:
+            descomprimir(c)
+        fim = time.perf_counter()
+        total = sum(len(c) for c in comprimidos)
+        resultado[nome] = {
+            "bytes": total,
+            "razao": round(originais / total, 2) if total else 0.0,
+            "comprimir_us": round((meio - inicio) / max(len(dados), 1) * 1e6, 1),
+            "descomprimir_us": round((fim - meio) / max(len(dados), 1) * 1e6, 1),
+        }
+    return resultado
+
+
+compressor = Compressor()
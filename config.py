@@ -19,23 +19,103 @@ class Config:
     # === BANCO DE DADOS ===
     DB_NAME = "bopm_db"
     COLLECTION_NAME = "ocorrencias"
+    STATS_COLLECTION_NAME = "estatisticas"
+    COMPRESSION_DICT_COLLECTION = "dicionarios_compressao"
     DB_TIMEOUT_MS = 5000
     DB_MAX_POOL_SIZE = 10
     DB_MIN_POOL_SIZE = 2
+    DB_HEARTBEAT_MS = 5000
+    DB_RECONNECT_MIN_S = 1
+    DB_RECONNECT_MAX_S = 60
+    JOURNAL_PATH = "bopm_journal.db"
+    JOURNAL_REPLAY_BATCH = 500
+    EXPORT_BATCH_SIZE = 1000
+    IMPORT_BATCH_SIZE = 1000
+    BULK_PROGRESS_EVERY = 10000
+    CLI_CONNECT_TIMEOUT_S = 15
+    
+    # === CACHE DE DOCUMENTOS ===
+    DOC_CACHE_MAX_BYTES = 8 * 1024 * 1024
+    DOC_CACHE_MAX_CONSULTAS = 32
+    # Código do MongoDB para "change streams só em replica set/sharded cluster"
+    CHANGE_STREAM_NAO_SUPORTADO = 40573
+    
+    # === COMPRESSÃO (zstd, opcional) ===
+    COMPRESSION_ENABLED = True
+    COMPRESSION_LEVEL = 6
+    COMPRESSION_MIN_CHARS = 200
+    COMPRESSION_DICT_SIZE = 64 * 1024
+    COMPRESSION_DICT_SAMPLES = 2000
+    COMPRESSION_DICT_DIR = "dicionarios_zstd"
+    
+    # === ÍNDICE DE BUSCA LOCAL ===
+    SEARCH_INDEX_PATH = "bopm_busca.db"
+    SEARCH_SYNC_BATCH = 1000
+    SEARCH_SYNC_INTERVAL_S = 60
+    SEARCH_SYNC_OVERLAP_S = 5
     
     # === IA GEMINI ===
     MODELOS_GEMINI = ['gemini-2.5-flash', 'gemini-2.0-flash', 'gemini-1.5-flash']
     IA_TEMPERATURE = 0.2
     IA_CANDIDATE_COUNT = 1
+    IA_STREAMING = True
+    IA_TIMEOUT_TENTATIVA_S = 30
+    IA_PRAZO_TOTAL_S = 90
+    IA_CANCELAMENTO_POLL_S = 0.1
+    IA_SEGMENTAR = True
+    IA_SEGMENTACAO_MIN_CHARS = 2500
+    IA_SEGMENTO_MIN_CHARS = 200
+    IA_SEGMENTO_MAX_CHARS = 1200
+    IA_SEGMENTOS_PARALELOS = 4
+    IA_HEDGE_WORKERS = 6
+    IA_HEDGE_DELAY_S = 3.0
+    IA_HEDGE_MIN_DELAY_S = 1.0
+    IA_HEDGE_MAX_DELAY_S = 8.0
+    IA_HEDGE_JANELA = 50
+    IA_EWMA_ALPHA = 0.3
+    IA_BREAKER_LIMIAR_FALHAS = 3
+    IA_BREAKER_BASE_S = 2.0
+    IA_BREAKER_MAX_S = 300.0
+    # Lote: ajuste à cota do projeto no Google AI Studio
+    IA_LOTE_CONCORRENCIA = 8
+    IA_QUOTA_RPM = 60
+    IA_QUOTA_TPM = 1000000
+    IA_TOKENS_POR_CARACTERE = 0.25
     
     # === CACHE ===
-    CACHE_MAX_SIZE = 100
+    CACHE_MAX_BYTES = 4 * 1024 * 1024
+    CACHE_SKETCH_WIDTH = 4096
+    CACHE_STATS_TOP = 10
+    AI_CACHE_PATH = "bopm_cache_ia.db"
+    AI_CACHE_TTL_S = 30 * 24 * 3600
+    AI_CACHE_MAX_BYTES = 64 * 1024 * 1024
+    AI_SHARED_CACHE_COLLECTION = "cache_ia"
+    AI_SHARED_CACHE_TTL_S = 90 * 24 * 3600
+    AI_SHARED_CACHE_TIMEOUT_MS = 500
     
     # === AUTO-SAVE ===
     AUTOSAVE_INTERVAL_MS = 30000
     
+    # === EXECUÇÃO ASSÍNCRONA ===
+    BACKEND_DB_WORKERS = 4
+    BACKEND_IA_WORKERS = 2
+    UI_POLL_INTERVAL_MS = 16
+    UI_FRAME_BUDGET_MS = 8
+    
     # === SEGURANÇA ===
     ENABLE_ENCRYPTION = False
+    BLIND_INDEX_MIN_PREFIX = 3
+    BLIND_INDEX_MAX_PREFIX = 16
+    # Descriptografia em lote: com 1, o lote é processado na própria thread
+    # (o Fernet da biblioteca cryptography não libera o GIL nas versões atuais)
+    CRYPTO_WORKERS = 1
+    CRYPTO_LOTE_MIN_PARALELO = 64
+    KEYRING_PATH = "bopm_chaves.json"
+    KEYRING_COLLECTION = "chaveiro"
+    KEYRING_RELOAD_MIN_S = 30
+    REENCRYPT_CHECKPOINT_PATH = "bopm_recriptografia.json"
+    REENCRYPT_BATCH_SIZE = 200
+    REENCRYPT_PAUSA_S = 0.5
     SESSION_TIMEOUT_MINUTES = 30
     MAX_LOGIN_ATTEMPTS = 5
     
@@ -61,6 +141,19 @@ class Config:
         "Saída (Apenas o texto reescrito):"
     )
     
+    # Trechos de rascunhos longos (geração segmentada): sem depender da posição
+    # do trecho, para que cada um tenha uma entrada de cache estável
+    PROMPT_TEMPLATE_SEGMENTO = (
+        "Atue como um Policial Militar (P2). "
+        "O texto abaixo é um TRECHO de um rascunho maior de Boletim de Ocorrência (BOPM). "
+        "Reescreva apenas este trecho em linguagem formal, técnica, coesa e impessoal, "
+        "como continuação natural do relato, sem introdução, conclusão ou resumo. "
+        "Mantenha ESTRITAMENTE todos os fatos, nomes, quantidades, placas e horários citados.\n\n"
+        "Natureza: {natureza}\n"
+        "Trecho: {rascunho}\n\n"
+        "Saída (Apenas o trecho reescrito):"
+    )
+    
     @classmethod
     def validate_config(cls) -> tuple[bool, str]:
         """Valida se as configurações essenciais estão presentes"""
@@ -0,0 +1,167 @@
+"""
+Módulo de Estatísticas Materializadas
+Mantém contadores por natureza, encarregado e dia em uma coleção própria,
+atualizados a cada salvamento/exclusão e reconstruíveis por agregação
+"""
+import logging
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from pymongo import UpdateOne
+
+logger = logging.getLogger(__name__)
+
+DIMENSOES = ("natureza", "encarregado", "dia")
+
+
+class RollupEstatisticas:
+    """Contadores agregados da coleção de ocorrências (leitura O(1) por chave)"""
+
+    def __init__(self, colecao_estatisticas, colecao_ocorrencias):
+        self.estatisticas = colecao_estatisticas
+        self.ocorrencias = colecao_ocorrencias
+        self._lock_reconstrucao = threading.Lock()
+
+    @staticmethod
+    def _chaves(documento: Dict) -> Dict[str, str]:
+        """Extrai as chaves de cada dimensão de um documento de ocorrência"""
+        data = documento.get("data_criacao") or documento.get("data_atualizacao")
+        return {
+            "natureza": documento.get("natureza") or "N/A",
+            "encarregado": (documento.get("equipe") or {}).get("encarregado") or "N/A",
+            "dia": data.strftime("%Y-%m-%d") if isinstance(data, datetime) else "N/A",
+        }
+
+    @staticmethod
+    def _operacao(dimensao: str, chave: str, delta: int) -> UpdateOne:
+        # "geracao" no relógio do servidor: a reconstrução não apaga contadores tocados durante ela
+        return UpdateOne(
+            {"_id": f"{dimensao}|{chave}"},
+            {"$inc": {"contagem": delta}, "$set": {"dimensao": dimensao, "chave": chave},
+             "$currentDate": {"geracao": True}},
+            upsert=True
+        )
+
+    def registrar_alteracao(self, anterior: Optional[Dict], atual: Optional[Dict]) -> None:
+        """
+        Aplica o delta de uma escrita nos contadores
+
+        Args:
+            anterior: Documento antes da escrita (None se foi criado)
+            atual: Documento depois da escrita (None se foi removido)
+        """
+        if anterior is None and atual is None:
+            return
+
+        deltas: Dict[tuple, int] = {}
+        if anterior is None:
+            deltas[("total", "total")] = 1
+        elif atual is None:
+            deltas[("total", "total")] = -1
+
+        chaves_antes = self._chaves(anterior) if anterior is not None else {}
+        chaves_depois = self._chaves(atual) if atual is not None else {}
+        for dimensao in DIMENSOES:
+            antes, depois = chaves_antes.get(dimensao), chaves_depois.get(dimensao)
+            # O dia de criação não muda em atualizações
+            if dimensao == "dia" and anterior is not None and atual is not None:
+                continue
+            if antes == depois:
+                continue
+            if antes is not None:
+                deltas[(dimensao, antes)] = deltas.get((dimensao, antes), 0) - 1
+            if depois is not None:
+                deltas[(dimensao, depois)] = deltas.get((dimensao, depois), 0) + 1
+
+        operacoes = [self._operacao(d, c, delta) for (d, c), delta in deltas.items() if delta]
+        if operacoes:
+            self.estatisticas.bulk_write(operacoes, ordered=False)
+
+    def contar(self) -> Optional[int]:
+        """Total de BOPMs (None se o rollup ainda não foi construído)"""
+        documento = self.estatisticas.find_one({"_id": "total|total"}, {"contagem": 1})
+        return documento["contagem"] if documento else None
+
+    def obter(self) -> Dict:
+        """
+        Retorna todos os contadores
+
+        Returns:
+            {"total": n, "natureza": {...}, "encarregado": {...}, "dia": {...}}
+        """
+        resultado: Dict = {"total": 0, **{d: {} for d in DIMENSOES}}
+        for documento in self.estatisticas.find({}, {"dimensao": 1, "chave": 1, "contagem": 1}):
+            if documento.get("contagem", 0) <= 0:
+                continue
+            if documento["dimensao"] == "total":
+                resultado["total"] = documento["contagem"]
+            else:
+                resultado[documento["dimensao"]][documento["chave"]] = documento["contagem"]
+        return resultado
+
+    def reconstruir(self) -> bool:
+        """
+        Recalcula todos os contadores com uma agregação sobre a coleção inteira.
+        Só são removidos os contadores que nem a agregação nem um delta
+        concorrente tocaram desde o início da reconstrução (relógio do servidor).
+        Um delta entre a agregação e a gravação de um contador que ela também
+        recalculou ainda pode ser sobrescrito; a próxima reconstrução o corrige.
+
+        Returns:
+            True se executou (False se já havia reconstrução em andamento)
+        """
+        if not self._lock_reconstrucao.acquire(blocking=False):
+            return False
+
+        try:
+            inicio = time.perf_counter()
+            inicio_servidor = self.estatisticas.database.command("hello")["localTime"]
+            data_ref = {"$ifNull": ["$data_criacao", "$data_atualizacao"]}
+            pipeline = [{"$facet": {
+                "total": [{"$count": "contagem"}],
+                "natureza": [{"$group": {"_id": "$natureza", "contagem": {"$sum": 1}}}],
+                "encarregado": [{"$group": {"_id": "$equipe.encarregado", "contagem": {"$sum": 1}}}],
+                "dia": [{"$group": {
+                    "_id": {"$dateToString": {"format": "%Y-%m-%d", "date": data_ref}},
+                    "contagem": {"$sum": 1}
+                }}],
+            }}]
+            facetas = next(self.ocorrencias.aggregate(pipeline, allowDiskUse=True))
+
+            operacoes: List[UpdateOne] = []
+            total = facetas["total"][0]["contagem"] if facetas["total"] else 0
+            valores = [("total", "total", total)] + [
+                (dimensao, grupo["_id"] or "N/A", grupo["contagem"])
+                for dimensao in DIMENSOES for grupo in facetas[dimensao]
+            ]
+            for dimensao, chave, contagem in valores:
+                operacoes.append(UpdateOne(
+                    {"_id": f"{dimensao}|{chave}"},
+                    {"$set": {"dimensao": dimensao, "chave": chave, "contagem": contagem},
+                     "$currentDate": {"geracao": True}},
+                    upsert=True
+                ))
+            self.estatisticas.bulk_write(operacoes, ordered=False)
+            # Gerações antigas (inclusive as gravadas como número por versões anteriores)
+            self.estatisticas.delete_many({"$or": [
+                {"geracao": {"$lt": inicio_servidor}},
+                {"geracao": {"$not": {"$type": "date"}}},
+            ]})
+
+            logger.info(f"✓ Estatísticas reconstruídas ({total} BOPMs) "
+                        f"em {time.perf_counter() - inicio:.1f}s")
+            return True
+        finally:
+            self._lock_reconstrucao.release()
+
+    def reconstruir_em_segundo_plano(self) -> None:
+        """Dispara a reconstrução em uma thread daemon"""
+        def executar():
+            try:
+                self.reconstruir()
+            except Exception as e:
+                logger.error(f"Erro ao reconstruir estatísticas: {str(e)}")
+
+        threading.Thread(target=executar, name="bopm-estatisticas", daemon=True).start()
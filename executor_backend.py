@@ -0,0 +1,152 @@
+"""
+Módulo de Execução Assíncrona do Backend
+Executa operações bloqueantes (MongoDB, IA) fora da thread do Tkinter
+e devolve os resultados ao mainloop via after()
+"""
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+class ExecutorBackend:
+    """Pools de workers limitados com entrega de resultados na thread da UI"""
+
+    def __init__(self):
+        self._pools: Dict[str, ThreadPoolExecutor] = {
+            "db": ThreadPoolExecutor(
+                max_workers=Config.BACKEND_DB_WORKERS,
+                thread_name_prefix="bopm-db"
+            ),
+            "ia": ThreadPoolExecutor(
+                max_workers=Config.BACKEND_IA_WORKERS,
+                thread_name_prefix="bopm-ia"
+            ),
+        }
+        self._fila_ui: queue.SimpleQueue = queue.SimpleQueue()
+        self._widget = None
+        self._encerrado = False
+
+    def vincular_ui(self, widget) -> None:
+        """
+        Associa o executor a um widget Tk e inicia a drenagem periódica
+
+        Args:
+            widget: Widget raiz cujo after() será usado
+        """
+        self._widget = widget
+        self._widget.after(Config.UI_POLL_INTERVAL_MS, self._drenar_fila_ui)
+
+    def executar(self, funcao: Callable, *args,
+                 ao_concluir: Optional[Callable[[Any], None]] = None,
+                 ao_falhar: Optional[Callable[[Exception], None]] = None,
+                 pool: str = "db", **kwargs) -> Future:
+        """
+        Agenda uma função em um pool de workers
+
+        Args:
+            funcao: Função bloqueante a executar
+            ao_concluir: Callback chamado na thread da UI com o resultado
+            ao_falhar: Callback chamado na thread da UI com a exceção
+                (sem ele, a exceção é registrada no log)
+            pool: Pool a utilizar ("db" ou "ia")
+
+        Returns:
+            Future com o resultado da função
+        """
+        future = self._pools[pool].submit(funcao, *args, **kwargs)
+        future.add_done_callback(
+            lambda f: self._entregar(f, ao_concluir, ao_falhar)
+        )
+        return future
+
+    def chamar_na_ui(self, callback: Callable, *args) -> None:
+        """Enfileira um callback para execução na thread do Tk (thread-safe)"""
+        if not self._encerrado:
+            self._fila_ui.put((callback, args))
+
+    def criar_acumulador(self, callback: Callable[[str], None]) -> "AcumuladorUI":
+        """Cria um acumulador que entrega texto em lotes na thread da UI"""
+        return AcumuladorUI(self, callback)
+
+    def _entregar(self, future: Future, ao_concluir: Optional[Callable],
+                  ao_falhar: Optional[Callable]) -> None:
+        if future.cancelled():
+            return
+
+        erro = future.exception()
+        if erro is None:
+            if ao_concluir:
+                self.chamar_na_ui(ao_concluir, future.result())
+        elif ao_falhar:
+            self.chamar_na_ui(ao_falhar, erro)
+        else:
+            logger.error(f"Erro em operação do backend: {str(erro)}", exc_info=erro)
+
+    def _drenar_fila_ui(self) -> None:
+        """Executa callbacks pendentes respeitando o orçamento de um quadro"""
+        if self._encerrado:
+            return
+
+        limite = time.perf_counter() + Config.UI_FRAME_BUDGET_MS / 1000
+        while time.perf_counter() < limite:
+            try:
+                callback, args = self._fila_ui.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                callback(*args)
+            except Exception as e:
+                logger.error(f"Erro em callback da UI: {str(e)}", exc_info=True)
+
+        self._widget.after(Config.UI_POLL_INTERVAL_MS, self._drenar_fila_ui)
+
+    def encerrar(self) -> None:
+        """Cancela tarefas pendentes e libera os workers"""
+        self._encerrado = True
+        for pool in self._pools.values():
+            pool.shutdown(wait=False, cancel_futures=True)
+        logger.info("Executor do backend encerrado")
+
+
+class AcumuladorUI:
+    """
+    Junta trechos de texto produzidos em um worker e os entrega à UI em
+    lotes: no máximo uma atualização pendente por vez, com tudo o que
+    chegou desde a anterior
+    """
+
+    def __init__(self, executor: ExecutorBackend, callback: Callable[[str], None]):
+        self._executor = executor
+        self._callback = callback
+        self._lock = threading.Lock()
+        self._trechos: List[str] = []
+        self._agendado = False
+
+    def adicionar(self, trecho: str) -> None:
+        """Acrescenta um trecho (thread-safe)"""
+        with self._lock:
+            self._trechos.append(trecho)
+            if self._agendado:
+                return
+            self._agendado = True
+        self._executor.chamar_na_ui(self._descarregar)
+
+    def descartar(self) -> None:
+        """Descarta trechos ainda não entregues"""
+        with self._lock:
+            self._trechos.clear()
+
+    def _descarregar(self) -> None:
+        with self._lock:
+            texto = "".join(self._trechos)
+            self._trechos.clear()
+            self._agendado = False
+        if texto:
+            self._callback(texto)
@@ -0,0 +1,313 @@
+"""
+Módulo de Índice de Busca Local
+Índice invertido de trigramas (SQLite FTS5) com normalização de acentos,
+mantido incrementalmente a cada salvamento/exclusão
+"""
+import json
+import logging
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from pymongo import ASCENDING
+
+from config import Config
+from validators import BOPMValidator
+
+logger = logging.getLogger(__name__)
+
+# Campo gravado pelo servidor ($currentDate) em todo salvamento, replay e importação
+CAMPO_SINCRONIZACAO = "sincronizado_em"
+# Marca da última sincronização, no relógio do servidor
+_MARCA = "sincronizado_servidor_ate"
+
+
+class IndiceBusca:
+    """Índice de substring acento-insensível sobre os campos pesquisáveis do BOPM"""
+
+    # Coluna do índice -> (campo do filtro, peso no ranking)
+    COLUNAS = {
+        "numero": ("numero", 10.0),
+        "infrator": ("infrator", 5.0),
+        "natureza": ("natureza", 3.0),
+        "motorista": ("motorista", 2.0),
+        "texto": ("texto", 1.0),
+    }
+    # Colunas com dados protegidos por criptografia no banco
+    SENSIVEIS = ("infrator", "texto")
+
+    def __init__(self, caminho: str = Config.SEARCH_INDEX_PATH, incluir_sensiveis: bool = True):
+        self._lock = threading.Lock()
+        self.pronto = False
+        self.colunas_indexadas = tuple(
+            c for c in self.COLUNAS if incluir_sensiveis or c not in self.SENSIVEIS
+        )
+
+        self._conn = sqlite3.connect(caminho, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (chave TEXT PRIMARY KEY, valor TEXT)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS registros ("
+            " id INTEGER PRIMARY KEY,"
+            " numero_bopm TEXT UNIQUE NOT NULL,"
+            " data_atualizacao REAL NOT NULL)"
+        )
+        self._conn.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS docs USING fts5("
+            f"{', '.join(self.COLUNAS)}, tokenize='trigram')"
+        )
+
+        # Se as colunas indexadas mudaram (ex.: criptografia ligada), reconstrói do zero
+        if self._meta("colunas") != json.dumps(self.colunas_indexadas):
+            self.limpar()
+            self._definir_meta("colunas", json.dumps(self.colunas_indexadas))
+
+    # === META ===
+    def _meta(self, chave: str) -> Optional[str]:
+        with self._lock:
+            linha = self._conn.execute("SELECT valor FROM meta WHERE chave = ?", (chave,)).fetchone()
+        return linha[0] if linha else None
+
+    def _definir_meta(self, chave: str, valor: str) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO meta (chave, valor) VALUES (?, ?) "
+                "ON CONFLICT(chave) DO UPDATE SET valor = excluded.valor", (chave, valor)
+            )
+
+    def limpar(self) -> None:
+        """Remove todo o conteúdo do índice"""
+        with self._lock:
+            self._conn.execute("DELETE FROM docs")
+            self._conn.execute("DELETE FROM registros")
+            self._conn.execute("DELETE FROM meta WHERE chave IN ('sincronizado_ate', ?)", (_MARCA,))
+        self.pronto = False
+
+    def definir_sensiveis(self, incluir_sensiveis: bool) -> None:
+        """
+        Acompanha a configuração de criptografia em tempo de execução: ao
+        excluir as colunas sensíveis, apaga o texto claro já indexado; ao
+        incluí-las de novo, limpa o índice para a sincronização reconstruí-lo
+        """
+        colunas = tuple(c for c in self.COLUNAS if incluir_sensiveis or c not in self.SENSIVEIS)
+        if colunas == self.colunas_indexadas:
+            return
+        # Primeiro as colunas: escritas concorrentes já seguem a nova configuração
+        self.colunas_indexadas = colunas
+        if incluir_sensiveis:
+            self.limpar()
+        else:
+            apagar = ", ".join(f"{c} = ''" for c in self.SENSIVEIS)
+            with self._lock:
+                self._conn.execute(f"UPDATE docs SET {apagar}")
+                # Funde os segmentos do FTS e reescreve o arquivo sem as páginas antigas
+                self._conn.execute("INSERT INTO docs(docs) VALUES ('optimize')")
+                self._conn.execute("VACUUM")
+            logger.info("✓ Campos sensíveis removidos do índice de busca local")
+        self._definir_meta("colunas", json.dumps(colunas))
+
+    # === ATUALIZAÇÃO ===
+    def _valores(self, documento: Dict) -> List[str]:
+        equipe = documento.get("equipe", {})
+        brutos = {
+            "numero": documento.get("numero_bopm", ""),
+            "infrator": documento.get("infrator", ""),
+            "natureza": documento.get("natureza", ""),
+            "motorista": equipe.get("motorista", ""),
+            "texto": documento.get("texto_final", ""),
+        }
+        return [
+            BOPMValidator.normalizar_para_busca(brutos[c]) if c in self.colunas_indexadas else ""
+            for c in self.COLUNAS
+        ]
+
+    def _upsert(self, documento: Dict) -> None:
+        numero = documento["numero_bopm"]
+        data = documento.get("data_atualizacao")
+        carimbo = data.timestamp() if isinstance(data, datetime) else time.time()
+
+        linha = self._conn.execute(
+            "SELECT id FROM registros WHERE numero_bopm = ?", (numero,)
+        ).fetchone()
+        if linha:
+            doc_id = linha[0]
+            self._conn.execute(
+                "UPDATE registros SET data_atualizacao = ? WHERE id = ?", (carimbo, doc_id)
+            )
+            self._conn.execute("DELETE FROM docs WHERE rowid = ?", (doc_id,))
+        else:
+            doc_id = self._conn.execute(
+                "INSERT INTO registros (numero_bopm, data_atualizacao) VALUES (?, ?)",
+                (numero, carimbo)
+            ).lastrowid
+
+        self._conn.execute(
+            f"INSERT INTO docs (rowid, {', '.join(self.COLUNAS)}) VALUES (?, ?, ?, ?, ?, ?)",
+            (doc_id, *self._valores(documento))
+        )
+
+    def atualizar(self, documento: Dict) -> None:
+        """
+        Indexa (ou reindexa) um documento em texto claro
+
+        Args:
+            documento: Documento no formato da coleção, já descriptografado
+        """
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._upsert(documento)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def atualizar_lote(self, documentos: Iterable[Dict]) -> int:
+        """Indexa vários documentos em uma única transação"""
+        total = 0
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                for documento in documentos:
+                    self._upsert(documento)
+                    total += 1
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return total
+
+    def remover(self, numeros: Iterable[str]) -> None:
+        """Remove documentos do índice pelo número do BOPM"""
+        with self._lock:
+            for numero in numeros:
+                linha = self._conn.execute(
+                    "SELECT id FROM registros WHERE numero_bopm = ?", (numero,)
+                ).fetchone()
+                if linha:
+                    self._conn.execute("DELETE FROM docs WHERE rowid = ?", (linha[0],))
+                    self._conn.execute("DELETE FROM registros WHERE id = ?", (linha[0],))
+
+    def sincronizar(self, collection, descriptografar) -> int:
+        """
+        Traz para o índice tudo o que mudou no banco desde a última sincronização
+        (inclui alterações feitas por outras estações)
+
+        A marca usa o horário do servidor (CAMPO_SINCRONIZACAO), e não
+        data_atualizacao: replays do journal mantêm a data offline e os
+        relógios das estações podem divergir. Uma pequena sobreposição
+        cobre escritas concorrentes com o mesmo horário.
+
+        Args:
+            collection: Coleção MongoDB de origem
+            descriptografar: Função que descriptografa um documento in-place
+
+        Returns:
+            Número de documentos indexados
+        """
+        marca = self._meta(_MARCA)
+        query = {}
+        if marca:
+            desde = datetime.fromisoformat(marca) - timedelta(seconds=Config.SEARCH_SYNC_OVERLAP_S)
+            query = {CAMPO_SINCRONIZACAO: {"$gte": desde}}
+        projecao = {"numero_bopm": 1, "infrator": 1, "natureza": 1, "equipe.motorista": 1,
+                    "texto_final": 1, "data_atualizacao": 1, CAMPO_SINCRONIZACAO: 1, "_id": 0}
+
+        cursor = (collection.find(query, projecao)
+                  .sort(CAMPO_SINCRONIZACAO, ASCENDING)
+                  .batch_size(Config.SEARCH_SYNC_BATCH))
+        total = 0
+        inicio = time.perf_counter()
+        lote: List[Dict] = []
+        ultima_data = None
+
+        for documento in cursor:
+            ultima_data = documento.pop(CAMPO_SINCRONIZACAO, None) or ultima_data
+            lote.append(descriptografar(documento))
+            if len(lote) >= Config.SEARCH_SYNC_BATCH:
+                total += self.atualizar_lote(lote)
+                lote.clear()
+                if ultima_data:
+                    self._definir_meta(_MARCA, ultima_data.isoformat())
+        if lote:
+            total += self.atualizar_lote(lote)
+        if ultima_data:
+            self._definir_meta(_MARCA, ultima_data.isoformat())
+
+        if total:
+            logger.info(f"✓ Índice de busca: {total} documentos sincronizados "
+                        f"em {time.perf_counter() - inicio:.1f}s")
+        self.pronto = True
+        return total
+
+    # === CONSULTA ===
+    def suporta(self, filtros: Dict) -> bool:
+        """Indica se todos os filtros informados podem ser atendidos pelo índice"""
+        campos_indexados = {self.COLUNAS[c][0] for c in self.colunas_indexadas}
+        return self.pronto and all(campo in campos_indexados for campo in filtros)
+
+    def buscar(self, filtros: Dict, limite: int,
+               apos: Optional[Tuple[float, float, int]] = None) -> List[Tuple[str, Tuple[float, float, int]]]:
+        """
+        Busca por substring (acento-insensível) com ranking bm25, paginada por
+        keyset sobre (bm25, data_atualizacao, id)
+
+        Args:
+            filtros: Campo -> texto procurado (numero/infrator/natureza/motorista/texto)
+            limite: Máximo de resultados
+            apos: Chave de ordenação do último resultado da página anterior
+
+        Returns:
+            Pares (número do BOPM, chave de ordenação), por relevância e data
+        """
+        termos_match = []
+        condicoes_like = []
+        parametros: List = []
+
+        for coluna, (campo, _) in self.COLUNAS.items():
+            valor = BOPMValidator.normalizar_para_busca(filtros.get(campo, ""))
+            if not valor:
+                continue
+            if len(valor) >= 3:
+                termos_match.append(f'{coluna} : "{valor.replace(chr(34), chr(34) * 2)}"')
+            else:
+                # Trigramas exigem 3 caracteres; termos curtos usam LIKE
+                condicoes_like.append(f"docs.{coluna} LIKE ? ESCAPE '\\'")
+                escapado = valor.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+                parametros.append(f"%{escapado}%")
+
+        where = []
+        if termos_match:
+            where.append("docs MATCH ?")
+            parametros.insert(0, " AND ".join(termos_match))
+        where.extend(condicoes_like)
+        if not where:
+            return []
+
+        pesos = ", ".join(str(peso) for _, peso in self.COLUNAS.values())
+        relevancia = f"bm25(docs, {pesos})" if termos_match else "0.0"
+        # bm25() só vale na consulta com MATCH: materializa antes de filtrar pelo keyset
+        sql = (
+            "WITH c AS MATERIALIZED ("
+            f"SELECT r.numero_bopm, {relevancia} AS rank, r.data_atualizacao AS data, r.id AS id "
+            f"FROM docs JOIN registros r ON r.id = docs.rowid WHERE {' AND '.join(where)}) "
+            "SELECT numero_bopm, rank, data, id FROM c "
+        )
+        if apos:
+            rank, data, doc_id = apos
+            sql += "WHERE rank > ? OR (rank = ? AND (data < ? OR (data = ? AND id > ?))) "
+            parametros.extend([rank, rank, data, data, doc_id])
+        sql += "ORDER BY rank, data DESC, id LIMIT ?"
+        with self._lock:
+            linhas = self._conn.execute(sql, (*parametros, limite)).fetchall()
+        return [(numero, (rank, data, doc_id)) for numero, rank, data, doc_id in linhas]
+
+    def tamanho(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM registros").fetchone()[0]
+
+    def fechar(self) -> None:
+        with self._lock:
+            self._conn.close()
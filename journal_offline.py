@@ -0,0 +1,196 @@
+"""
+Módulo de Journal Offline (write-ahead)
+Registra em SQLite local os upserts feitos sem conexão com o MongoDB
+e os reaplica em lote quando a conexão volta
+"""
+import logging
+import sqlite3
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from bson import json_util
+from pymongo import UpdateOne, errors
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Código de erro do MongoDB para violação de índice único
+DUPLICATE_KEY = 11000
+
+
+class JournalOffline:
+    """Fila durável de upserts pendentes, um registro por número de BOPM"""
+
+    def __init__(self, caminho: str = Config.JOURNAL_PATH):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(caminho, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=FULL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS operacoes ("
+            " numero_bopm TEXT PRIMARY KEY,"
+            " documento TEXT NOT NULL,"
+            " registrado_em REAL NOT NULL)"
+        )
+        self.ultimo_replay: Dict = {}
+
+    def registrar(self, numero_bopm: str, documento: Dict) -> None:
+        """
+        Grava (ou substitui) o upsert pendente de um BOPM
+
+        Args:
+            numero_bopm: Chave do documento
+            documento: Documento completo, já pronto para $set
+        """
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO operacoes (numero_bopm, documento, registrado_em) VALUES (?, ?, ?) "
+                "ON CONFLICT(numero_bopm) DO UPDATE SET "
+                "documento = excluded.documento, registrado_em = excluded.registrado_em",
+                (numero_bopm, json_util.dumps(documento), time.time())
+            )
+        logger.info(f"💾 BOPM #{numero_bopm} registrado no journal offline")
+
+    def profundidade(self) -> int:
+        """Número de BOPMs aguardando sincronização"""
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM operacoes").fetchone()[0]
+
+    def buscar(self, numero_bopm: str) -> Optional[Dict]:
+        """Retorna a versão pendente de um BOPM, se houver"""
+        with self._lock:
+            linha = self._conn.execute(
+                "SELECT documento FROM operacoes WHERE numero_bopm = ?", (numero_bopm,)
+            ).fetchone()
+        return json_util.loads(linha[0]) if linha else None
+
+    def _ler_lote(self, limite: int) -> List[Tuple[str, str, float]]:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT numero_bopm, documento, registrado_em FROM operacoes "
+                "ORDER BY registrado_em LIMIT ?", (limite,)
+            ).fetchall()
+
+    def _remover(self, linhas: List[Tuple[str, str, float]]) -> None:
+        # Só remove se não houve novo registro do mesmo BOPM durante o replay
+        with self._lock:
+            self._conn.executemany(
+                "DELETE FROM operacoes WHERE numero_bopm = ? AND registrado_em = ?",
+                [(numero, registrado_em) for numero, _, registrado_em in linhas]
+            )
+
+    def reaplicar(self, collection, tamanho_lote: int = Config.JOURNAL_REPLAY_BATCH,
+                  ao_aplicar: Optional[Callable[[Optional[Dict], Dict], None]] = None,
+                  projecao_anterior: Optional[Dict] = None) -> Dict:
+        """
+        Reaplica os upserts pendentes com bulk_write em lotes.
+        Conflitos são resolvidos por data_atualizacao: a versão mais recente vence.
+
+        Args:
+            collection: Coleção MongoDB de destino
+            tamanho_lote: Operações por bulk_write
+            ao_aplicar: Chamado com (documento anterior ou None, documento gravado)
+                para cada upsert efetivamente aplicado (ex.: deltas de estatísticas)
+            projecao_anterior: Campos do documento anterior lidos para ao_aplicar
+
+        Returns:
+            Estatísticas do replay
+        """
+        inicio = time.perf_counter()
+        aplicados = conflitos = falhas = 0
+
+        while True:
+            linhas = self._ler_lote(tamanho_lote)
+            if not linhas:
+                break
+
+            documentos = [json_util.loads(documento_json) for _, documento_json, _ in linhas]
+            anteriores: Dict[str, Dict] = {}
+            if ao_aplicar:
+                try:
+                    anteriores = {
+                        doc["numero_bopm"]: doc for doc in collection.find(
+                            {"numero_bopm": {"$in": [numero for numero, _, _ in linhas]}},
+                            {**(projecao_anterior or {}), "numero_bopm": 1}
+                        )
+                    }
+                except errors.PyMongoError as e:
+                    logger.warning(f"Replay interrompido: {str(e)}")
+                    break
+
+            operacoes = []
+            for (numero, _, _), documento in zip(linhas, documentos):
+                filtro = {
+                    "numero_bopm": numero,
+                    "$or": [
+                        {"data_atualizacao": {"$lt": documento["data_atualizacao"]}},
+                        {"data_atualizacao": {"$exists": False}},
+                    ],
+                }
+                operacoes.append(UpdateOne(
+                    filtro,
+                    {"$set": documento, "$inc": {"_version": 1},
+                     "$currentDate": {"sincronizado_em": True},
+                     "$setOnInsert": {"data_criacao": documento["data_atualizacao"]}},
+                    upsert=True
+                ))
+
+            concluidas = list(linhas)
+            nao_aplicados = set()
+            try:
+                collection.bulk_write(operacoes, ordered=False)
+                aplicados += len(linhas)
+            except errors.BulkWriteError as e:
+                # Chave duplicada = o servidor já tem versão mais recente (servidor vence)
+                indices_falha = set()
+                for erro in e.details.get("writeErrors", []):
+                    nao_aplicados.add(erro["index"])
+                    if erro.get("code") == DUPLICATE_KEY:
+                        conflitos += 1
+                    else:
+                        indices_falha.add(erro["index"])
+                        logger.error(f"Falha no replay de #{linhas[erro['index']][0]}: {erro.get('errmsg')}")
+                falhas += len(indices_falha)
+                aplicados += len(linhas) - len(e.details.get("writeErrors", []))
+                concluidas = [l for i, l in enumerate(linhas) if i not in indices_falha]
+            except errors.PyMongoError as e:
+                logger.warning(f"Replay interrompido: {str(e)}")
+                break
+
+            if ao_aplicar:
+                for i, ((numero, _, _), documento) in enumerate(zip(linhas, documentos)):
+                    if i not in nao_aplicados:
+                        ao_aplicar(anteriores.get(numero), documento)
+
+            self._remover(concluidas)
+            if len(concluidas) < len(linhas):
+                # Falhas persistentes ficam no journal para a próxima tentativa
+                break
+
+        duracao = time.perf_counter() - inicio
+        self.ultimo_replay = {
+            "aplicados": aplicados,
+            "conflitos": conflitos,
+            "falhas": falhas,
+            "segundos": duracao,
+            "registros_por_s": (aplicados + conflitos) / duracao if duracao > 0 else 0.0,
+        }
+        if aplicados or conflitos or falhas:
+            logger.info(
+                f"✓ Journal reaplicado: {aplicados} aplicados, {conflitos} conflitos, "
+                f"{falhas} falhas ({self.ultimo_replay['registros_por_s']:.0f} reg/s)"
+            )
+        return self.ultimo_replay
+
+    def estatisticas(self) -> Dict:
+        """Retorna profundidade da fila e métricas do último replay"""
+        return {
+            "pendentes": self.profundidade(),
+            "ultimo_replay": self.ultimo_replay,
+        }
+
+    def fechar(self) -> None:
+        with self._lock:
+            self._conn.close()
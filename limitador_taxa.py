@@ -0,0 +1,70 @@
+"""
+Módulo de Limitação de Taxa (token bucket)
+Mantém as chamadas em lote dentro da cota do Gemini:
+requisições por minuto e tokens por minuto
+"""
+import asyncio
+import time
+from typing import Dict
+
+from config import Config
+
+
+class BaldeTokens:
+    """Balde que enche continuamente até a capacidade de um minuto de cota"""
+
+    def __init__(self, por_minuto: float):
+        self.capacidade = float(por_minuto)
+        self.taxa = por_minuto / 60.0
+        self.disponivel = self.capacidade
+        self._atualizado = time.monotonic()
+
+    def reabastecer(self) -> None:
+        agora = time.monotonic()
+        self.disponivel = min(self.capacidade, self.disponivel + (agora - self._atualizado) * self.taxa)
+        self._atualizado = agora
+
+    def espera_para(self, quantidade: float) -> float:
+        """Segundos até haver a quantidade pedida (0 se já há)"""
+        faltam = min(quantidade, self.capacidade) - self.disponivel
+        return max(0.0, faltam / self.taxa)
+
+
+class LimitadorTaxa:
+    """Token bucket duplo (RPM e TPM) para uso com asyncio"""
+
+    def __init__(self, rpm: float = Config.IA_QUOTA_RPM, tpm: float = Config.IA_QUOTA_TPM):
+        self.requisicoes = BaldeTokens(rpm)
+        self.tokens = BaldeTokens(tpm)
+        self._lock = asyncio.Lock()
+        self.tempo_em_espera = 0.0
+
+    async def adquirir(self, tokens_estimados: int) -> None:
+        """Aguarda até haver cota para uma requisição com o volume estimado"""
+        async with self._lock:
+            while True:
+                self.requisicoes.reabastecer()
+                self.tokens.reabastecer()
+                espera = max(self.requisicoes.espera_para(1), self.tokens.espera_para(tokens_estimados))
+                if espera <= 0:
+                    self.requisicoes.disponivel -= 1
+                    self.tokens.disponivel -= min(tokens_estimados, self.tokens.capacidade)
+                    return
+                self.tempo_em_espera += espera
+                await asyncio.sleep(espera)
+
+    def ajustar(self, tokens_estimados: int, tokens_reais: int) -> None:
+        """Corrige o balde de tokens com o consumo informado pela API"""
+        self.tokens.disponivel -= tokens_reais - tokens_estimados
+
+    def estatisticas(self) -> Dict:
+        return {
+            "rpm": self.requisicoes.capacidade,
+            "tpm": self.tokens.capacidade,
+            "segundos_em_espera": round(self.tempo_em_espera, 1),
+        }
+
+
+def estimar_tokens(prompt: str) -> int:
+    """Estimativa de tokens de entrada + saída (o texto gerado tem tamanho similar ao rascunho)"""
+    return int(len(prompt) * Config.IA_TOKENS_POR_CARACTERE * 2)
@@ -0,0 +1,84 @@
+"""
+Módulo de Monitoramento da Conexão MongoDB
+Mantém o estado de saúde em cache a partir dos eventos do driver,
+sem round-trips extras por operação
+"""
+import logging
+import threading
+from typing import Callable, List, Optional
+
+from pymongo import monitoring
+
+logger = logging.getLogger(__name__)
+
+
+class MonitorConexao(monitoring.TopologyListener, monitoring.ServerHeartbeatListener):
+    """Listener de topologia/heartbeat do pymongo que alimenta o estado da conexão"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._online: Optional[bool] = None
+        self._observadores: List[Callable[[Optional[bool]], None]] = []
+        self.ultimo_rtt_ms: Optional[float] = None
+        self.falhas_heartbeat = 0
+        self.mudou = threading.Event()
+
+    @property
+    def online(self) -> Optional[bool]:
+        """True/False após o primeiro evento de topologia; None enquanto desconhecido"""
+        return self._online
+
+    def adicionar_observador(self, callback: Callable[[Optional[bool]], None]) -> None:
+        """
+        Registra callback chamado a cada mudança de estado
+
+        Args:
+            callback: Recebe o novo estado (chamado na thread do monitor)
+        """
+        self._observadores.append(callback)
+
+    def definir_estado(self, online: Optional[bool]) -> None:
+        """Atualiza o estado em cache e notifica observadores se houve mudança"""
+        with self._lock:
+            if online == self._online:
+                return
+            self._online = online
+
+        if online:
+            logger.info("✓ MongoDB disponível")
+        elif online is False:
+            logger.warning("✗ MongoDB indisponível")
+
+        self.notificar()
+
+    def notificar(self) -> None:
+        """Acorda quem aguarda mudanças e chama os observadores com o estado atual"""
+        online = self._online
+        self.mudou.set()
+        for callback in list(self._observadores):
+            try:
+                callback(online)
+            except Exception as e:
+                logger.error(f"Erro em observador de conexão: {str(e)}")
+
+    # === TopologyListener ===
+    def opened(self, event: monitoring.TopologyOpenedEvent) -> None:
+        logger.debug(f"Topologia aberta: {event.topology_id}")
+
+    def description_changed(self, event: monitoring.TopologyDescriptionChangedEvent) -> None:
+        self.definir_estado(event.new_description.has_writable_server())
+
+    def closed(self, event: monitoring.TopologyClosedEvent) -> None:
+        self.definir_estado(False)
+
+    # === ServerHeartbeatListener ===
+    def started(self, event: monitoring.ServerHeartbeatStartedEvent) -> None:
+        pass
+
+    def succeeded(self, event: monitoring.ServerHeartbeatSucceededEvent) -> None:
+        self.ultimo_rtt_ms = event.duration * 1000
+        self.falhas_heartbeat = 0
+
+    def failed(self, event: monitoring.ServerHeartbeatFailedEvent) -> None:
+        self.falhas_heartbeat += 1
+        logger.debug(f"Heartbeat falhou ({event.connection_id}): {event.reply}")
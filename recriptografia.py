@@ -0,0 +1,184 @@
+"""
+Módulo de Recriptografia em Lote
+Reescreve os campos sensíveis da coleção de ocorrências com a chave ativa
+(ou em texto puro, ao desligar a criptografia) em segundo plano, com
+checkpoint para retomar e pausas entre lotes para não competir com a interface
+"""
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Optional
+
+from bson import ObjectId
+from pymongo import ASCENDING, UpdateOne
+
+from compressao import CAMPOS_COMPRIMIDOS, compressor
+from config import Config
+from security import security
+from user_settings import settings
+
+logger = logging.getLogger(__name__)
+
+CAMPOS = ("infrator", "texto_final")
+
+# Um único job por processo
+_lock_execucao = threading.Lock()
+
+
+def _caminho(caminho: Optional[str]) -> Path:
+    return Path(caminho or Config.REENCRYPT_CHECKPOINT_PATH)
+
+
+def ler_checkpoint(caminho: Optional[str] = None) -> Optional[Dict]:
+    """Estado do job pendente, ou None se não há recriptografia em andamento"""
+    arquivo = _caminho(caminho)
+    if not arquivo.exists():
+        return None
+    try:
+        with open(arquivo, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception as e:
+        logger.error(f"✗ Checkpoint de recriptografia ilegível: {str(e)}")
+        return None
+
+
+def _gravar_checkpoint(estado: Dict, caminho: Optional[str] = None) -> None:
+    arquivo = _caminho(caminho)
+    temporario = arquivo.with_suffix(".tmp")
+    with open(temporario, "w", encoding="utf-8") as f:
+        json.dump(estado, f, indent=2)
+    os.replace(temporario, arquivo)
+
+
+def agendar_recriptografia(criptografar: bool, caminho: Optional[str] = None) -> Dict:
+    """
+    Registra um job do início da coleção; o app o executa em segundo plano
+    ao conectar (ou use 'bopm_cli.py chaves recriptografar')
+    """
+    estado = {
+        "criptografar": criptografar,
+        "id_chave": security.id_chave if criptografar else None,
+        "ultimo_id": None,
+        "processados": 0,
+        "alterados": 0,
+        "ilegiveis": 0,
+        "agendado_em": datetime.now().isoformat(timespec="seconds"),
+    }
+    _gravar_checkpoint(estado, caminho)
+    logger.info(f"Recriptografia agendada ({'criptografar' if criptografar else 'descriptografar'})")
+    return estado
+
+
+class JobRecriptografia:
+    """Percorre a coleção em ordem de _id reescrevendo infrator/texto_final via bulk_write"""
+
+    def __init__(self, collection, caminho_checkpoint: Optional[str] = None):
+        self.collection = collection
+        self.caminho_checkpoint = caminho_checkpoint
+
+    def _estado_inicial(self, criptografar: Optional[bool]) -> Dict:
+        estado = ler_checkpoint(self.caminho_checkpoint)
+        if criptografar is None:
+            criptografar = estado["criptografar"] if estado else settings.get(
+                "security", "encrypt_sensitive_data", False
+            )
+        id_chave = security.id_chave if criptografar else None
+        if estado is None or estado["criptografar"] != criptografar or estado.get("id_chave") != id_chave:
+            # Outro modo ou nova rotação: o progresso anterior não vale mais
+            estado = agendar_recriptografia(criptografar, self.caminho_checkpoint)
+        return estado
+
+    def _reescrever(self, documentos, criptografar: bool, estado: Dict) -> int:
+        """Monta e envia as atualizações de um lote; retorna quantos documentos mudaram"""
+        pendentes = [
+            (documento, campo)
+            for documento in documentos
+            for campo in CAMPOS
+            if security.precisa_recriptografar(documento.get(campo) or "", criptografar)
+        ]
+        textos = security.descriptografar_lote([documento[campo] for documento, campo in pendentes])
+
+        novos: Dict[ObjectId, Dict] = {}
+        for (documento, campo), texto in zip(pendentes, textos):
+            if security.criptografado(texto):
+                # Chave ausente do chaveiro: mantém o valor como está
+                estado["ilegiveis"] += 1
+                continue
+            if campo in CAMPOS_COMPRIMIDOS:
+                # Valores já comprimidos passam direto; os demais são comprimidos agora
+                texto = compressor.comprimir(texto)
+            novos.setdefault(documento["_id"], {})[campo] = security.encrypt(texto) if criptografar else texto
+
+        originais = {documento["_id"]: documento for documento in documentos}
+        operacoes = [
+            # Compara-e-troca: um salvamento concorrente não é sobrescrito
+            UpdateOne(
+                {"_id": doc_id, **{campo: originais[doc_id][campo] for campo in campos}},
+                {"$set": campos}
+            )
+            for doc_id, campos in novos.items()
+        ]
+        if not operacoes:
+            return 0
+        return self.collection.bulk_write(operacoes, ordered=False).modified_count
+
+    def executar(self, criptografar: Optional[bool] = None,
+                 tamanho_lote: int = Config.REENCRYPT_BATCH_SIZE,
+                 pausa_s: float = Config.REENCRYPT_PAUSA_S,
+                 parar: Optional[threading.Event] = None) -> Dict:
+        """
+        Executa (ou retoma) a recriptografia
+
+        Args:
+            criptografar: True para a chave ativa, False para texto puro;
+                None retoma o job pendente ou segue a configuração atual
+            tamanho_lote: Documentos por lote
+            pausa_s: Pausa entre lotes
+            parar: Evento que interrompe o job (o progresso fica no checkpoint)
+
+        Returns:
+            Estado final, com "concluido" indicando se a coleção foi percorrida
+        """
+        if not _lock_execucao.acquire(blocking=False):
+            raise RuntimeError("Recriptografia já em andamento")
+        try:
+            estado = self._estado_inicial(criptografar)
+            criptografar = estado["criptografar"]
+            parar = parar or threading.Event()
+            inicio = time.perf_counter()
+
+            while not parar.is_set():
+                filtro = {"_id": {"$gt": ObjectId(estado["ultimo_id"])}} if estado["ultimo_id"] else {}
+                documentos = list(
+                    self.collection.find(filtro, {campo: 1 for campo in CAMPOS})
+                    .sort("_id", ASCENDING)
+                    .limit(tamanho_lote)
+                )
+                if not documentos:
+                    _caminho(self.caminho_checkpoint).unlink(missing_ok=True)
+                    estado["concluido"] = True
+                    logger.info(
+                        f"✓ Recriptografia concluída: {estado['processados']} documentos, "
+                        f"{estado['alterados']} reescritos, {estado['ilegiveis']} campos ilegíveis"
+                    )
+                    return estado
+
+                estado["alterados"] += self._reescrever(documentos, criptografar, estado)
+                estado["processados"] += len(documentos)
+                estado["ultimo_id"] = str(documentos[-1]["_id"])
+                _gravar_checkpoint(estado, self.caminho_checkpoint)
+
+                if estado["processados"] % Config.BULK_PROGRESS_EVERY < tamanho_lote:
+                    taxa = estado["processados"] / (time.perf_counter() - inicio)
+                    logger.info(f"Recriptografados {estado['processados']} documentos ({taxa:.0f} doc/s)")
+                parar.wait(pausa_s)
+
+            estado["concluido"] = False
+            logger.info(f"Recriptografia interrompida em {estado['processados']} documentos (retomável)")
+            return estado
+        finally:
+            _lock_execucao.release()
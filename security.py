@@ -1,20 +1,290 @@
-from cryptography.fernet import Fernet
+from cryptography.fernet import Fernet, InvalidToken
 from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
 from cryptography.hazmat.backends import default_backend
 import base64
+import hmac
+import json
+import logging
+import os
 import re
 import hashlib
 import secrets
-from typing import Optional
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+
+from config import Config
+from validators import BOPMValidator
+from compressao import ErroCompressao, compressor
+
+logger = logging.getLogger(__name__)
+
+# Envelope versionado: "bopm1:<id da chave>:<token Fernet>"
+ENVELOPE = "bopm1:"
+# Tokens Fernet gravados antes do envelope (versão 0x80 + timestamp em base64)
+_TOKEN_LEGADO = re.compile(r"gAAAAA[A-Za-z0-9_\-]{92,}={0,2}")
+# Documento do chaveiro compartilhado que indica a chave ativa
+_ESTADO_CHAVEIRO = "estado"
+
+
+def _id_da_chave(chave: bytes) -> str:
+    return hashlib.sha256(chave).hexdigest()[:8]
+
 
 class SecurityManager:
-    def __init__(self, master_key: Optional[str] = None):
+    """
+    Criptografia de campos com chaveiro persistente
+
+    O chaveiro (Config.KEYRING_PATH) guarda todas as chaves já usadas,
+    identificadas pelo id gravado no envelope, a chave ativa (usada para
+    criptografar) e a chave do blind index, que nunca muda na rotação.
+    Com BOPM_MASTER_KEY, a chave derivada dela faz parte do chaveiro e as
+    demais são gravadas protegidas por uma subchave sua, tanto no arquivo
+    local quanto na coleção Config.KEYRING_COLLECTION, comum às estações.
+    Sem chave mestra não há chaveiro compartilhado nem rotação.
+    """
+    
+    def __init__(self, master_key: Optional[str] = None,
+                 caminho_chaves: Optional[str] = Config.KEYRING_PATH):
+        self._lock_chaves = threading.RLock()
+        self._chaves: Dict[str, bytes] = {}
+        self._cifras: Dict[str, Fernet] = {}
+        self._protecao: Optional[Fernet] = None
+        # Entradas do arquivo que não puderam ser abertas: enquanto houver, o arquivo não é regravado
+        self._chaves_ilegiveis: Dict[str, str] = {}
+        self._em_texto_claro = False
+        self._ultima_recarga = 0.0
+        self._colecao_chaves = None
+        self.caminho_chaves = Path(caminho_chaves) if caminho_chaves else None
+        
+        ativa = indice = None
         if master_key:
-            self.key = self._derive_key(master_key)
-        else:
-            self.key = Fernet.generate_key()
-        self.cipher = Fernet(self.key)
+            chave_mestra = self._derive_key(master_key)
+            ativa = indice = self._adicionar_chave(chave_mestra)
+            self._protecao = Fernet(base64.urlsafe_b64encode(
+                self._derivar_subchave(chave_mestra, b"bopm-keyring")
+            ))
+        
+        chaveiro = self._ler_chaveiro()
+        if chaveiro:
+            ativa = chaveiro.get("ativa") or ativa
+            indice = chaveiro.get("indice") or indice
+        if ativa is None:
+            # Sem chave mestra nem chaveiro: cria e persiste uma chave, para que
+            # o que foi criptografado continue legível na próxima execução
+            ativa = indice = self._adicionar_chave(Fernet.generate_key())
+            if self.caminho_chaves is not None and self.caminho_chaves.exists():
+                # Nunca sobrescreve um chaveiro que não pôde ser aberto
+                logger.error("✗ Nenhuma chave do chaveiro pôde ser aberta: usando chave temporária")
+            else:
+                self._gravar_chaveiro(ativa, indice)
+        elif self._em_texto_claro and self._protecao is not None:
+            # Chaveiro criado antes da BOPM_MASTER_KEY: passa a guardá-lo protegido
+            self._gravar_chaveiro(ativa, indice)
+            logger.info("✓ Chaveiro local protegido com a BOPM_MASTER_KEY")
+        
+        self._ativar(ativa)
+        self.id_indice = indice
+        self.chave_indice = self._derivar_subchave(self._chaves[indice], b"bopm-blind-index")
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._lock_pool = threading.Lock()
+    
+    def _ativar(self, id_chave: str) -> None:
+        self.id_chave = id_chave
+        self.key = self._chaves[id_chave]
+        self.cipher = self._cifras[id_chave]
+    
+    def _adicionar_chave(self, chave: bytes) -> str:
+        id_chave = _id_da_chave(chave)
+        self._chaves[id_chave] = chave
+        self._cifras[id_chave] = Fernet(chave)
+        return id_chave
+    
+    def _ler_chaveiro(self) -> Optional[Dict]:
+        """
+        Carrega as chaves do arquivo. Chaves que não puderem ser abertas ficam
+        em _chaves_ilegiveis, como estavam, e impedem a regravação do arquivo.
+        Chaves em texto claro (gravadas sem chave mestra) são aceitas e
+        marcadas para serem protegidas na próxima gravação.
+        """
+        if self.caminho_chaves is None or not self.caminho_chaves.exists():
+            return None
+        try:
+            with open(self.caminho_chaves, "r", encoding="utf-8") as f:
+                chaveiro = json.load(f)
+        except Exception as e:
+            logger.error(f"✗ Erro ao ler chaveiro: {str(e)}")
+            return None
+        
+        self._chaves_ilegiveis = {}
+        self._em_texto_claro = False
+        for id_chave, armazenada in chaveiro.get("chaves", {}).items():
+            if id_chave in self._chaves:
+                continue
+            chave = armazenada.encode()
+            if _id_da_chave(chave) == id_chave:
+                self._adicionar_chave(chave)
+                self._em_texto_claro = True
+                continue
+            if self._protecao is not None:
+                try:
+                    chave = self._protecao.decrypt(chave)
+                    if _id_da_chave(chave) == id_chave:
+                        self._adicionar_chave(chave)
+                        continue
+                except InvalidToken:
+                    pass
+            self._chaves_ilegiveis[id_chave] = armazenada
+            logger.error(f"✗ Chave {id_chave} do chaveiro não pôde ser aberta (BOPM_MASTER_KEY incorreta?)")
+        
+        for campo in ("ativa", "indice"):
+            if chaveiro.get(campo) and chaveiro[campo] not in self._chaves:
+                chaveiro[campo] = None
+        return chaveiro
+    
+    def _gravar_chaveiro(self, ativa: str, indice: str) -> None:
+        """
+        Grava o chaveiro de forma atômica e legível apenas pelo usuário.
+        Não grava se alguma chave do arquivo não pôde ser aberta: regravar
+        apagaria essa chave e os dados criptografados com ela.
+        """
+        if self.caminho_chaves is None:
+            return
+        if self._chaves_ilegiveis:
+            logger.error(f"✗ Chaveiro local não atualizado: {len(self._chaves_ilegiveis)} chave(s) "
+                         f"não puderam ser abertas ({', '.join(sorted(self._chaves_ilegiveis))})")
+            return
+        chaves = {
+            id_chave: (self._protecao.encrypt(chave) if self._protecao else chave).decode()
+            for id_chave, chave in self._chaves.items()
+        }
+        temporario = self.caminho_chaves.with_suffix(".tmp")
+        with open(temporario, "w", encoding="utf-8") as f:
+            json.dump({"versao": 1, "ativa": ativa, "indice": indice, "chaves": chaves}, f, indent=2)
+        os.chmod(temporario, 0o600)
+        os.replace(temporario, self.caminho_chaves)
+    
+    # === CHAVEIRO COMPARTILHADO ===
+    def conectar_chaveiro_compartilhado(self, colecao) -> None:
+        """
+        Passa a usar a coleção do MongoDB como chaveiro comum às estações:
+        publica as chaves locais, traz as das outras estações e adota a
+        chave ativa registrada no banco (ignorado sem BOPM_MASTER_KEY)
+        """
+        if self._protecao is None:
+            logger.warning("Sem BOPM_MASTER_KEY: chaveiro compartilhado desativado")
+            return
+        with self._lock_chaves:
+            self._colecao_chaves = colecao
+            for id_chave, chave in list(self._chaves.items()):
+                colecao.update_one(
+                    {"_id": id_chave},
+                    {"$setOnInsert": {"chave": self._protecao.encrypt(chave).decode(),
+                                      "criada_em": datetime.now()}},
+                    upsert=True
+                )
+            # Primeira estação a conectar define a chave ativa comum
+            colecao.update_one({"_id": _ESTADO_CHAVEIRO}, {"$setOnInsert": {"ativa": self.id_chave}}, upsert=True)
+            self._sincronizar_compartilhado()
+    
+    def _sincronizar_compartilhado(self) -> None:
+        """Traz as chaves e a chave ativa da coleção, guardando-as no arquivo local"""
+        conhecidas = len(self._chaves)
+        anterior = self.id_chave
+        ativa = None
+        for documento in self._colecao_chaves.find({}, max_time_ms=Config.DB_TIMEOUT_MS):
+            if documento["_id"] == _ESTADO_CHAVEIRO:
+                ativa = documento.get("ativa")
+                continue
+            if documento["_id"] in self._chaves:
+                continue
+            try:
+                chave = self._protecao.decrypt(documento["chave"].encode())
+            except InvalidToken:
+                logger.error(f"✗ Chave compartilhada {documento['_id']} não pôde ser aberta "
+                             f"(BOPM_MASTER_KEY diferente entre as estações?)")
+                continue
+            if _id_da_chave(chave) == documento["_id"]:
+                self._adicionar_chave(chave)
+        
+        if ativa in self._chaves and ativa != self.id_chave:
+            self._ativar(ativa)
+            logger.info(f"✓ Chave ativa do chaveiro compartilhado: {ativa}")
+        elif ativa and ativa not in self._chaves:
+            logger.error(f"✗ Chave ativa {ativa} do chaveiro compartilhado não pôde ser aberta")
+        if len(self._chaves) != conhecidas or self.id_chave != anterior:
+            # Cópia local: permite ler e salvar sem conexão
+            self._gravar_chaveiro(self.id_chave, self.id_indice)
+    
+    def rotacionar_chave(self) -> str:
+        """
+        Cria uma nova chave, publica-a no chaveiro compartilhado e passa a
+        criptografar com ela. As anteriores continuam no chaveiro para ler os
+        dados ainda não recriptografados.
+        
+        Returns:
+            Id da nova chave ativa
+            
+        Raises:
+            ValueError: Sem BOPM_MASTER_KEY (a chave não pode ser compartilhada)
+            ConnectionError: Sem o chaveiro compartilhado (banco não conectado)
+        """
+        if self._protecao is None:
+            raise ValueError("Defina a mesma BOPM_MASTER_KEY em todas as estações antes de rotacionar")
+        if self._colecao_chaves is None:
+            raise ConnectionError("Conecte ao banco para rotacionar: a nova chave precisa chegar às outras estações")
+        if self._chaves_ilegiveis:
+            raise ValueError("O chaveiro local tem chaves que não puderam ser abertas: "
+                             "confira a BOPM_MASTER_KEY antes de rotacionar")
+        with self._lock_chaves:
+            chave = Fernet.generate_key()
+            id_chave = _id_da_chave(chave)
+            # Publica antes de usar: nenhum dado é gravado com uma chave só local
+            self._colecao_chaves.insert_one({
+                "_id": id_chave,
+                "chave": self._protecao.encrypt(chave).decode(),
+                "criada_em": datetime.now(),
+            })
+            self._colecao_chaves.update_one(
+                {"_id": _ESTADO_CHAVEIRO}, {"$set": {"ativa": id_chave}}, upsert=True
+            )
+            self._adicionar_chave(chave)
+            self._gravar_chaveiro(id_chave, self.id_indice)
+            self._ativar(id_chave)
+        logger.info(f"✓ Nova chave ativa: {id_chave}")
+        return id_chave
+    
+    def recarregar_chaves(self) -> None:
+        """Relê o chaveiro local e o compartilhado (ex.: chave rotacionada por outra estação)"""
+        with self._lock_chaves:
+            self._ultima_recarga = time.monotonic()
+            chaveiro = self._ler_chaveiro()
+            if chaveiro and chaveiro.get("ativa"):
+                self._ativar(chaveiro["ativa"])
+            if self._colecao_chaves is not None:
+                try:
+                    self._sincronizar_compartilhado()
+                except Exception as e:
+                    logger.warning(f"Chaveiro compartilhado indisponível: {str(e)}")
+    
+    def ids_chaves(self) -> List[str]:
+        return sorted(self._chaves)
+    
+    @staticmethod
+    def _derivar_subchave(chave: bytes, contexto: bytes) -> bytes:
+        hkdf = HKDF(
+            algorithm=hashes.SHA256(),
+            length=32,
+            salt=None,
+            info=contexto,
+            backend=default_backend()
+        )
+        return hkdf.derive(base64.urlsafe_b64decode(chave))
     
     def _derive_key(self, password: str) -> bytes:
         kdf = PBKDF2HMAC(
@@ -26,14 +296,131 @@ class SecurityManager:
         )
         return base64.urlsafe_b64encode(kdf.derive(password.encode()))
     
-    def encrypt(self, data: str) -> str:
-        return self.cipher.encrypt(data.encode()).decode()
+    def encrypt(self, data) -> str:
+        """Criptografa texto ou bytes (ex.: texto já comprimido)"""
+        dados = data if isinstance(data, bytes) else data.encode()
+        token = self.cipher.encrypt(dados).decode()
+        return f"{ENVELOPE}{self.id_chave}:{token}"
     
     def decrypt(self, encrypted_data: str) -> str:
-        try:
-            return self.cipher.decrypt(encrypted_data.encode()).decode()
-        except Exception:
-            return ""
+        texto = self._decifrar(encrypted_data)
+        return texto if texto is not None else ""
+    
+    @staticmethod
+    def criptografado(valor) -> bool:
+        """Reconhece valores criptografados pelo formato, sem tentar descriptografar"""
+        if not isinstance(valor, str):
+            return False
+        return valor.startswith(ENVELOPE) or bool(_TOKEN_LEGADO.fullmatch(valor))
+    
+    def _decifrar(self, valor: str) -> Optional[str]:
+        """Descriptografa um envelope ou token legado; None se não for possível"""
+        if valor.startswith(ENVELOPE):
+            id_chave, _, token = valor[len(ENVELOPE):].partition(":")
+            cifra = self._cifras.get(id_chave)
+            if cifra is None and time.monotonic() - self._ultima_recarga >= Config.KEYRING_RELOAD_MIN_S:
+                self.recarregar_chaves()
+                cifra = self._cifras.get(id_chave)
+            cifras = [cifra] if cifra is not None else []
+        elif _TOKEN_LEGADO.fullmatch(valor):
+            # Tokens sem envelope não dizem a chave: tenta a ativa e depois as demais
+            token = valor
+            cifras = [self.cipher] + [c for i, c in self._cifras.items() if i != self.id_chave]
+        else:
+            return None
+        for cifra in cifras:
+            try:
+                dados = cifra.decrypt(token.encode())
+            except InvalidToken:
+                continue
+            # Textos comprimidos antes da criptografia
+            try:
+                return compressor.descomprimir(dados) if compressor.comprimido(dados) else dados.decode()
+            except ErroCompressao as e:
+                # Fica como ilegível (criptografado), igual a uma chave ausente
+                logger.error(f"✗ Campo criptografado ilegível: {str(e)}")
+                return None
+        return None
+    
+    def precisa_recriptografar(self, valor, criptografar: bool) -> bool:
+        """Se o campo não está no estado desejado (envelope da chave ativa, ou texto puro)"""
+        if not valor:
+            return False
+        if isinstance(valor, bytes):
+            # Texto comprimido sem criptografia
+            return criptografar
+        if criptografar:
+            return not valor.startswith(f"{ENVELOPE}{self.id_chave}:")
+        return self.criptografado(valor)
+    
+    def descriptografar_campo(self, valor):
+        """Texto puro é devolvido sem custo; se a descriptografia falhar, devolve o original"""
+        if not valor or not self.criptografado(valor):
+            return valor
+        texto = self._decifrar(valor)
+        return texto if texto is not None else valor
+    
+    def descriptografar_lote(self, valores: Sequence[str]) -> List[str]:
+        """
+        Descriptografa vários campos de uma vez (ex.: uma página de resultados)
+        
+        Texto puro é devolvido como está. Os valores criptografados vão para
+        um pool de threads quando são muitos e Config.CRYPTO_WORKERS > 1.
+        """
+        resultado = list(valores)
+        posicoes = [i for i, valor in enumerate(resultado) if valor and self.criptografado(valor)]
+        if Config.CRYPTO_WORKERS <= 1 or len(posicoes) < Config.CRYPTO_LOTE_MIN_PARALELO:
+            decifrados = [self._decifrar(resultado[i]) for i in posicoes]
+        else:
+            decifrados = list(self._obter_pool().map(self._decifrar, [resultado[i] for i in posicoes]))
+        for i, texto in zip(posicoes, decifrados):
+            if texto is not None:
+                resultado[i] = texto
+        return resultado
+    
+    def _obter_pool(self) -> ThreadPoolExecutor:
+        with self._lock_pool:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(
+                    max_workers=Config.CRYPTO_WORKERS, thread_name_prefix="bopm-cripto"
+                )
+            return self._pool
+    
+    def blind_index(self, valor: str) -> str:
+        """Token HMAC determinístico: permite busca por igualdade sem expor o valor"""
+        digest = hmac.new(self.chave_indice, valor.encode(), hashlib.sha256).digest()
+        return base64.urlsafe_b64encode(digest[:16]).decode().rstrip("=")
+    
+    def tokens_busca(self, valor: str) -> List[str]:
+        """
+        Gera tokens de blind index para valor exato e prefixos normalizados
+        (do texto inteiro e de cada palavra). Prefixos revelam apenas
+        igualdade entre tokens, nunca o conteúdo.
+        """
+        normalizado = BOPMValidator.normalizar_para_busca(valor)
+        if not normalizado:
+            return []
+        
+        tokens = {self.blind_index("e:" + normalizado)}
+        minimo, maximo = Config.BLIND_INDEX_MIN_PREFIX, Config.BLIND_INDEX_MAX_PREFIX
+        for termo in [normalizado] + normalizado.split():
+            for tamanho in range(minimo, min(len(termo), maximo) + 1):
+                tokens.add(self.blind_index("p:" + termo[:tamanho]))
+        return sorted(tokens)
+    
+    def token_consulta(self, consulta: str, exato: bool = False) -> Optional[str]:
+        """
+        Token para buscar documentos cujo valor (ou alguma palavra) começa com a consulta,
+        ou cujo valor é exatamente a consulta (exato=True).
+        Consultas maiores que o prefixo máximo são truncadas; o chamador deve
+        confirmar o resultado após descriptografar.
+        """
+        normalizado = BOPMValidator.normalizar_para_busca(consulta)
+        if exato:
+            return self.blind_index("e:" + normalizado) if normalizado else None
+        if len(normalizado) < Config.BLIND_INDEX_MIN_PREFIX:
+            return None
+        return self.blind_index("p:" + normalizado[:Config.BLIND_INDEX_MAX_PREFIX])
     
     @staticmethod
     def hash_password(password: str) -> str:
@@ -61,4 +448,4 @@ class SecurityManager:
             return mask_char * len(data)
         return mask_char * (len(data) - keep_last) + data[-keep_last:]
 
-security = SecurityManager()
+security = SecurityManager(os.getenv("BOPM_MASTER_KEY"))
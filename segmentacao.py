@@ -0,0 +1,66 @@
+"""
+Módulo de Segmentação de Rascunhos
+Divide rascunhos longos em trechos por parágrafo para geração em paralelo,
+de forma estável: editar um parágrafo altera apenas o seu trecho
+"""
+import re
+from typing import List
+
+from config import Config
+
+_SEPARADOR_PARAGRAFOS = re.compile(r"\n\s*\n")
+_FIM_DE_FRASE = re.compile(r"(?<=[.!?;])\s+")
+
+
+def _quebrar_paragrafo(paragrafo: str, max_chars: int) -> List[str]:
+    """Quebra um parágrafo longo em blocos de frases inteiras"""
+    blocos: List[str] = []
+    atual = ""
+    for frase in _FIM_DE_FRASE.split(paragrafo):
+        if atual and len(atual) + 1 + len(frase) > max_chars:
+            blocos.append(atual)
+            atual = frase
+        else:
+            atual = f"{atual} {frase}" if atual else frase
+    if atual:
+        blocos.append(atual)
+    return blocos
+
+
+def dividir_em_segmentos(texto: str,
+                         min_chars: int = Config.IA_SEGMENTO_MIN_CHARS,
+                         max_chars: int = Config.IA_SEGMENTO_MAX_CHARS) -> List[str]:
+    """
+    Divide o rascunho em trechos
+
+    Cada parágrafo vira um trecho; parágrafos curtos são anexados ao anterior
+    e parágrafos longos são quebrados em frases. O agrupamento nunca depende
+    de parágrafos distantes, para que os demais trechos continuem no cache.
+
+    Args:
+        texto: Rascunho completo
+        min_chars: Tamanho abaixo do qual o parágrafo é anexado ao anterior
+        max_chars: Tamanho máximo de um trecho (exceto frases maiores que isso)
+
+    Returns:
+        Lista de trechos na ordem original
+    """
+    paragrafos = [p.strip() for p in _SEPARADOR_PARAGRAFOS.split(texto) if p.strip()]
+    if len(paragrafos) <= 1:
+        # Sem linhas em branco: usa as quebras de linha simples como parágrafos
+        paragrafos = [p.strip() for p in texto.splitlines() if p.strip()]
+
+    segmentos: List[str] = []
+    for paragrafo in paragrafos:
+        if len(paragrafo) > max_chars:
+            segmentos.extend(_quebrar_paragrafo(paragrafo, max_chars))
+        elif segmentos and len(paragrafo) < min_chars and len(segmentos[-1]) + len(paragrafo) <= max_chars:
+            segmentos[-1] = f"{segmentos[-1]}\n{paragrafo}"
+        else:
+            segmentos.append(paragrafo)
+    return segmentos
+
+
+def juntar_segmentos(textos: List[str]) -> str:
+    """Reúne os trechos formalizados em um único relato"""
+    return "\n\n".join(texto.strip() for texto in textos if texto and texto.strip())
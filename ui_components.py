@@ -1,7 +1,9 @@
 import customtkinter as ctk
+import tkinter
 from tkinter import messagebox
-from typing import Callable, Optional
+from typing import Any, Callable, List, NamedTuple, Optional, Sequence, Tuple
 from user_settings import settings
+from recriptografia import agendar_recriptografia
 import sys
 import os
 
@@ -112,6 +114,284 @@ class SearchFrame(ctk.CTkFrame):
     def update_status(self, connected: bool):
         self.label_status.configure(text="🟢 MongoDB" if connected else "🔴 Offline")
 
+def _formatar_padrao(valor: Any) -> str:
+    return "N/A" if valor in (None, "") else str(valor)
+
+
+def _chave_ordenacao(valor: Any):
+    # Vazios sempre juntos; textos sem diferenciar maiúsculas
+    if valor in (None, ""):
+        return (1, "")
+    return (0, valor.casefold() if isinstance(valor, str) else valor)
+
+
+class Coluna(NamedTuple):
+    atributo: str
+    titulo: str
+    largura: int
+    formatar: Callable[[Any], str] = _formatar_padrao
+
+
+class _LinhaTabela:
+    __slots__ = ("frame", "rotulos", "textos", "visivel")
+
+    def __init__(self, frame, rotulos):
+        self.frame = frame
+        self.rotulos = rotulos
+        self.textos = [""] * len(rotulos)
+        self.visivel = True
+
+
+class TabelaVirtual(ctk.CTkFrame):
+    """
+    Tabela que cria widgets só para as linhas visíveis e os reaproveita ao
+    rolar; o tempo de abertura não depende do número de registros.
+
+    Os registros são objetos com atributos (ex.: RegistroBOPM). Ao se
+    aproximar do fim, pede a próxima página a carregar_pagina(token,
+    ao_receber, ao_falhar), que deve chamar ao_receber(registros, proximo_token)
+    ou ao_falhar(mensagem) na thread da UI. Clicar no título de uma coluna
+    ordena os registros já carregados (as páginas seguintes entram na ordem).
+    """
+
+    ALTURA_LINHA = 36
+    # Linhas restantes antes do fim que disparam a próxima página
+    MARGEM_CARREGAMENTO = 10
+    PASSO_RODA = 3
+
+    def __init__(self, master, colunas: Sequence[Coluna],
+                 carregar_pagina: Optional[Callable] = None,
+                 acao: Optional[Tuple[str, Callable[[Any], None]]] = None,
+                 ao_atualizar: Optional[Callable[[int, bool], None]] = None, **kwargs):
+        """
+        Args:
+            colunas: Colunas exibidas (atributo do registro, título, largura em px)
+            carregar_pagina: Busca a página seguinte a partir do token de continuação
+            acao: Texto e callback do botão de cada linha (recebe o registro)
+            ao_atualizar: Chamado com (registros carregados, se há mais páginas)
+        """
+        super().__init__(master, fg_color="transparent", **kwargs)
+        self.colunas = list(colunas)
+        self._carregar_pagina = carregar_pagina
+        self._acao = acao
+        self._ao_atualizar = ao_atualizar
+        self._itens: List[Any] = []
+        self._proximo_token: Optional[str] = None
+        self._carregando = False
+        self._inicio = 0
+        self._linhas: List[_LinhaTabela] = []
+        self._ordem: Optional[Tuple[str, bool]] = None
+        self._create_widgets()
+
+    def _create_widgets(self):
+        self.grid_columnconfigure(0, weight=1)
+        self.grid_rowconfigure(1, weight=1)
+
+        cabecalho = ctk.CTkFrame(self, fg_color="#2C3E50")
+        cabecalho.grid(row=0, column=0, columnspan=2, sticky="ew", pady=(0, 5))
+        self._titulos = {}
+        for coluna in self.colunas:
+            botao = ctk.CTkButton(cabecalho, text=coluna.titulo, width=coluna.largura, anchor="w",
+                                  fg_color="transparent", font=("Arial", 12, "bold"),
+                                  command=lambda a=coluna.atributo: self.ordenar(a))
+            botao.pack(side="left", padx=5)
+            self._titulos[coluna.atributo] = botao
+
+        self.corpo = ctk.CTkFrame(self, fg_color="transparent")
+        self.corpo.grid(row=1, column=0, sticky="nsew")
+        self.corpo.grid_columnconfigure(0, weight=1)
+        # O tamanho vem da janela; as linhas se ajustam a ele, nunca o contrário
+        self.corpo.grid_propagate(False)
+        self.corpo.bind("<Configure>", self._ao_redimensionar)
+
+        self.barra = ctk.CTkScrollbar(self, command=self._ao_rolar)
+        self.barra.grid(row=1, column=1, sticky="ns")
+
+        self.lbl_rodape = ctk.CTkLabel(self, text="", font=("Arial", 11), text_color="gray")
+        self.lbl_rodape.grid(row=2, column=0, columnspan=2, sticky="w", padx=5)
+
+        # Mesmo esquema do CTkScrollableFrame: bind global filtrado pelo widget do evento
+        # (widgets do CustomTkinter não permitem bind_all; a janela permite)
+        janela = self._janela_roda = self.winfo_toplevel()
+        self._binds_roda = [
+            (sequencia, janela.bind_all(sequencia, self._ao_rodar, add="+"))
+            for sequencia in ("<MouseWheel>", "<Button-4>", "<Button-5>")
+        ]
+        # Bind direto no widget Tk (o bind do CTkFrame vai para o canvas interno);
+        # <Destroy> dispara também quando a janela é fechada pelo gerenciador de janelas
+        tkinter.Misc.bind(self, "<Destroy>", self._ao_destruir, "+")
+
+    # === DADOS ===
+    def definir_registros(self, registros: Sequence[Any], proximo_token: Optional[str] = None):
+        """Substitui o conteúdo da tabela (primeira página)"""
+        self._itens = list(registros)
+        self._proximo_token = proximo_token
+        self._carregando = False
+        self._inicio = 0
+        self._aplicar_ordem()
+        self._atualizar()
+
+    def adicionar(self, registros: Sequence[Any], proximo_token: Optional[str]):
+        """Acrescenta uma página recebida de carregar_pagina"""
+        self._carregando = False
+        if not self.winfo_exists():
+            return
+        self._proximo_token = proximo_token
+        if registros:
+            self._itens.extend(registros)
+            self._aplicar_ordem()
+        self._atualizar()
+
+    def falhar_carregamento(self, msg: str):
+        """A página não veio; uma nova rolagem tenta outra vez"""
+        self._carregando = False
+        if self.winfo_exists():
+            self.lbl_rodape.configure(text=f"✗ {msg}", text_color="red")
+
+    # === ORDENAÇÃO ===
+    def ordenar(self, atributo: str):
+        """Ordena pela coluna; um segundo clique inverte a ordem"""
+        decrescente = self._ordem == (atributo, False)
+        self._ordem = (atributo, decrescente)
+        for coluna in self.colunas:
+            seta = (" ▼" if decrescente else " ▲") if coluna.atributo == atributo else ""
+            self._titulos[coluna.atributo].configure(text=coluna.titulo + seta)
+        self._aplicar_ordem()
+        self._inicio = 0
+        self._atualizar()
+
+    def _aplicar_ordem(self):
+        if self._ordem is None:
+            return
+        atributo, decrescente = self._ordem
+        self._itens.sort(key=lambda item: _chave_ordenacao(getattr(item, atributo, None)), reverse=decrescente)
+
+    # === RENDERIZAÇÃO ===
+    def _criar_linha(self, posicao: int) -> _LinhaTabela:
+        frame = ctk.CTkFrame(self.corpo, fg_color="#34495E", height=self.ALTURA_LINHA - 4)
+        frame.grid(row=posicao, column=0, sticky="ew", pady=2, padx=5)
+        frame.pack_propagate(False)
+        rotulos = []
+        for coluna in self.colunas:
+            rotulo = ctk.CTkLabel(frame, text="", width=coluna.largura, anchor="w")
+            rotulo.pack(side="left", padx=5)
+            rotulos.append(rotulo)
+        if self._acao:
+            texto, _ = self._acao
+            ctk.CTkButton(frame, text=texto, width=80,
+                          command=lambda p=posicao: self._acionar(p)).pack(side="right", padx=5)
+        return _LinhaTabela(frame, rotulos)
+
+    def _ao_redimensionar(self, event):
+        visiveis = max(1, int(event.height // self._apply_widget_scaling(self.ALTURA_LINHA)))
+        while len(self._linhas) < visiveis:
+            self._linhas.append(self._criar_linha(len(self._linhas)))
+        while len(self._linhas) > visiveis:
+            self._linhas.pop().frame.destroy()
+        self._rolar_para(self._inicio)
+
+    def _rolar_para(self, inicio: int):
+        self._inicio = max(0, min(inicio, len(self._itens) - len(self._linhas)))
+        self._renderizar()
+        self._verificar_carregamento()
+
+    def _renderizar(self):
+        for posicao, linha in enumerate(self._linhas):
+            indice = self._inicio + posicao
+            if indice >= len(self._itens):
+                if linha.visivel:
+                    linha.frame.grid_remove()
+                    linha.visivel = False
+                continue
+            if not linha.visivel:
+                linha.frame.grid()
+                linha.visivel = True
+            item = self._itens[indice]
+            for i, (rotulo, coluna) in enumerate(zip(linha.rotulos, self.colunas)):
+                texto = coluna.formatar(getattr(item, coluna.atributo, None))
+                limite = coluna.largura // 8
+                if len(texto) > limite:
+                    texto = texto[:limite - 3] + "..."
+                if texto != linha.textos[i]:
+                    rotulo.configure(text=texto)
+                    linha.textos[i] = texto
+
+        total = len(self._itens)
+        if total:
+            self.barra.set(self._inicio / total, min(1.0, (self._inicio + len(self._linhas)) / total))
+        else:
+            self.barra.set(0.0, 1.0)
+
+    def _atualizar(self):
+        self._rolar_para(self._inicio)
+        ha_mais = bool(self._proximo_token)
+        rodape = f"{len(self._itens)} registros carregados"
+        if ha_mais:
+            rodape += " (mais ao rolar)"
+            if self._ordem:
+                rodape += " · ordenação aplicada aos já carregados"
+        if not self._carregando:
+            self.lbl_rodape.configure(text=rodape, text_color="gray")
+        if self._ao_atualizar:
+            self._ao_atualizar(len(self._itens), ha_mais)
+
+    def _verificar_carregamento(self):
+        if (self._proximo_token and self._carregar_pagina and not self._carregando
+                and self._inicio + len(self._linhas) >= len(self._itens) - self.MARGEM_CARREGAMENTO):
+            self._carregando = True
+            self.lbl_rodape.configure(text="⏳ Carregando mais...", text_color="gray")
+            self._carregar_pagina(self._proximo_token, self.adicionar, self.falhar_carregamento)
+
+    # === EVENTOS ===
+    def _acionar(self, posicao: int):
+        indice = self._inicio + posicao
+        if self._acao and indice < len(self._itens):
+            self._acao[1](self._itens[indice])
+
+    def _ao_rolar(self, acao, *args):
+        if acao == "moveto":
+            self._rolar_para(round(float(args[0]) * len(self._itens)))
+        elif acao == "scroll":
+            passo = int(float(args[0]))
+            if len(args) > 1 and args[1] == "pages":
+                passo *= len(self._linhas)
+            self._rolar_para(self._inicio + passo)
+
+    def _contem(self, widget) -> bool:
+        while widget is not None:
+            if widget is self:
+                return True
+            widget = widget.master
+        return False
+
+    def _ao_destruir(self, event):
+        if event.widget is not self:
+            return
+        # unbind_all removeria os binds de todos; tira só as linhas com os nossos funcids
+        for sequencia, funcid in self._binds_roda:
+            try:
+                script = self.tk.call("bind", "all", sequencia)
+                restante = "\n".join(linha for linha in script.split("\n") if funcid not in linha)
+                self.tk.call("bind", "all", sequencia, restante)
+                # Pela janela, para o funcid sair também da lista que ela apaga no destroy
+                self._janela_roda.deletecommand(funcid)
+            except tkinter.TclError:
+                pass
+        self._binds_roda = []
+
+    def _ao_rodar(self, event):
+        try:
+            if not self.winfo_exists() or not self._contem(event.widget):
+                return
+        except Exception:
+            # Janela destruída ou widget fora do Tk (ex.: popups nativos)
+            return
+        if event.num == 4 or getattr(event, "delta", 0) > 0:
+            self._rolar_para(self._inicio - self.PASSO_RODA)
+        else:
+            self._rolar_para(self._inicio + self.PASSO_RODA)
+
+
 class SettingsDialog(ctk.CTkToplevel):
     def __init__(self, parent, on_save: Callable):
         super().__init__(parent)
@@ -167,7 +447,11 @@ class SettingsDialog(ctk.CTkToplevel):
         settings.set("appearance", "color_theme", self.color_var.get())
         settings.set("ai", "model", self.model_var.get())
         settings.set("editor", "auto_save", self.auto_save_var.get())
-        settings.set("security", "encrypt_sensitive_data", self.encrypt_var.get())
+        criptografar = self.encrypt_var.get()
+        if criptografar != settings.get("security", "encrypt_sensitive_data", False):
+            # Os documentos existentes são convertidos em segundo plano após reiniciar
+            agendar_recriptografia(criptografar)
+        settings.set("security", "encrypt_sensitive_data", criptografar)
         settings.save_settings()
         
         self.destroy()
@@ -4,6 +4,7 @@ Valida dados antes de processamento e salvamento
 """
 import re
 import logging
+import unicodedata
 from typing import Dict, Tuple
 from config import Config
 
@@ -187,6 +188,25 @@ class BOPMValidator:
         
         return texto.strip()
     
+    @staticmethod
+    def normalizar_para_busca(texto: str) -> str:
+        """
+        Normaliza texto para comparação em buscas: sem acentos,
+        sem diferença de maiúsculas e com espaços colapsados
+        
+        Args:
+            texto: Texto original
+            
+        Returns:
+            Texto normalizado ("Agressão  Física" -> "agressao fisica")
+        """
+        if not texto:
+            return ""
+        
+        decomposto = unicodedata.normalize("NFKD", texto)
+        sem_acentos = "".join(c for c in decomposto if not unicodedata.combining(c))
+        return " ".join(sem_acentos.casefold().split())
+    
     @staticmethod
     def sanitizar_dados(dados: Dict) -> Dict:
         """